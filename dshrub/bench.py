@@ -0,0 +1,491 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Benchmarks of sensor data processing with synthetic sensor data.
+
+Each benchmark returns dictionary with number of processed samples,
+samples per second and latency percentiles in seconds, so results can be
+saved as JSON and compared between releases.
+"""
+
+import asyncio
+import contextlib
+import math
+import json
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+from collections import deque
+
+import numpy as np
+from n23 import Data
+
+from .broadcast import Broadcast
+from .data import Cache, bin_cache, bin_data, cache_data
+from .redis import Config, Format, _pools, publish
+
+# latency percentiles reported by benchmarks
+PERCENTILES = (50, 90, 99)
+
+# modules, which take long to import and are imported on demand only,
+# when a feature using them is enabled
+LAZY_MODULES = (
+    'h5py', 'scipy', 'aioredis', 'tornado', 'tawf', 'dbus', 'gi', 'btzen',
+)
+
+# modules imported on start of the applications and on demand modules
+# they need
+STARTUP = {
+    'dshrub': ('dshrub.core', ()),
+    'dshrub-dashboard': (
+        'dshrub.ws, dshrub.redis, dshrub.shm', ('tornado', 'tawf')
+    ),
+}
+
+STARTUP_CODE = """
+import json, sys, time
+t = time.perf_counter()
+import {}
+t = time.perf_counter() - t
+modules = [m for m in {!r} if m in sys.modules]
+print(json.dumps({{'time': t, 'modules': modules}}))
+"""
+
+
+def generate(n_sensors, rate, duration, start=0):
+    """
+    Generate batches of synthetic sensor data.
+
+    One batch is generated per tick, each batch has one sensor data item
+    per sensor.
+
+    :param n_sensors: Number of sensors.
+    :param rate: Number of ticks per second.
+    :param duration: Duration of sensor data in seconds.
+    :param start: Time of first tick.
+    """
+    names = ['sensor-{}'.format(i) for i in range(n_sensors)]
+    n = int(rate * duration)
+    values = np.sin(np.arange(n) / 60).tolist()
+    return [
+        [Data(s, k, start + k / rate, v + i) for i, s in enumerate(names)]
+        for k, v in enumerate(values)
+    ]
+
+
+def stats(samples, total, latency):
+    """
+    Create benchmark result.
+
+    :param samples: Number of processed samples.
+    :param total: Total processing time in seconds.
+    :param latency: Collection of latencies in seconds.
+    """
+    latency = np.asarray(latency)
+    percentiles = np.percentile(latency, PERCENTILES).tolist() \
+        if len(latency) else [math.nan] * len(PERCENTILES)
+    return {
+        'samples': samples,
+        'samples_per_s': samples / total if total else math.inf,
+        'latency': dict(zip(
+            ('p{}'.format(p) for p in PERCENTILES), percentiles
+        )),
+        'latency_max': float(latency.max()) if len(latency) else math.nan,
+    }
+
+
+def timed(f, items):
+    """
+    Call function for each item and measure time of each call.
+
+    :param f: Function to call.
+    :param items: Function arguments.
+    """
+    timer = time.perf_counter
+    latency = []
+    start = timer()
+    for v in items:
+        t = timer()
+        f(v)
+        latency.append(timer() - t)
+    return timer() - start, latency
+
+
+def bench_cache_add(batches, maxsize):
+    """
+    Benchmark adding sensor data batches to data cache.
+
+    :param batches: Sensor data batches.
+    :param maxsize: Data cache maximum size.
+    """
+    cache = Cache([v.name for v in batches[0]], maxsize)
+    total, latency = timed(cache.add, batches)
+    return stats(len(batches) * len(batches[0]), total, latency)
+
+
+def bench_cache_data(batches, maxsize):
+    """
+    Benchmark caching sensor data received from a coroutine.
+
+    :param batches: Sensor data batches.
+    :param maxsize: Data cache maximum size.
+    """
+    cache = Cache([v.name for v in batches[0]], maxsize)
+    queue = deque(batches)
+    timer = time.perf_counter
+    latency = []
+
+    async def get():
+        if not queue:
+            raise StopAsyncIteration()
+        if latency:
+            latency[-1] = timer() - latency[-1]
+        latency.append(timer())
+        return queue.popleft()
+
+    async def run():
+        try:
+            await cache_data(get, cache)
+        except StopAsyncIteration:
+            latency[-1] = timer() - latency[-1]
+
+    start = timer()
+    run_until_complete(run())
+    total = timer() - start
+    return stats(len(batches) * len(batches[0]), total, latency)
+
+
+def bench_bin_data(batches, maxsize, bins=480, repeat=20):
+    """
+    Benchmark binning of sensor data from data cache, with and without
+    rollups.
+
+    :param batches: Sensor data batches.
+    :param maxsize: Data cache maximum size.
+    :param bins: Number of bins.
+    :param repeat: Number of binning calls.
+    """
+    name = batches[0][0].name
+    cache = Cache([name], maxsize)
+    cache.add([b[0] for b in batches])
+    n = len(cache[name])
+
+    items = range(repeat)
+    total, latency = timed(
+        lambda _: bin_data(cache[name], 'mean', bins), items
+    )
+    raw = stats(n * repeat, total, latency)
+    total, latency = timed(
+        lambda _: bin_cache(cache, name, 'mean', bins), items
+    )
+    rollup = stats(n * repeat, total, latency)
+    return {'raw': raw, 'rollup': rollup}
+
+
+def bench_fan_out(batches, n_clients):
+    """
+    Benchmark fan-out of sensor data batches to SSE clients.
+
+    The latency is time between putting a batch into the broadcaster and
+    receiving it by the last client.
+
+    :param batches: Sensor data batches.
+    :param n_clients: Number of clients.
+    """
+    broadcast = Broadcast(maxsize=len(batches))
+    timer = time.perf_counter
+
+    async def client(queue, received):
+        async for items in queue:
+            received.append(timer())
+
+    async def run():
+        received = [[] for _ in range(n_clients)]
+        with contextlib.ExitStack() as stack:
+            queues = [
+                stack.enter_context(broadcast.subscribe())
+                for _ in range(n_clients)
+            ]
+            tasks = [
+                asyncio.ensure_future(client(q, r))
+                for q, r in zip(queues, received)
+            ]
+            sent = []
+            for items in batches:
+                sent.append(timer())
+                broadcast.put(items)
+                await asyncio.sleep(0)
+            while any(len(r) < len(batches) for r in received):
+                await asyncio.sleep(0)
+            for t in tasks:
+                t.cancel()
+
+        last = np.max(received, axis=0)
+        return last - np.array(sent)
+
+    start = timer()
+    latency = run_until_complete(run())
+    total = timer() - start
+    samples = len(batches) * len(batches[0]) * n_clients
+    return stats(samples, total, latency)
+
+
+def bench_publish(batches, format=Format.JSON):
+    """
+    Benchmark publishing sensor data to Redis channel using local Redis
+    server stand-in.
+
+    The latency is time between receiving a batch from the topic and
+    receiving its last message by the Redis server stand-in. Each batch is
+    published with one message per sensor data item for `Format.JSON`
+    format and with one message otherwise.
+
+    :param batches: Sensor data batches.
+    :param format: Format of published messages.
+    """
+    server = RedisStub()
+    queue = deque(batches)
+    timer = time.perf_counter
+    sent = []
+
+    class Topic:
+        async def get(self):
+            if sent:
+                # let the publisher send the previous batch
+                await asyncio.sleep(0)
+            if not queue:
+                await asyncio.sleep(math.inf)
+            sent.append(timer())
+            return queue.popleft()
+
+    # number of messages per batch
+    k = len(batches[0]) if format == Format.JSON else 1
+    n = len(batches) * k
+
+    async def run():
+        config = await server.start()
+        task = asyncio.ensure_future(
+            publish(Topic(), 'bench', format, config=config)
+        )
+        while len(server.received) < n:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+        pool = _pools.pop(config)
+        pool.close()
+        await pool.wait_closed()
+        await server.stop()
+
+    start = timer()
+    run_until_complete(run())
+    total = timer() - start
+    received = np.array(server.received[k - 1:n:k])
+    return stats(len(batches) * len(batches[0]), total, received - sent)
+
+
+def bench_rss(maxsize, n_sensors):
+    """
+    Measure peak RSS of a process with full data cache.
+
+    The data cache is filled in a separate process. The result is
+    dictionary of RSS of the process before filling the cache and its peak
+    RSS, in kilobytes.
+
+    :param maxsize: Data cache maximum size.
+    :param n_sensors: Number of sensors.
+    """
+    code = 'import dshrub.bench as b; b._fill_cache({}, {})'.format(
+        maxsize, n_sensors
+    )
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return json.loads(output.decode())
+
+
+def bench_startup(apps=STARTUP, repeat=5):
+    """
+    Measure time of importing modules on start of the applications.
+
+    The modules are imported in a new process `repeat` times. The result
+    is dictionary of median import time, in seconds, and list of imported
+    on demand modules, see `LAZY_MODULES`, for each application.
+
+    :param apps: Dictionary of modules imported by the applications.
+    :param repeat: Number of measurements.
+    """
+    result = {}
+    for app, (modules, _) in apps.items():
+        code = STARTUP_CODE.format(modules, LAZY_MODULES)
+        items = [
+            json.loads(subprocess.check_output([sys.executable, '-c', code]))
+            for _ in range(repeat)
+        ]
+        result[app] = {
+            'import_s': float(np.median([v['time'] for v in items])),
+            'modules': items[0]['modules'],
+        }
+    return result
+
+
+def run(n_sensors=5, rate=1, duration=3600 * 24, maxsize=(3600, 3600 * 24),
+        n_clients=100):
+    """
+    Run all benchmarks and return dictionary of results.
+
+    :param n_sensors: Number of sensors.
+    :param rate: Number of ticks per second.
+    :param duration: Duration of sensor data in seconds.
+    :param maxsize: Collection of data cache maximum sizes.
+    :param n_clients: Number of SSE clients.
+    """
+    batches = generate(n_sensors, rate, duration)
+    short = batches[:1000]
+    size = max(maxsize)
+    return {
+        'meta': {
+            'time': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sensors': n_sensors,
+            'rate': rate,
+            'duration': duration,
+        },
+        'cache_add': bench_cache_add(batches, size),
+        'cache_data': bench_cache_data(batches, size),
+        'bin_data': bench_bin_data(batches, size),
+        'fan_out': bench_fan_out(short, n_clients),
+        'publish': {
+            f.value: bench_publish(short, f) for f in Format
+        },
+        'rss': {str(n): bench_rss(n, n_sensors) for n in maxsize},
+        'startup': bench_startup(),
+    }
+
+
+class RedisStub(object):
+    """
+    Local Redis server stand-in.
+
+    The server records received commands and time of each `PUBLISH`
+    command. The commands are answered with `reply` method, which can be
+    overridden to simulate other commands.
+
+    The server port is reserved on creation, so Redis connection
+    configuration is known before the server is started.
+    """
+    def __init__(self):
+        super().__init__()
+        self.commands = []
+        self.received = []
+        self._server = None
+
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        self.config = Config('127.0.0.1', port)
+
+
+    async def start(self):
+        """
+        Start server and return its Redis connection configuration.
+        """
+        self._server = await asyncio.start_server(
+            self._handle, self.config.host, self.config.port
+        )
+        return self.config
+
+
+    async def stop(self):
+        """
+        Stop server.
+        """
+        self._server.close()
+        await self._server.wait_closed()
+
+
+    async def reply(self, args):
+        """
+        Create reply to Redis command.
+
+        `PUBLISH` and `PING` commands receive their usual replies, other
+        commands are acknowledged. If `None` is returned, then client
+        connection is closed.
+
+        :param args: Redis command and its arguments.
+        """
+        if args[0] == b'PUBLISH':
+            return b':1\r\n'
+        elif args[0] == b'PING':
+            return b'+PONG\r\n'
+        else:
+            return b'+OK\r\n'
+
+
+    async def _handle(self, reader, writer):
+        timer = time.perf_counter
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            args = []
+            for i in range(int(line[1:])):
+                size = int((await reader.readline())[1:])
+                args.append((await reader.readexactly(size + 2))[:-2])
+
+            if args[0] == b'PUBLISH':
+                self.received.append(timer())
+            self.commands.append(args)
+            data = await self.reply(args)
+            if data is None:
+                break
+            writer.write(data)
+        writer.close()
+
+
+def run_until_complete(coro):
+    """
+    Run coroutine in a new event loop.
+
+    :param coro: Coroutine to run.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def _fill_cache(maxsize, n_sensors):
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cache = Cache(['sensor-{}'.format(i) for i in range(n_sensors)], maxsize)
+    times = np.arange(maxsize, dtype=np.float64)
+    for i in range(n_sensors):
+        cache.extend('sensor-{}'.format(i), times, np.sin(times))
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'base': base, 'peak': peak}))
+
+
+# vim: sw=4:et:ai
@@ -0,0 +1,189 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Fan-out of sensor data to multiple clients, i.e. dashboard viewers.
+
+Sensor data is read from its source once and each batch of sensor data is
+copied to bounded queue of every subscriber.
+"""
+
+import asyncio
+import enum
+import logging
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# maximum number of sensor data batches queued per subscriber
+N_QUEUE = 60
+
+
+class Overflow(enum.Enum):
+    """
+    Policy applied when queue of a subscriber is full.
+
+    :var DROP: Drop the oldest batch of sensor data.
+    :var LATEST: Drop all queued batches and keep the latest one only.
+    :var DISCONNECT: Disconnect the subscriber.
+    """
+    DROP = 'drop'
+    LATEST = 'latest'
+    DISCONNECT = 'disconnect'
+
+
+class Subscriber(object):
+    """
+    Bounded queue of sensor data batches of a subscriber.
+
+    It is asynchronous iterator. The iteration stops when the subscriber
+    is disconnected due to queue overflow.
+    """
+    def __init__(self, maxsize, overflow):
+        """
+        Create subscriber queue.
+
+        :param maxsize: Maximum number of queued sensor data batches.
+        :param overflow: Queue overflow policy.
+        """
+        super().__init__()
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.closed = False
+
+        self._items = deque()
+        self._event = asyncio.Event()
+
+
+    def put(self, items):
+        """
+        Put batch of sensor data into the queue.
+
+        :param items: Batch of sensor data.
+        """
+        if self.closed:
+            return
+
+        queue = self._items
+        if len(queue) >= self.maxsize:
+            if self.overflow == Overflow.DROP:
+                self.dropped += len(queue.popleft())
+            elif self.overflow == Overflow.LATEST:
+                self.dropped += sum(len(v) for v in queue)
+                queue.clear()
+            else:
+                self.closed = True
+                logger.info('disconnecting subscriber due to queue overflow')
+
+        if not self.closed:
+            queue.append(items)
+        self._event.set()
+
+
+    async def get(self):
+        """
+        Get batch of sensor data from the queue.
+
+        `None` is returned if the subscriber is disconnected.
+        """
+        while not self._items and not self.closed:
+            self._event.clear()
+            await self._event.wait()
+        return None if self.closed else self._items.popleft()
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        items = await self.get()
+        if items is None:
+            raise StopAsyncIteration()
+        return items
+
+
+class Broadcast(object):
+    """
+    Fan-out batches of sensor data to subscribers.
+
+    Number of sensor data items dropped for removed subscribers and number
+    of subscribers disconnected due to queue overflow are kept in
+    `dropped` and `disconnected` attributes.
+    """
+    def __init__(self, maxsize=N_QUEUE, overflow=Overflow.DROP):
+        """
+        Create sensor data broadcaster.
+
+        :param maxsize: Maximum number of sensor data batches queued per
+            subscriber.
+        :param overflow: Subscriber queue overflow policy.
+        """
+        super().__init__()
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.subscribers = set()
+
+        # statistics of removed subscribers
+        self.dropped = 0
+        self.disconnected = 0
+
+
+    def put(self, items):
+        """
+        Copy batch of sensor data to all subscribers.
+
+        :param items: Batch of sensor data.
+        """
+        for s in self.subscribers:
+            s.put(items)
+
+
+    @contextmanager
+    def subscribe(self):
+        """
+        Create context manager returning new subscriber queue.
+
+        The subscriber is removed from the broadcaster on exit.
+        """
+        s = Subscriber(self.maxsize, self.overflow)
+        self.subscribers.add(s)
+        try:
+            yield s
+        finally:
+            self.subscribers.discard(s)
+            self.dropped += s.dropped
+            self.disconnected += s.closed
+
+
+    async def run(self, callable):
+        """
+        Receive sensor data batches from coroutine and copy them to all
+        subscribers.
+
+        :param callable: Coroutine to receive sensor data batch.
+        """
+        while True:
+            items = await callable()
+            self.put(items)
+
+
+# vim: sw=4:et:ai
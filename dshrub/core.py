@@ -18,38 +18,112 @@
 #
 
 import asyncio
-import functools
-import h5py
+import glob
 import logging
-import operator
+import os.path
 import signal
 import sys
 from contextlib import contextmanager
 
 import n23
 
-from . import ws
-from .data import Cache, cache_data, replay_file
-from .redis import publish
+from .broadcast import Broadcast, Overflow
+from .data import Batch, Cache, cache_data, preload_data
+from .derive import Derive, derived_channel, sensor_inputs, \
+    sensor_intervals
+from .device import Device, qualify, sensor_name
+from .dlog import DataLog, N_CHUNK
+from .history import Archive
+from .metrics import Metrics, TopicProbe, timed, timed_async
+from .redis import Config, Format, publish
+from .replay import Replay, replay_files
+from .sampler import Sampler, batch_size
+from .shm import MappedCache, sync
+from .stats import Stats
 
 logger = logging.getLogger(__name__)
 
-def start(device, sensors, dashboard=None, data_dir=None, rotate=None,
-        channel=None, replay=None):
+# shape of sensor data values, scalar if not specified
+SHAPE = {
+    'accelerometer': (3,),
+}
+
+def start(devices, sensors, dashboard=None, data_dir=None, rotate=None,
+        channel=None, channel_format=Format.JSON, channel_size=None,
+        channel_delay=None, redis=Config(), dlog_chunk=N_CHUNK,
+        dlog_compression=None, dlog_shuffle=False, replay=None,
+        replay_speed=1, overflow=Overflow.DROP, metrics_port=None,
+        intervals=None, channel_stream=None, cache_file=None,
+        stats_windows=None):
 
     dbus_loop = None
+    dbus_bus = None
     topic = n23.Topic()
+    metrics = Metrics()
+
+    # sensors and derived channels of all devices
+    qualified = [qualify(s, d) for d, _ in devices for s in sensors]
+    inputs = sensor_inputs(qualified)
+    intervals = device_intervals(inputs, intervals or {})
+
+    # dashboard and rolling statistics use sensor data with scalar values
+    # only
+    names = [s for s in qualified if not SHAPE.get(sensor_name(s))]
+
+    stats = None
+    if stats_windows:
+        stats = Stats(None, names, stats_windows)
 
     if dashboard:
-        cache = Cache(sensors)
-        # read_data(preload_file, sensors, N_DATA, cache)
-        ws.create_app(sensors, topic, cache, dashboard)
+        from . import ws
+
+        cache_intervals = sensor_intervals(names, intervals)
+        if cache_file:
+            cache = MappedCache(cache_file, names, intervals=cache_intervals)
+            asyncio.ensure_future(sync(cache))
+        else:
+            cache = Cache(names, intervals=cache_intervals)
+        broadcast = Broadcast(overflow=overflow)
+
+        # data log files are indexed by the data acquisition workflow
+        archive = None
+        if data_dir:
+            archive = Archive(data_dir)
+
+        ws.create_app(
+            names, broadcast, cache, dashboard, archive=archive,
+            metrics=metrics, stats=stats
+        )
+        for n in names:
+            buffer = cache[n]
+            metrics.gauge(
+                'cache_fill', lambda b=buffer: len(b) / b.maxsize, label=n
+            )
+        metrics.gauge('sse_clients', lambda: len(broadcast.subscribers))
+        metrics.gauge('sse_dropped', lambda: broadcast.dropped + sum(
+            s.dropped for s in broadcast.subscribers
+        ))
+        metrics.gauge('sse_disconnected', lambda: broadcast.disconnected)
+
+        # warm start of the cache; find data log files before new data log
+        # file is created, the files are opened in a separate thread;
+        # derived sensor data is not saved in data log files
+        if data_dir:
+            files = glob.glob(os.path.join(data_dir, 'dshrub*'))
+            logged = [n for n in names if n in inputs]
+            asyncio.ensure_future(preload_data(cache, files, logged))
     else:
         cache = None
+        broadcast = None
+        archive = None
+        if metrics_port:
+            from . import ws
+            ws.create_metrics_app(metrics, port=metrics_port, stats=stats)
 
+    readers = None
     if replay:
-        logger.info('replaying a data file {}'.format(replay))
-        replay = h5py.File(replay)
+        logger.info('replaying data from {}'.format(replay))
+        replay = Replay(replay_files(replay), inputs, replay_speed)
     else:
         import dbus
         import threading
@@ -61,13 +135,36 @@ def start(device, sensors, dashboard=None, data_dir=None, rotate=None,
         thread = threading.Thread(target=dbus_main_loop.run, daemon=True)
         thread.start()
 
+        # devices are connected once and reconnected independently of
+        # data log file rotation
+        readers = []
+        for name, address in devices:
+            own = {
+                sensor_name(s): v for s, v in intervals.items()
+                if qualify(sensor_name(s), name) == s
+            }
+            device = Device(
+                dbus_bus, address, name, sensor_inputs(sensors), own
+            )
+            asyncio.ensure_future(device.run())
+            metrics.gauge(
+                'device_connected', lambda d=device: d.connected,
+                label=address
+            )
+            readers.extend(device.readers())
+
     files = None
     if data_dir:
         files = n23.dlog_filename('dshrub', data_dir)
 
     w = n23.cycle(
-        rotate, workflow, topic, device, sensors, files=files,
-        channel=channel, replay=replay, cache=cache, dbus_bus=dbus_bus
+        rotate, workflow, topic, readers, qualified, files=files,
+        channel=channel, channel_format=channel_format,
+        channel_size=channel_size, channel_delay=channel_delay,
+        channel_stream=channel_stream, redis=redis, dlog_chunk=dlog_chunk,
+        dlog_compression=dlog_compression, dlog_shuffle=dlog_shuffle,
+        replay=replay, cache=cache, broadcast=broadcast, archive=archive,
+        metrics=metrics, intervals=intervals, stats=stats
     )
     loop = asyncio.get_event_loop()
     loop.add_signal_handler(signal.SIGTERM, sys.exit)
@@ -76,84 +173,175 @@ def start(device, sensors, dashboard=None, data_dir=None, rotate=None,
     finally:
         loop.remove_signal_handler(signal.SIGTERM)
         w.close()
+        if cache_file and cache:
+            cache.close()
 
 
 @contextmanager
-def workflow(topic, device, sensors, files=None, channel=None,
-        replay=None, cache=None, dbus_bus=None):
+def workflow(topic, readers, sensors, files=None, channel=None,
+        channel_format=Format.JSON, channel_size=None, channel_delay=None,
+        channel_stream=None, redis=Config(), dlog_chunk=N_CHUNK,
+        dlog_compression=None, dlog_shuffle=False, replay=None, cache=None,
+        broadcast=None, archive=None, metrics=None, intervals=None,
+        stats=None):
 
+    # scheduler interval; sensors with other sampling interval are read by
+    # samplers
     interval = 1
-    scheduler = n23.Scheduler(interval)
+    intervals = {
+        n: v for n, v in (intervals or {}).items() if v != interval
+    }
+    observers = []
+    samplers = []
 
     dlog = None
     if files:
-        fout = h5py.File(next(files), 'w')
-        dlog = n23.DLog(fout, interval, n_chunk=60, debug=True)
-        scheduler.debug = dlog
-        scheduler.add_observer(dlog.notify)
+        dlog = DataLog(
+            next(files), interval, n_chunk=dlog_chunk,
+            compression=dlog_compression, shuffle=dlog_shuffle
+        )
+        if metrics:
+            metrics.gauge('dlog_queued', lambda: dlog.queued)
+            metrics.gauge('dlog_flush_time', lambda: dlog.flush_time)
+            metrics.gauge('dlog_flush_count', lambda: dlog.flush_count)
+            metrics.gauge('dlog_flush_mean', lambda: dlog.flush_total
+                / dlog.flush_count if dlog.flush_count else None)
+
+    if metrics:
+        topic = TopicProbe(topic, metrics)
+
+    # raw sensor data is sent to the topic for requested sensors only,
+    # derived sensor data is calculated once per scheduler tick
+    channels = [c for c in map(derived_channel, sensors) if c]
+    inputs = sensor_inputs(sensors)
+    def put(item):
+        topic.put_nowait(item)
+        if stats:
+            stats.put(item)
+
+    stage = Derive(put, channels, raw=set(sensors))
+    tick = stage.notify
+    if metrics:
+        tick = timed(tick, metrics.histogram('derive_time'))
+    observers.append(tick)
+
+    # rolling statistics are sent to the topic and saved in data log as
+    # separate sensor data series; the statistics are sent every
+    # `stats.period` scheduler ticks, so only every `stats.period` row of
+    # their data log datasets has values, other rows are NaN, which is
+    # stored efficiently with data log compression
+    if stats:
+        def emit(item):
+            topic.put_nowait(item)
+            if dlog:
+                dlog.put(item)
+
+        stats.consumer = emit
+        observers.append(stats.notify)
 
-    items = sensor_replay(replay, sensors) if replay \
-        else sensor_tag(dbus_bus, device, sensors)
+    # data log moves to the next row once sensor data and statistics of
+    # the scheduler tick are stored
+    if dlog:
+        observers.append(dlog.notify)
 
-    for name, read in items:
+    if dlog:
+        for name in inputs:
+            v = intervals.get(name, interval)
+            size = batch_size(v, interval) if v < interval else None
+            shape = SHAPE.get(sensor_name(name), ())
+            dlog.add(name, shape=shape, size=size)
+        if stats:
+            for name in stats.names():
+                dlog.add(name)
+
+    samples = {}
+    if metrics:
+        samples = {n: metrics.counter('samples', n) for n in inputs}
+
+    def consume(item):
+        # sensor of disconnected device
+        if item.value is None:
+            return
+        if item.name in samples:
+            n = len(item.time) if isinstance(item, Batch) else 1
+            samples[item.name].inc(n)
+        stage.put(item)
         if dlog:
-            shape = ()
-            if name == 'accelerometer':
-                shape += (3,)
-            dlog.add(name, shape=shape)
-
-        @n23.coroutine
-        def calc(callback):
-            import math
-            while True:
-                item = yield
-                value = math.sqrt(sum(v ** 2 for v in item.value))
-                item = item._replace(value=value)
-                callback(item)
-        pt = calc(topic.put_nowait) if name == 'accelerometer' else topic.put_nowait
-        consume = n23.split(pt, dlog)
-        scheduler.add(name, read, consume)
-
-    tasks = [scheduler]
+            dlog.put(item)
+
+    scheduler = None
+    if replay:
+        def notify():
+            for f in observers:
+                f()
+        tasks = [replay.run(consume, notify)]
+    else:
+        scheduler = n23.Scheduler(interval)
+        for name, read in readers:
+            if metrics:
+                read = timed_async(read, metrics.histogram('read_time', name))
+            if name in intervals:
+                s = Sampler(name, read, intervals[name], consume, interval)
+                samplers.append(s)
+            else:
+                scheduler.add(name, read, consume)
+
+        # samplers send sensor data before data log and derived sensor
+        # data stages process the scheduler tick
+        for f in [s.notify for s in samplers] + observers:
+            scheduler.add_observer(f)
+        tasks = [scheduler] + [s.run() for s in samplers]
+
+    def reader(label):
+        return topic.reader(label) if metrics else topic
+
     if channel:
-        p = publish(topic, channel)
+        p = publish(
+            reader('redis'), channel, channel_format, channel_size,
+            channel_delay, redis, metrics=metrics, stream_size=channel_stream
+        )
         tasks.append(p)
         logger.info('publish data to redis channel {}'.format(channel))
 
     if cache:
-        t = cache_data(topic.get, cache)
+        t = cache_data(reader('cache').get, cache)
         tasks.append(t)
 
+    if broadcast:
+        t = broadcast.run(reader('broadcast').get)
+        tasks.append(t)
+
+    # index data log files finished since previous rotation in a separate
+    # thread
+    if archive:
+        loop = asyncio.get_event_loop()
+        tasks.append(loop.run_in_executor(None, archive.update))
+
     try:
         yield asyncio.gather(*tasks)
     finally:
-        scheduler.close()
-        dlog.close()
-        fout.close()
-
-
-def sensor_replay(fin, sensors):
-    reader = functools.partial(replay_file, fin)
-    items = ((s, reader(s)) for s in sensors)
-    return items
+        if scheduler:
+            scheduler.close()
+        if dlog:
+            dlog.close()
 
 
-def sensor_tag(bus, device, sensors):
-    import btzen
+def device_intervals(names, intervals):
+    """
+    Get sampling intervals of device-qualified sensors.
 
-    dev = btzen.connect(bus, device)
-    logger.info('connected to sensor {}'.format(device))
+    Sampling interval can be specified for a sensor of a device, i.e.
+    `kitchen.light`, or for a sensor of all devices, i.e. `light`.
 
-    readers = {
-        'temperature': btzen.Temperature,
-        'pressure': btzen.Pressure,
-        'humidity': btzen.Humidity,
-        'light': btzen.Light,
-        'accelerometer': btzen.Accelerometer,
-    }
-    items = [(n, cls(bus, dev)) for n, cls in readers.items() if n in sensors]
-    for n, s in items:
-        s.set_interval(1)
-    return ((n, s.read_async) for n, s in items)
+    :param names: Device-qualified sensor names.
+    :param intervals: Dictionary of sampling intervals.
+    """
+    result = {}
+    for n in names:
+        for k in (n, sensor_name(n)):
+            if k in intervals:
+                result[n] = intervals[k]
+                break
+    return result
 
 # vim: sw=4:et:ai
@@ -23,32 +23,320 @@ Sensor data processing functions.
 
 import asyncio
 import functools
-import h5py
-import itertools
+import glob
+import logging
 import math
+import numpy as np
+import os.path
+import time
 
-from collections import deque
+from collections import deque, namedtuple
 from n23 import Data
-from scipy.stats import binned_statistic
+
+logger = logging.getLogger(__name__)
 
 # how much data items to keep in memory per sensor, default 24h of data
 N_DATA = 3600 * 24
 
+# width of rollup buckets in seconds, finest first
+LEVELS = (10, 60, 300)
+
+# aggregation functions supported when binning sensor data; `lttb` and
+# `minmax` select sensor data values, see `lttb` and `minmax` functions
+AGG = ('mean', 'min', 'max', 'median', 'count', 'lttb', 'minmax')
+
+# aggregation functions supported by rollups
+ROLLUP_AGG = {'mean', 'min', 'max', 'count'}
+
+
+Batch = namedtuple('Batch', ['name', 'clock', 'time', 'value'])
+Batch.__doc__ = """
+Batch of sensor data values of a sensor read within one scheduler tick.
+
+Sensor data of sensors read at high rate is processed in batches instead
+of one `n23.core.Data` item per value.
+
+:var name: Sensor name.
+:var clock: Scheduler tick number.
+:var time: Array of sensor data times.
+:var value: Array of sensor data values.
+"""
+
 def bin_data(data, agg, bins):
     """
     Bin sensor data and use `agg` function to aggregate values within one
     bin.
 
-    Sensor data values is a list of (time, value) pairs.
+    Sensor data values is a list of (time, value) pairs or a ring buffer.
 
-    :param data: List of sensor data values.
+    :param data: List of sensor data values or ring buffer.
     :param agg: Name of aggregation function, i.e. `mean'.
     :param bins: Numbers of bins.
     """
-    times, values = zip(*data)
-    values, times, *_ = binned_statistic(times, values, agg, bins=bins)
-    data = [[t, v] for t, v in zip(times, values) if not math.isnan(v)]
-    return data
+    if isinstance(data, RingBuffer):
+        times, values = data.data()
+    elif data:
+        times, values = zip(*data)
+    else:
+        times = values = ()
+
+    return _pairs(*_bin_arrays(times, values, agg, bins))
+
+
+def bin_cache(cache, name, agg, bins, start=None, end=None):
+    """
+    Bin sensor data from data cache and use `agg` function to aggregate
+    values within one bin.
+
+    The result has the same format as result of `bin_data` function, see
+    also `bin_cache_columns` function.
+
+    :param cache: Sensor data cache.
+    :param name: Sensor name.
+    :param agg: Name of aggregation function, i.e. `mean'.
+    :param bins: Numbers of bins.
+    :param start: Start of time range (inclusive), if any.
+    :param end: End of time range (inclusive), if any.
+    """
+    return _pairs(*bin_cache_columns(cache, name, agg, bins, start, end))
+
+
+def bin_cache_columns(cache, name, agg, bins, start=None, end=None):
+    """
+    Bin sensor data from data cache and use `agg` function to aggregate
+    values within one bin.
+
+    Pair of arrays `(times, values)` of binned sensor data is returned.
+
+    The coarsest rollup of sensor data, which still provides at least
+    `bins` buckets for the requested time range, is used. If there is no
+    such rollup or the aggregation function is not supported by rollups,
+    then the sensor data values are binned.
+
+    :param cache: Sensor data cache.
+    :param name: Sensor name.
+    :param agg: Name of aggregation function, i.e. `mean'.
+    :param bins: Numbers of bins.
+    :param start: Start of time range (inclusive), if any.
+    :param end: End of time range (inclusive), if any.
+    """
+    start = -math.inf if start is None else start
+    end = math.inf if end is None else end
+
+    level = _rollup(cache, name, agg, bins, start, end)
+    if level is not None:
+        # rollup buckets are aligned to their width, so the oldest bucket
+        # can start before the oldest sensor data value in the cache
+        first, last = _time_range(cache[name])
+        start, end = max(start, first), min(end, last)
+        return level.bin_columns(agg, bins, start, end)
+
+    times, values = cache[name].select(start, end)
+    return _bin_arrays(times, values, agg, bins)
+
+
+def bin_cache_grid(cache, names, agg, bins, start=None, end=None):
+    """
+    Bin sensor data of multiple sensors from data cache on one grid of
+    bins and use `agg` function to aggregate values within one bin.
+
+    The grid spans the requested time range limited to time range of
+    sensor data of all the sensors, so binned sensor data of the sensors
+    is aligned in time. Rollups of sensor data are used as with
+    `bin_cache_columns` function.
+
+    Pair `(times, values)` is returned, where `times` is array of start
+    times of the bins and `values` is dictionary of arrays of binned
+    sensor data values of each sensor. Value of a bin without sensor data
+    values is `nan`, or zero for `count` aggregation function.
+
+    :param cache: Sensor data cache.
+    :param names: Sensor names.
+    :param agg: Name of aggregation function, one of `mean`, `min`,
+        `max`, `median` or `count`.
+    :param bins: Numbers of bins.
+    :param start: Start of time range (inclusive), if any.
+    :param end: End of time range (inclusive), if any.
+    """
+    start = -math.inf if start is None else start
+    end = math.inf if end is None else end
+
+    ranges = [_time_range(cache[n]) for n in names]
+    ranges = [r for r in ranges if r is not None]
+    if ranges:
+        start = max(start, min(r[0] for r in ranges))
+        end = min(end, max(r[1] for r in ranges))
+    if not ranges or start > end:
+        return np.empty(0), {n: np.empty(0) for n in names}
+
+    # widen time range of single sensor data value
+    end = start + 1 if start == end else end
+
+    edges = np.linspace(start, end, bins + 1)
+    values = {n: _bin_grid(cache, n, agg, edges) for n in names}
+    return edges[:-1], values
+
+
+def _bin_grid(cache, name, agg, edges):
+    start, end = edges[0], edges[-1]
+    bins = len(edges) - 1
+
+    level = _rollup(cache, name, agg, bins, start, end)
+    if level is not None:
+        values = level.bin_grid(agg, edges)
+    else:
+        times, values = cache[name].select(start, end)
+        if len(times):
+            values, *_ = _binned_statistic(times, values, agg, bins=edges)
+        else:
+            values = None
+
+    if values is None:
+        values = np.zeros(bins) if agg == 'count' else np.full(bins, np.nan)
+    return values
+
+
+def _rollup(cache, name, agg, bins, start, end):
+    # the coarsest rollup, which provides at least `bins` buckets for the
+    # time range of sensor data
+    time_range = _time_range(cache[name])
+    if agg not in ROLLUP_AGG or time_range is None:
+        return None
+
+    start = max(start, time_range[0])
+    end = min(end, time_range[1])
+    levels = (
+        r for r in reversed(cache.levels(name))
+        if r.step * bins <= end - start and r.start <= start
+    )
+    return next(levels, None)
+
+
+def _time_range(data):
+    segments = data.segments()
+    if segments:
+        return segments[0][0][0], segments[-1][0][-1]
+    else:
+        return None
+
+
+def lttb(times, values, n):
+    """
+    Downsample sensor data with Largest-Triangle-Three-Buckets algorithm.
+
+    The first and the last sensor data values are kept, and one value is
+    selected from each of `n - 2` buckets of equal number of values - the
+    one forming the largest triangle with the average value of previous
+    and next buckets. Using the average of previous bucket, instead of
+    value selected from the bucket, allows to select values from all
+    buckets at once.
+
+    If `n` is less than three, then only the first value or the first and
+    the last values are selected.
+
+    Pair of arrays `(times, values)` of selected sensor data values is
+    returned.
+
+    :param times: Array of sensor data times.
+    :param values: Array of sensor data values.
+    :param n: Number of sensor data values to select.
+    """
+    times, values = _valid(times, values)
+    size = len(times)
+    if n >= size:
+        return times, values
+    elif n < 3:
+        idx = [0, size - 1][:max(n, 0)]
+        return times[idx], values[idx]
+
+    # buckets of values between the first and the last value
+    edges = np.linspace(1, size - 1, n - 1).astype(int)
+    starts = edges[:-1]
+    counts = np.diff(edges)
+    mean_t = np.add.reduceat(times[:-1], starts) / counts
+    mean_v = np.add.reduceat(values[:-1], starts) / counts
+
+    prev_t = np.r_[times[0], mean_t[:-1]]
+    prev_v = np.r_[values[0], mean_v[:-1]]
+    next_t = np.r_[mean_t[1:], times[-1]]
+    next_v = np.r_[mean_v[1:], values[-1]]
+
+    bucket = np.repeat(np.arange(n - 2), counts)
+    t, v = times[1:-1], values[1:-1]
+    pt, pv = prev_t[bucket], prev_v[bucket]
+    area = np.abs(
+        (pt - next_t[bucket]) * (v - pv) - (pt - t) * (next_v[bucket] - pv)
+    )
+    idx = _argreduce(area, starts - 1, np.maximum) + 1
+    idx = np.r_[0, idx, size - 1]
+    return times[idx], values[idx]
+
+
+def minmax(times, values, bins):
+    """
+    Downsample sensor data to envelope of minimum and maximum values.
+
+    Sensor data values are split into `bins` buckets of equal number of
+    values and the minimum and maximum values are selected from each
+    bucket, so spikes of sensor data are kept.
+
+    Pair of arrays `(times, values)` of selected sensor data values is
+    returned.
+
+    :param times: Array of sensor data times.
+    :param values: Array of sensor data values.
+    :param bins: Number of buckets.
+    """
+    times, values = _valid(times, values)
+    size = len(times)
+    if 2 * bins >= size:
+        return times, values
+
+    starts = np.linspace(0, size, bins + 1).astype(int)[:-1]
+    idx = np.union1d(
+        _argreduce(values, starts, np.minimum),
+        _argreduce(values, starts, np.maximum),
+    )
+    return times[idx], values[idx]
+
+
+def _valid(times, values):
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    return times[valid], values[valid]
+
+
+def _argreduce(values, starts, ufunc):
+    # index of first extreme value of each segment starting at `starts`
+    best = ufunc.reduceat(values, starts)
+    counts = np.diff(np.r_[starts, len(values)])
+    segment = np.repeat(np.arange(len(starts)), counts)
+    idx = np.flatnonzero(values == best[segment])
+    _, first = np.unique(segment[idx], return_index=True)
+    return idx[first]
+
+
+def _bin_arrays(times, values, agg, bins):
+    if len(times) == 0:
+        return _valid((), ())
+    elif agg == 'lttb':
+        return lttb(times, values, bins)
+    elif agg == 'minmax':
+        return minmax(times, values, bins)
+
+    values, edges, _ = _binned_statistic(times, values, agg, bins=bins)
+    return _valid(edges[:-1], values)
+
+
+def _pairs(times, values):
+    return np.column_stack((times, values)).tolist()
+
+
+def _binned_statistic(*args, **kw):
+    # scipy takes long to import, so import it on first use
+    from scipy.stats import binned_statistic
+    return binned_statistic(*args, **kw)
 
 
 async def cache_data(callable, cache):
@@ -63,27 +351,140 @@ async def cache_data(callable, cache):
         cache.add(item)
 
 
-def replay_file(f, sensor):
+async def preload_data(cache, files, sensors, n=None):
+    """
+    Load the last sensor data values from data log files into data cache.
+
+    The data log files are ordered by their start time and read in a
+    separate thread, so sensor data acquisition is not delayed. Data log
+    files older than time window of the cache are not read.
+
+    :param cache: Sensor data cache.
+    :param files: List of data log files.
+    :param sensors: List of sensors saved in data log files.
+    :param n: Maximum number of values to load per sensor, size of the
+        sensor data buffer of a sensor by default.
     """
-    Return sensor data reader function getting data from HDF file.
+    if n is None:
+        n = {s: cache[s].maxsize for s in sensors}
+    since = time.time() - cache.maxsize
+    loop = asyncio.get_event_loop()
+    data = await loop.run_in_executor(
+        None, lambda: read_data(sort_dlog_files(files), sensors, n, since)
+    )
+    for name, (times, values) in data.items():
+        cache.preload(name, times, values)
+    logger.info('preloaded data from {} files'.format(len(files)))
+
+
+def dlog_files(path, prefix='dshrub'):
+    """
+    Get list of data log files ordered by their start time.
 
-    :param f: HDF file object.
-    :param sensor: Sensor name.
+    :param path: Directory with data log files.
+    :param prefix: Prefix of data log file names.
     """
-    data = itertools.cycle(f[sensor])
-    return lambda: float(next(data))
+    files = glob.glob(os.path.join(path, prefix + '*'))
+    return sort_dlog_files(files)
 
 
-def read_data(fn, sensors, n, data):
-    f = h5py.File(fn)
-    start = f.attrs.start
-    for name in sensors:
-        ds = f[name][-n:]
-        data[name].extend(
-            [start + t, float(v)] for t, v in enumerate(ds)
-            if not math.isnan(v)
-        )
-    f.close()
+def sort_dlog_files(files):
+    """
+    Sort data log files by their start time.
+
+    Files, which are not HDF5 files, are skipped.
+
+    :param files: List of data log files.
+    """
+    import h5py
+
+    files = [fn for fn in files if h5py.is_hdf5(fn)]
+
+    def start(fn):
+        with h5py.File(fn, 'r') as f:
+            return f.attrs['start']
+
+    return sorted(files, key=start)
+
+
+def read_data(files, sensors, n, since=None):
+    """
+    Read the last sensor data values from data log files.
+
+    The data log files are read from the newest one until the maximum
+    number of values is read for each sensor or until a data log file
+    started before `since` time is read. Sensor data values are read as array slices and
+    missing values are dropped after reading, so less than `n` values
+    might be returned.
+
+    Sensor data of sensors read in batches is stored with sensor data
+    times, see `dshrub.dlog.DataLog.add` method, and it is flattened.
+
+    Dictionary of `(times, values)` pairs of arrays is returned for each
+    sensor found in the data log files.
+
+    :param files: List of data log files ordered by start time.
+    :param sensors: List of sensors.
+    :param n: Maximum number of values to read per sensor or dictionary
+        of maximum number of values of each sensor.
+    :param since: Time of the oldest sensor data value to read.
+    """
+    import h5py
+
+    limit = n if isinstance(n, dict) else dict.fromkeys(sensors, n)
+    parts = {s: [] for s in sensors}
+    size = dict.fromkeys(sensors, 0)
+    for fn in reversed(files):
+        names = [s for s in sensors if size[s] < limit[s]]
+        if not names:
+            break
+
+        start = None
+        try:
+            with h5py.File(fn, 'r') as f:
+                start = f.attrs['start']
+                interval = f.attrs.get('interval', 1)
+                for s in (s for s in names if s in f):
+                    ds = f[s]
+                    batch = s + '_time' in f
+                    # number of rows to read
+                    rows = limit[s] - size[s]
+                    if batch:
+                        rows = math.ceil(rows / ds.shape[1])
+                    k = len(ds) - min(rows, len(ds))
+                    values = ds[k:]
+                    if batch:
+                        times = f[s + '_time'][k:].ravel()
+                        values = values.ravel()
+                    else:
+                        times = start + interval * np.arange(k, len(ds))
+                    idx = ~np.isnan(values)
+                    parts[s].append((times[idx], values[idx]))
+                    size[s] += len(values)
+        except (OSError, KeyError) as ex:
+            logger.warning('cannot read data file {}: {}'.format(fn, ex))
+
+        # older data log files have sensor data older than `since` only
+        if since is not None and start is not None and start <= since:
+            break
+
+    data = {}
+    for s, items in parts.items():
+        if items:
+            times, values = zip(*reversed(items))
+            data[s] = np.concatenate(times), np.concatenate(values)
+    return data
+
+
+def cache_size(maxsize, interval):
+    """
+    Get number of sensor data values kept in data cache for a sensor.
+
+    :param maxsize: Number of values kept for a sensor sampled every
+        second.
+    :param interval: Sampling interval of the sensor in seconds.
+    """
+    return max(1, int(maxsize / interval))
 
 
 def dispatch(func):
@@ -100,22 +501,397 @@ def dispatch(func):
     return wrapper
 
 
+class RingBuffer:
+    """
+    Circular buffer of sensor data values.
+
+    Sensor data time and value are stored in two preallocated arrays of
+    64-bit floats. When the buffer is full, the oldest values are
+    overwritten.
+
+    Iterating over the buffer returns `(time, value)` pairs, oldest
+    first.
+    """
+    def __init__(self, maxsize):
+        """
+        Create ring buffer.
+
+        :param maxsize: Maximum number of values kept in the buffer.
+        """
+        self.maxsize = maxsize
+        self._time = np.empty(maxsize, dtype=np.float64)
+        self._value = np.empty(maxsize, dtype=np.float64)
+        self._pos = 0  # index of next value to write
+        self._size = 0
+        self._written = 0
+
+
+    @property
+    def count(self):
+        """
+        Total number of values written to the buffer.
+        """
+        return self._written
+
+
+    def append(self, time, value):
+        """
+        Append sensor data value to the buffer.
+
+        :param time: Sensor data time.
+        :param value: Sensor data value.
+        """
+        pos = self._pos
+        self._time[pos] = time
+        self._value[pos] = value
+        self._pos = (pos + 1) % self.maxsize
+        if self._size < self.maxsize:
+            self._size += 1
+        self._written += 1
+
+
+    def extend(self, times, values):
+        """
+        Append arrays of sensor data times and values to the buffer.
+
+        :param times: Array of sensor data times.
+        :param values: Array of sensor data values.
+        """
+        times = np.asarray(times, dtype=np.float64)[-self.maxsize:]
+        values = np.asarray(values, dtype=np.float64)[-self.maxsize:]
+        n = len(times)
+        pos = self._pos
+        k = min(n, self.maxsize - pos)
+        self._time[pos:pos + k] = times[:k]
+        self._value[pos:pos + k] = values[:k]
+        self._time[:n - k] = times[k:]
+        self._value[:n - k] = values[k:]
+        self._pos = (pos + n) % self.maxsize
+        self._size = min(self._size + n, self.maxsize)
+        self._written += n
+
+
+    def clear(self):
+        """
+        Remove all sensor data values from the buffer.
+        """
+        self._pos = 0
+        self._size = 0
+
+
+    def segments(self):
+        """
+        Return list of up to two `(times, values)` pairs of array views,
+        oldest data first.
+
+        The arrays are not copied, so they change when new values are
+        added to the buffer.
+        """
+        pos, size = self._pos, self._size
+        start = pos - size
+        if start >= 0:
+            items = [(start, pos)]
+        else:
+            items = [(self.maxsize + start, self.maxsize), (0, pos)]
+        return [
+            (self._time[i:j], self._value[i:j])
+            for i, j in items if i < j
+        ]
+
+
+    def data(self):
+        """
+        Return `(times, values)` pair of arrays, oldest data first.
+
+        The arrays are views of the buffer unless the buffer wraps
+        around, in which case the data is copied.
+        """
+        return self.select()
+
+
+    def select(self, start=-math.inf, end=math.inf):
+        """
+        Return `(times, values)` pair of arrays for sensor data within
+        time range, oldest data first.
+
+        Sensor data times are expected to be in ascending order, so the
+        time range is found with binary search.
+
+        The arrays are views of the buffer unless the time range spans the
+        buffer boundary, in which case the data is copied.
+
+        :param start: Start of time range (inclusive).
+        :param end: End of time range (inclusive).
+        """
+        items = []
+        for times, values in self.segments():
+            i = np.searchsorted(times, start, 'left')
+            j = np.searchsorted(times, end, 'right')
+            if i < j:
+                items.append((times[i:j], values[i:j]))
+
+        if len(items) == 1:
+            return items[0]
+        elif items:
+            times, values = zip(*items)
+            return np.concatenate(times), np.concatenate(values)
+        else:
+            return self._time[:0], self._value[:0]
+
+
+    def __len__(self):
+        return self._size
+
+
+    def __iter__(self):
+        for times, values in self.segments():
+            yield from zip(times.tolist(), values.tolist())
+
+
+
+class Rollup:
+    """
+    Sensor data values aggregated into buckets of fixed time width.
+
+    For each bucket, its start time, and count, sum, minimum and maximum of
+    sensor data values are kept. The buckets are stored in preallocated
+    arrays used as circular buffer. The current bucket is kept separately
+    until sensor data value for next bucket arrives.
+    """
+    def __init__(self, step, maxsize):
+        """
+        Create sensor data rollup.
+
+        :param step: Width of bucket in seconds.
+        :param maxsize: Maximum number of buckets.
+        """
+        self.step = step
+        self.maxsize = maxsize
+        self._time = np.empty(maxsize, dtype=np.float64)
+        self._count = np.empty(maxsize, dtype=np.float64)
+        self._sum = np.empty(maxsize, dtype=np.float64)
+        self._min = np.empty(maxsize, dtype=np.float64)
+        self._max = np.empty(maxsize, dtype=np.float64)
+        self._pos = 0
+        self._size = 0
+
+        self._key = None
+        self._bucket = None
+
+
+    @property
+    def start(self):
+        """
+        Start time of the oldest bucket or infinity if there is no data.
+        """
+        if self._size:
+            return self._time[(self._pos - self._size) % self.maxsize]
+        elif self._key is not None:
+            return self._key * self.step
+        else:
+            return math.inf
+
+
+    def add(self, time, value):
+        """
+        Add sensor data value to the rollup.
+
+        :param time: Sensor data time.
+        :param value: Sensor data value.
+        """
+        if value == value:  # skip nan
+            self._merge(time // self.step, 1, value, value, value)
+
+
+    def extend(self, times, values):
+        """
+        Add arrays of sensor data times and values to the rollup.
+
+        :param times: Array of sensor data times.
+        :param values: Array of sensor data values.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        idx = ~np.isnan(values)
+        times, values = times[idx], values[idx]
+        if not len(times):
+            return
+
+        keys = times // self.step
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        counts = np.diff(np.r_[starts, len(keys)])
+        items = zip(
+            keys[starts].tolist(),
+            counts.tolist(),
+            np.add.reduceat(values, starts).tolist(),
+            np.minimum.reduceat(values, starts).tolist(),
+            np.maximum.reduceat(values, starts).tolist(),
+        )
+        for item in items:
+            self._merge(*item)
+
+
+    def data(self):
+        """
+        Return tuple of arrays of bucket start time, and count, sum,
+        minimum and maximum of sensor data values, oldest bucket first.
+
+        The current bucket is included.
+        """
+        pos, size = self._pos, self._size
+        idx = np.arange(pos - size, pos) % self.maxsize
+        arrays = (self._time, self._count, self._sum, self._min, self._max)
+        data = tuple(a[idx] for a in arrays)
+        if self._key is not None:
+            current = (self._key * self.step, *self._bucket)
+            data = tuple(np.append(a, v) for a, v in zip(data, current))
+        return data
+
+
+    def bin(self, agg, bins, start=-math.inf, end=math.inf):
+        """
+        Bin the rollup buckets and use `agg` function to aggregate values
+        within one bin.
+
+        The result has the same format as result of `bin_data` function.
+
+        :param agg: Name of aggregation function, one of `mean`, `min`,
+            `max` or `count`.
+        :param bins: Numbers of bins.
+        :param start: Ignore buckets ending before the start time.
+        :param end: Ignore buckets starting after the end time.
+        """
+        return _pairs(*self.bin_columns(agg, bins, start, end))
+
+
+    def bin_columns(self, agg, bins, start=-math.inf, end=math.inf):
+        """
+        Bin the rollup buckets and use `agg` function to aggregate values
+        within one bin.
+
+        Pair of arrays `(times, values)` of binned sensor data is
+        returned.
+
+        :param agg: Name of aggregation function, one of `mean`, `min`,
+            `max` or `count`.
+        :param bins: Numbers of bins.
+        :param start: Ignore buckets ending before the start time; buckets
+            overlapping the start time are binned from the start time.
+        :param end: Ignore buckets starting after the end time.
+        """
+        result = self._bin(agg, bins, start, end)
+        if result is None:
+            return _valid((), ())
+        edges, values = result
+        return _valid(edges[:-1], values)
+
+
+    def bin_grid(self, agg, edges):
+        """
+        Bin the rollup buckets on grid of bins and use `agg` function to
+        aggregate values within one bin.
+
+        Array of binned sensor data values is returned, with `nan` values
+        for bins without buckets, or `None` if no bucket overlaps the
+        grid. Buckets overlapping start or end of the grid are binned into
+        its first or last bin.
+
+        :param agg: Name of aggregation function, one of `mean`, `min`,
+            `max` or `count`.
+        :param edges: Array of edges of the bins.
+        """
+        result = self._bin(agg, edges, edges[0], edges[-1])
+        return None if result is None else result[1]
+
+
+    def _bin(self, agg, bins, start, end):
+        times, count, total, vmin, vmax = self.data()
+        idx = (times + self.step > start) & (times <= end)
+        times = times[idx]
+        if not len(times):
+            return None
+        times = np.clip(times, start, end)
+
+        stat = functools.partial(_binned_statistic, times, bins=bins)
+        if agg == 'mean':
+            total, edges, _ = stat(total[idx], 'sum')
+            count, *_ = stat(count[idx], 'sum')
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = total / count
+        elif agg == 'count':
+            values, edges, _ = stat(count[idx], 'sum')
+        elif agg == 'min':
+            values, edges, _ = stat(vmin[idx], 'min')
+        elif agg == 'max':
+            values, edges, _ = stat(vmax[idx], 'max')
+        else:
+            raise ValueError('Aggregation {} not supported'.format(agg))
+
+        return edges, values
+
+
+    def _merge(self, key, count, total, vmin, vmax):
+        if key == self._key:
+            b = self._bucket
+            b[0] += count
+            b[1] += total
+            if vmin < b[2]:
+                b[2] = vmin
+            if vmax > b[3]:
+                b[3] = vmax
+        else:
+            if self._key is not None:
+                self._flush()
+            self._key = key
+            self._bucket = [count, total, vmin, vmax]
+
+
+    def _flush(self):
+        pos = self._pos
+        self._time[pos] = self._key * self.step
+        self._count[pos], self._sum[pos], self._min[pos], self._max[pos] = \
+            self._bucket
+        self._pos = (pos + 1) % self.maxsize
+        if self._size < self.maxsize:
+            self._size += 1
+
+
+
 class Cache:
     """
     Senor data cache.
 
-    Sensor data is kept in dictionary consisting of `(name, queue)` pairs,
-    where `name` is name of a sensor and queue holds sensor data values.
-    Sensor data value consists of a pair `(time, value)`.
+    Sensor data is kept in dictionary consisting of `(name, buffer)`
+    pairs, where `name` is name of a sensor and buffer is ring buffer
+    holding sensor data values. Sensor data value consists of a pair
+    `(time, value)`.
+
+    For each sensor, the cache also maintains rollups of sensor data
+    values, see `Rollup` class.
+
+    The cache keeps sensor data of the same time period for each sensor.
+    The size of the buffer of a sensor is derived from its sampling
+    interval.
     """
-    def __init__(self, sensors, maxsize=N_DATA):
+    def __init__(self, sensors, maxsize=N_DATA, levels=LEVELS, intervals=None):
         """
         Create sensor data cach.
 
         :param sensors: List of sensors.
-        :param maxsize: Maximum number of values kept per sensor.
+        :param maxsize: Maximum number of values kept per sensor sampled
+            every second.
+        :param levels: Width of rollup buckets in seconds.
+        :param intervals: Dictionary of sampling intervals of sensors, in
+            seconds; one second by default.
         """
-        self._cache = {s: deque([], maxsize) for s in sensors}
+        self.maxsize = maxsize
+        intervals = intervals or {}
+        size = {s: cache_size(maxsize, intervals.get(s, 1)) for s in sensors}
+        self._cache = {s: RingBuffer(size[s]) for s in sensors}
+        self._levels = {
+            s: [Rollup(step, math.ceil(maxsize / step)) for step in levels]
+            for s in sensors
+        }
 
 
     @dispatch
@@ -126,9 +902,13 @@ class Cache:
         Sensor data item can be
 
         - `n23.core.Data` sensor data value
+        - `Batch` of sensor data values
         - dictionary compatible with `n23.core.Data` class
         - list of above objects
 
+        Sensor data items of sensors not known to the cache and sensor data
+        items with vector values, i.e. raw accelerometer data, are ignored.
+
         :param item: Sensor data item.
         """
         raise NotImplementedError('Not implemented for {}'.format(type(item)))
@@ -138,11 +918,80 @@ class Cache:
         return self._cache[name]
 
 
+    def levels(self, name):
+        """
+        Get list of rollups of sensor data values, finest first.
+
+        :param name: Sensor name.
+        """
+        return self._levels[name]
+
+
+    def last_time(self, name):
+        """
+        Get time of the newest sensor data value of a sensor or `None` if
+        there is no sensor data of the sensor in the cache.
+
+        :param name: Sensor name.
+        """
+        segments = self._cache[name].segments()
+        return float(segments[-1][0][-1]) if segments else None
+
+
+    def preload(self, name, times, values):
+        """
+        Add arrays of sensor data times and values, which are older than
+        sensor data values already kept in the cache.
+
+        Values newer than the oldest value in the cache are ignored. The
+        sensor data buffer and its rollups are rebuilt.
+
+        :param name: Sensor name.
+        :param times: Array of sensor data times.
+        :param values: Array of sensor data values.
+        """
+        data = self._cache.get(name)
+        if data is None:
+            return
+
+        current = data.data()
+        if len(current[0]):
+            idx = times < current[0][0]
+            times, values = times[idx], values[idx]
+        times = np.concatenate((times, current[0]))
+        values = np.concatenate((values, current[1]))
+
+        data.clear()
+        self._levels[name] = [
+            Rollup(r.step, r.maxsize) for r in self._levels[name]
+        ]
+        self.extend(name, times, values)
+
+
+    def extend(self, name, times, values):
+        """
+        Add arrays of sensor data times and values.
+
+        :param name: Sensor name.
+        :param times: Array of sensor data times.
+        :param values: Array of sensor data values.
+        """
+        self._cache[name].extend(times, values)
+        for r in self._levels[name]:
+            r.extend(times, values)
+
+
     @add.register(Data)
     def _add(self, item):
         self._add_value(item.name, item.time, item.value)
 
 
+    @add.register(Batch)
+    def _add(self, item):
+        if item.name in self._cache and np.ndim(item.value) == 1:
+            self.extend(item.name, item.time, item.value)
+
+
     @add.register(dict)
     def _add(self, item):
         self._add_value(item['name'], item['time'], item['value'])
@@ -156,7 +1005,11 @@ class Cache:
 
 
     def _add_value(self, name, time, value):
-        self._cache[name].append((time, value))
+        data = self._cache.get(name)
+        if data is not None and np.ndim(value) == 0:
+            data.append(time, value)
+            for r in self._levels[name]:
+                r.add(time, value)
 
 
 # vim: sw=4:et:ai
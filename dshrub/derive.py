@@ -0,0 +1,291 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Derived sensor data channels.
+
+Derived sensor data is calculated from batches of sensor data values
+using NumPy arrays, i.e. magnitude of accelerometer vector or dew point
+from temperature and humidity.
+"""
+
+import numpy as np
+from collections import defaultdict, namedtuple
+
+from n23 import Data
+
+from .data import Batch
+
+
+Derived = namedtuple('Derived', ['name', 'inputs', 'func'])
+Derived.__doc__ = """
+Derived sensor data channel.
+
+The function receives array of sensor data values for each input sensor
+and returns array of derived values. The arrays of input values are
+aligned with the first input sensor, see `Derive` class.
+
+:var name: Name of derived sensor data channel.
+:var inputs: Names of input sensors.
+:var func: Function calculating derived values.
+"""
+
+
+def magnitude(values):
+    """
+    Calculate magnitude of vectors.
+
+    :param values: Array of vectors, i.e. accelerometer data.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return np.sqrt((values ** 2).sum(axis=1))
+
+
+def dew_point(temperature, humidity):
+    """
+    Calculate dew point with Magnus formula.
+
+    :param temperature: Array of temperature values (Celsius).
+    :param humidity: Array of relative humidity values (percent).
+    """
+    b, c = 17.62, 243.12
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g = np.log(humidity / 100) + b * temperature / (c + temperature)
+        return c * g / (b - g)
+
+
+class MovingAverage(object):
+    """
+    Moving average of sensor data values.
+
+    The last values of a batch are kept to calculate moving average over
+    batch boundary.
+    """
+    def __init__(self, window):
+        """
+        Create moving average function.
+
+        :param window: Number of values to average.
+        """
+        super().__init__()
+        self.window = window
+        self._tail = np.empty(0, dtype=np.float64)
+
+
+    def __call__(self, values):
+        values = np.concatenate((self._tail, values))
+        n = len(self._tail)
+        self._tail = values[-(self.window - 1):] if self.window > 1 \
+            else values[:0]
+
+        total = np.cumsum(np.r_[0, values])
+        count = np.minimum(np.arange(1, len(values) + 1), self.window)
+        start = np.arange(1, len(values) + 1) - count
+        avg = (total[1:] - total[start]) / count
+        return avg[n:]
+
+
+# derived sensor data channels, the functions are created for each
+# workflow as they might keep state
+DERIVED = {
+    'acceleration': lambda: Derived(
+        'acceleration', ('accelerometer',), magnitude
+    ),
+    'acceleration_avg': lambda: Derived(
+        'acceleration_avg', ('accelerometer',),
+        lambda v, avg=MovingAverage(10): avg(magnitude(v))
+    ),
+    'dew_point': lambda: Derived(
+        'dew_point', ('temperature', 'humidity'), dew_point
+    ),
+}
+
+
+def derived_channel(name):
+    """
+    Create derived sensor data channel.
+
+    For device-qualified name of derived sensor data channel, i.e.
+    `kitchen.dew_point`, names of input sensors are qualified with the
+    device name as well. `None` is returned if there is no such derived
+    sensor data channel.
+
+    :param name: Name of derived sensor data channel.
+    """
+    device, _, base = name.rpartition('.')
+    if base not in DERIVED:
+        return None
+
+    channel = DERIVED[base]()
+    if device:
+        inputs = tuple('{}.{}'.format(device, n) for n in channel.inputs)
+        channel = Derived(name, inputs, channel.func)
+    return channel
+
+
+def sensor_inputs(names):
+    """
+    Get names of sensors, which need to be read to provide sensor data for
+    the sensor and derived sensor data channels.
+
+    :param names: Names of sensors and derived sensor data channels.
+    """
+    result = []
+    for n in names:
+        channel = derived_channel(n)
+        inputs = channel.inputs if channel else (n,)
+        result.extend(v for v in inputs if v not in result)
+    return result
+
+
+def sensor_intervals(names, intervals):
+    """
+    Get sampling intervals of sensors and derived sensor data channels.
+
+    Derived sensor data channel is calculated at sampling interval of its
+    first input sensor.
+
+    :param names: Names of sensors and derived sensor data channels.
+    :param intervals: Dictionary of sampling intervals of sensors.
+    """
+    result = {}
+    for n in names:
+        channel = derived_channel(n)
+        s = channel.inputs[0] if channel else n
+        if s in intervals:
+            result[n] = intervals[s]
+    return result
+
+
+class Derive(object):
+    """
+    Sensor data stage calculating derived sensor data channels.
+
+    Sensor data values of input sensors are collected with `put` method.
+    On `notify` call, i.e. once per scheduler tick, derived values are
+    calculated for the whole batch and sent to the consumer.
+
+    Multiple input sensors are aligned with the first input sensor - for
+    each value of the first sensor, the latest value of other input sensors
+    is used.
+
+    If the first input sensor is read in batches, see `dshrub.data.Batch`,
+    then derived values are sent to the consumer as one batch as well.
+    """
+    def __init__(self, consumer, channels, raw=None):
+        """
+        Create sensor data stage.
+
+        :param consumer: Function receiving sensor data items.
+        :param channels: Collection of derived sensor data channels.
+        :param raw: Names of sensors, which values are passed to the
+            consumer as well; all sensors by default.
+        """
+        super().__init__()
+        self.consumer = consumer
+        self.channels = channels
+        self.raw = raw
+
+        self._inputs = {n for c in channels for n in c.inputs}
+        self._items = defaultdict(list)
+        self._last = {}
+        self._batch = set()
+
+
+    def put(self, item):
+        """
+        Receive sensor data item.
+
+        :param item: Sensor data item.
+        """
+        if self.raw is None or item.name in self.raw:
+            self.consumer(item)
+        if item.name in self._inputs:
+            self._items[item.name].append(item)
+            if isinstance(item, Batch):
+                self._batch.add(item.name)
+
+
+    def notify(self, *args):
+        """
+        Calculate derived sensor data for collected sensor data items.
+        """
+        if not self._items:
+            return
+
+        data = {n: self._columns(v) for n, v in self._items.items()}
+        self._items.clear()
+
+        for c in self.channels:
+            for item in self._derive(c, data):
+                self.consumer(item)
+
+        for n, (_, times, values) in data.items():
+            self._last[n] = times[-1:], values[-1:]
+
+
+    def _columns(self, items):
+        if isinstance(items[0], Batch):
+            clock = np.concatenate([
+                np.full(len(v.time), v.clock) for v in items
+            ])
+            times = np.concatenate([v.time for v in items])
+            values = np.concatenate([v.value for v in items])
+            return clock, times, values
+
+        _, clock, times, values = zip(*items)
+        values = np.array(values, dtype=np.float64)
+        return np.array(clock), np.array(times, dtype=np.float64), values
+
+
+    def _derive(self, channel, data):
+        first, *others = channel.inputs
+        if first not in data:
+            return []
+
+        clock, times, values = data[first]
+        valid = np.ones(len(times), dtype=bool)
+        args = [values]
+        for n in others:
+            t, v = self._last.get(n, (np.empty(0), np.empty(0)))
+            if n in data:
+                t = np.concatenate((t, data[n][1]))
+                v = np.concatenate((v, data[n][2]))
+            if not len(t):
+                return []
+            idx = np.searchsorted(t, times, 'right') - 1
+            valid &= idx >= 0
+            args.append(v[np.maximum(idx, 0)])
+
+        result = channel.func(*args)
+        if first in self._batch:
+            if not valid.any():
+                return []
+            item = Batch(
+                channel.name, int(clock[valid][-1]), times[valid],
+                result[valid]
+            )
+            return [item]
+
+        items = zip(clock[valid].tolist(), times[valid].tolist(),
+            result[valid].tolist())
+        return [Data(channel.name, c, t, v) for c, t, v in items]
+
+
+# vim: sw=4:et:ai
@@ -0,0 +1,204 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Sensor devices, i.e. SensorTag, read concurrently by one process.
+
+Each device is connected and reconnected independently, so a device
+going out of range does not stall reading of other devices. When multiple
+devices are read, sensor names are qualified with device name, i.e.
+`kitchen.temperature`.
+"""
+
+import asyncio
+import functools
+import logging
+
+from .retry import backoff
+
+logger = logging.getLogger(__name__)
+
+# names of sensors and btzen classes reading them
+READERS = {
+    'temperature': 'Temperature',
+    'pressure': 'Pressure',
+    'humidity': 'Humidity',
+    'light': 'Light',
+    'accelerometer': 'Accelerometer',
+}
+
+
+def parse_devices(value):
+    """
+    Parse comma separated list of devices.
+
+    Each device is specified as `[NAME=]ADDRESS`. List of `(name,
+    address)` pairs is returned. Name of a device is `None` if only one
+    device is specified without name, otherwise device address is its
+    default name.
+
+    :param value: Comma separated list of devices.
+    """
+    items = [v.partition('=') for v in value.split(',') if v]
+    devices = [(n, a) if s else (None, n) for n, s, a in items]
+    if not devices or any(not a for _, a in devices):
+        raise ValueError('invalid device list: {}'.format(value))
+    if len(devices) > 1:
+        devices = [(n or a, a) for n, a in devices]
+    names = [n for n, _ in devices]
+    if len(set(names)) != len(names):
+        raise ValueError('duplicate device name: {}'.format(value))
+    return devices
+
+
+def qualify(name, device):
+    """
+    Get device-qualified name of a sensor.
+
+    :param name: Sensor name.
+    :param device: Device name or `None`.
+    """
+    return name if device is None else '{}.{}'.format(device, name)
+
+
+def sensor_name(name):
+    """
+    Get sensor name from device-qualified name of a sensor.
+
+    :param name: Device-qualified name of a sensor.
+    """
+    return name.rpartition('.')[2]
+
+
+class Device(object):
+    """
+    Sensor device with its connection maintained by `run` coroutine.
+
+    Sensors of the device are read with `read` coroutine. If the device is
+    not connected, then `None` is returned. If reading fails or does not
+    finish within timeout, then the device is reconnected. The timeout of
+    reading a sensor is at least twice its sampling interval.
+    """
+    def __init__(self, bus, address, name=None, sensors=(), intervals=None,
+            timeout=1):
+        """
+        Create sensor device.
+
+        :param bus: D-Bus connection.
+        :param address: Device address.
+        :param name: Device name qualifying sensor names.
+        :param sensors: Names of sensors to read.
+        :param intervals: Dictionary of sampling intervals of sensors.
+        :param timeout: Minimum timeout of reading a sensor.
+        """
+        super().__init__()
+        self.bus = bus
+        self.address = address
+        self.name = name
+        self.sensors = [s for s in sensors if s in READERS]
+        self.intervals = intervals or {}
+        self.timeout = timeout
+
+        self._readers = {}
+        self._lost = asyncio.Event()
+
+
+    @property
+    def connected(self):
+        """
+        Check if device is connected.
+        """
+        return bool(self._readers)
+
+
+    def readers(self):
+        """
+        Get list of `(name, read)` pairs for each sensor of the device.
+
+        The sensor name is device-qualified and `read` is coroutine
+        function reading the sensor.
+        """
+        return [
+            (qualify(s, self.name), functools.partial(self.read, s))
+            for s in self.sensors
+        ]
+
+
+    async def read(self, sensor):
+        """
+        Read sensor data value.
+
+        :param sensor: Sensor name.
+        """
+        reader = self._readers.get(sensor)
+        if reader is None:
+            return None
+        timeout = max(self.timeout, 2 * self.intervals.get(sensor, 1))
+        try:
+            return await asyncio.wait_for(reader.read_async(), timeout)
+        except Exception as ex:
+            if self._readers:
+                logger.warning('device {} read error: {!r}'.format(
+                    self.address, ex
+                ))
+                self._readers = {}
+                self._lost.set()
+            return None
+
+
+    async def run(self, retry=backoff):
+        """
+        Connect to the device and reconnect when connection is lost.
+
+        :param retry: Generator function of reconnection delays, see
+            `dshrub.retry.backoff` function.
+        """
+        loop = asyncio.get_event_loop()
+        delays = retry()
+        while True:
+            try:
+                self._readers = await loop.run_in_executor(
+                    None, self._connect
+                )
+            except Exception as ex:
+                logger.warning('cannot connect to device {}: {!r}'.format(
+                    self.address, ex
+                ))
+                await asyncio.sleep(next(delays))
+                continue
+
+            logger.info('connected to device {}'.format(self.address))
+            delays = retry()
+            self._lost.clear()
+            await self._lost.wait()
+
+
+    def _connect(self):
+        import btzen
+
+        dev = btzen.connect(self.bus, self.address)
+        readers = {}
+        for s in self.sensors:
+            reader = getattr(btzen, READERS[s])(self.bus, dev)
+            reader.set_interval(self.intervals.get(s, 1))
+            readers[s] = reader
+        return readers
+
+
+# vim: sw=4:et:ai
@@ -0,0 +1,286 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Sensor data logging into HDF5 files.
+
+Sensor data is collected into chunks on the event loop. Filled chunks are
+written to HDF5 file by a dedicated writer thread, so slow disk does not
+delay sensor data acquisition.
+"""
+
+import logging
+import numpy as np
+import queue
+import threading
+import time
+
+from .data import Batch
+
+logger = logging.getLogger(__name__)
+
+# default number of rows of sensor data written at once
+N_CHUNK = 60
+
+
+class DataLog(object):
+    """
+    Sensor data log stage.
+
+    Sensor data items are received with `put` method and stored in a row of
+    current chunk. The `notify` method, called once per scheduler tick,
+    moves to the next row. Missing values are stored as NaN.
+
+    When a chunk is full, it is handed over to the writer thread and
+    another chunk buffer is used to collect sensor data. Chunk buffers are
+    reused once written.
+
+    Each HDF5 file dataset is named after its sensor. The `start` and
+    `interval` attributes of the file store time of the first row and time
+    between rows.
+
+    Sensor data of a sensor read in batches, see `dshrub.data.Batch`, is
+    stored as rows of fixed number of values. Sensor data times of such
+    sensor are stored in `<sensor>_time` dataset. Batches of sensor data
+    of a sensor not added as read in batches, and single sensor data
+    values of a sensor added as read in batches, are skipped, i.e. when
+    replaying data log file with different sampling intervals.
+    """
+    def __init__(self, filename, interval, n_chunk=N_CHUNK, compression=None,
+            shuffle=False):
+        """
+        Create sensor data log.
+
+        :param filename: HDF5 file name.
+        :param interval: Time between rows of sensor data.
+        :param n_chunk: Number of rows in a chunk.
+        :param compression: HDF5 compression filter, i.e. `gzip` or `lzf`.
+        :param shuffle: Enable HDF5 shuffle filter.
+        """
+        super().__init__()
+        self.filename = filename
+        self.interval = interval
+        self.n_chunk = n_chunk
+        self.compression = compression
+        self.shuffle = shuffle
+
+        # writer thread statistics
+        self.flush_count = 0
+        self.flush_time = 0
+        self.flush_total = 0
+
+        self._shapes = {}
+        self._batch = {}
+        self._skipped = set()
+        self._start = None
+        self._row = 0
+        self._size = 0
+        self._buffer = None
+        self._free = queue.Queue()
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._queued = 0
+
+        self._thread = threading.Thread(target=self._write)
+        self._thread.start()
+
+
+    @property
+    def queued(self):
+        """
+        Number of sensor data values not written to the file yet.
+        """
+        return self._queued
+
+
+    def add(self, name, shape=(), size=None):
+        """
+        Add sensor to the data log.
+
+        :param name: Sensor name.
+        :param shape: Shape of sensor data value.
+        :param size: Number of sensor data values stored in a row for
+            sensor read in batches.
+        """
+        if size is None:
+            self._shapes[name] = shape
+        else:
+            self._shapes[name] = (size,) + shape
+            self._shapes[name + '_time'] = (size,)
+            self._batch[name] = size
+
+
+    def put(self, item):
+        """
+        Store sensor data item in the current row of sensor data.
+
+        :param item: Sensor data item.
+        """
+        if item.name not in self._shapes:
+            return
+        if isinstance(item, Batch) != (item.name in self._batch):
+            self._skip(item.name)
+            return
+        if self._buffer is None:
+            self._buffer = self._get_buffer()
+        if self._start is None:
+            self._start = _start_time(item)
+
+        if isinstance(item, Batch):
+            # values not fitting into a row are dropped
+            n = min(len(item.time), self._batch[item.name])
+            self._buffer[item.name][self._row, :n] = item.value[:n]
+            self._buffer[item.name + '_time'][self._row, :n] = item.time[:n]
+        else:
+            self._buffer[item.name][self._row] = item.value
+        self._size += 1
+        with self._lock:
+            self._queued += 1
+
+
+    def notify(self, *args):
+        """
+        Move to the next row of sensor data.
+
+        If current chunk is full, then it is handed over to the writer
+        thread.
+        """
+        if self._start is None:
+            return
+        self._row += 1
+        if self._row == self.n_chunk:
+            self._flush()
+
+
+    def close(self):
+        """
+        Hand over remaining sensor data to the writer thread and close the
+        data log.
+
+        The writer thread closes the file once all sensor data is written.
+        """
+        if self._row:
+            self._flush()
+        self._jobs.put(None)
+
+
+    def join(self):
+        """
+        Wait for the writer thread to finish.
+        """
+        self._thread.join()
+
+
+    def _flush(self):
+        # no sensor data received for the whole chunk, i.e. device is
+        # disconnected; write rows of missing values
+        if self._buffer is None:
+            self._buffer = self._get_buffer()
+        self._jobs.put((self._start, self._row, self._size, self._buffer))
+        self._buffer = None
+        self._row = 0
+        self._size = 0
+
+
+    def _skip(self, name):
+        if name not in self._skipped:
+            self._skipped.add(name)
+            logger.warning(
+                'sensor data of sensor {} does not match its sampling'
+                ' interval, skipping'.format(name)
+            )
+
+
+    def _get_buffer(self):
+        try:
+            buffer = self._free.get_nowait()
+        except queue.Empty:
+            buffer = {
+                n: np.full((self.n_chunk,) + shape, np.nan)
+                for n, shape in self._shapes.items()
+            }
+        return buffer
+
+
+    def _write(self):
+        f = None
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+
+            start, rows, size, buffer = job
+            t = time.monotonic()
+            try:
+                if f is None:
+                    f = self._create(start)
+                for name, data in buffer.items():
+                    ds = f[name]
+                    n = len(ds)
+                    ds.resize(n + rows, axis=0)
+                    ds[n:] = data[:rows]
+                f.flush()
+            except Exception as ex:
+                logger.error('cannot write data file {}: {}'.format(
+                    self.filename, ex
+                ))
+            finally:
+                t = time.monotonic() - t
+                self.flush_time = t
+                self.flush_total += t
+                self.flush_count += 1
+                with self._lock:
+                    self._queued -= size
+
+                for data in buffer.values():
+                    data.fill(np.nan)
+                self._free.put(buffer)
+
+        if f is not None:
+            f.close()
+        logger.info('data file {} closed'.format(self.filename))
+
+
+    def _create(self, start):
+        import h5py
+
+        f = h5py.File(self.filename, 'w')
+        f.attrs['start'] = start
+        f.attrs['interval'] = self.interval
+        for name, shape in self._shapes.items():
+            f.create_dataset(
+                name, (0,) + shape, dtype=np.float64,
+                maxshape=(None,) + shape,
+                chunks=(self.n_chunk,) + shape,
+                compression=self.compression,
+                shuffle=self.shuffle,
+            )
+        return f
+
+
+def _start_time(item):
+    # time of the first sensor data value of an item, `None` for empty
+    # batch
+    if isinstance(item, Batch):
+        return float(item.time[0]) if len(item.time) else None
+    else:
+        return item.time
+
+
+# vim: sw=4:et:ai
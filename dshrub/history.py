@@ -0,0 +1,235 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Historical sensor data queries over archive of data log files.
+"""
+
+import glob
+import logging
+import math
+import numpy as np
+import os.path
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# aggregation functions supported by historical queries
+HISTORY_AGG = ('mean', 'min', 'max', 'count')
+
+
+Entry = namedtuple(
+    'Entry', ['filename', 'mtime', 'start', 'interval', 'size', 'batch']
+)
+Entry.__doc__ = """
+Archive index entry of data log file.
+
+:var filename: Data log file name.
+:var mtime: Modification time of the file when it was indexed.
+:var start: Time of first row of sensor data.
+:var interval: Time between rows of sensor data.
+:var size: Dictionary of number of rows per sensor.
+:var batch: Set of sensors read in batches, see `dshrub.dlog.DataLog`.
+"""
+
+
+class Archive(object):
+    """
+    Index of archive of data log files.
+
+    For each data log file, its start time, interval and number of rows of
+    each sensor are indexed, so only data log files overlapping with time
+    range of a query are opened.
+
+    Sensor data of sensors read in batches is indexed as well and it is
+    flattened when read. Sensor data with vector values, i.e. raw
+    accelerometer data, is not indexed.
+    """
+    def __init__(self, path, prefix='dshrub'):
+        """
+        Create index of archive of data log files.
+
+        :param path: Directory with data log files.
+        :param prefix: Prefix of data log file names.
+        """
+        super().__init__()
+        self.path = path
+        self.prefix = prefix
+        self._index = {}
+
+
+    def update(self):
+        """
+        Index new and modified data log files.
+        """
+        files = glob.glob(os.path.join(self.path, self.prefix + '*'))
+        index = {}
+        for fn in files:
+            try:
+                mtime = os.stat(fn).st_mtime
+                entry = self._index.get(fn)
+                if entry is None or entry.mtime != mtime:
+                    entry = self._read_entry(fn, mtime)
+                index[fn] = entry
+            except (OSError, KeyError) as ex:
+                logger.debug('cannot index data file {}: {}'.format(fn, ex))
+        self._index = index
+        logger.info('archive index has {} files'.format(len(index)))
+
+
+    def entries(self, sensor, start, end):
+        """
+        Get archive index entries of data log files having sensor data
+        within time range, ordered by start time.
+
+        :param sensor: Sensor name.
+        :param start: Start of time range.
+        :param end: End of time range.
+        """
+        entries = (
+            e for e in self._index.values()
+            if e.size.get(sensor)
+                and e.start <= end
+                and e.start + (e.size[sensor] - 1) * e.interval >= start
+        )
+        return sorted(entries, key=lambda e: e.start)
+
+
+    def read(self, sensor, start, end):
+        """
+        Read sensor data within time range from data log files.
+
+        Generator of `(times, values)` pairs of arrays is returned, one
+        pair per data log file. Only the slice of sensor data within the
+        time range is read. Missing values are dropped.
+
+        :param sensor: Sensor name.
+        :param start: Start of time range (inclusive).
+        :param end: End of time range (inclusive).
+        """
+        import h5py
+
+        for e in self.entries(sensor, start, end):
+            batch = sensor in e.batch
+            i = max(0, math.ceil((start - e.start) / e.interval))
+            j = math.floor((end - e.start) / e.interval) + 1
+            if batch:
+                # sensor data values of a row are read before its time
+                i = max(0, i - 1)
+                j += 1
+            j = min(e.size[sensor], j)
+            try:
+                with h5py.File(e.filename, 'r') as f:
+                    values = f[sensor][i:j]
+                    if batch:
+                        times = f[sensor + '_time'][i:j]
+            except (OSError, KeyError) as ex:
+                logger.warning('cannot read data file {}: {}'.format(
+                    e.filename, ex
+                ))
+                continue
+
+            if batch:
+                times, values = times.ravel(), values.ravel()
+                idx = ~np.isnan(values) & (times >= start) & (times <= end)
+            else:
+                times = e.start + e.interval * np.arange(i, j)
+                idx = ~np.isnan(values)
+            yield times[idx], values[idx]
+
+
+    def _read_entry(self, fn, mtime):
+        import h5py
+
+        with h5py.File(fn, 'r') as f:
+            start = f.attrs['start']
+            interval = f.attrs.get('interval', 1)
+            size = {}
+            batch = set()
+            for n, ds in f.items():
+                if not isinstance(ds, h5py.Dataset):
+                    continue
+                if ds.ndim == 1:
+                    size[n] = len(ds)
+                elif ds.ndim == 2 and n + '_time' in f:
+                    size[n] = len(ds)
+                    batch.add(n)
+        return Entry(fn, mtime, start, interval, size, batch)
+
+
+def bin_history(archive, sensor, agg, bins, start, end):
+    """
+    Bin historical sensor data and use `agg` function to aggregate values
+    within one bin.
+
+    The time range is split into `bins` bins of equal width. The data log
+    files are read one by one and generator of lists of bins is returned.
+    A list contains bins completed by data read from a data log file, so
+    the result can be sent to a client in pieces. Each bin is `[time,
+    value]` pair as in result of `bin_data` function.
+
+    :param archive: Archive of data log files.
+    :param sensor: Sensor name.
+    :param agg: Name of aggregation function, one of `mean`, `min`, `max`
+        or `count`.
+    :param bins: Numbers of bins.
+    :param start: Start of time range.
+    :param end: End of time range.
+    """
+    width = (end - start) / bins
+    edges = (start + width * np.arange(bins)).tolist()
+    count = np.zeros(bins)
+    total = np.zeros(bins)
+    vmin = np.full(bins, np.inf)
+    vmax = np.full(bins, -np.inf)
+
+    def result(i, j):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if agg == 'mean':
+                values = total[i:j] / count[i:j]
+            elif agg == 'count':
+                values = count[i:j]
+            elif agg == 'min':
+                values = np.where(count[i:j] > 0, vmin[i:j], np.nan)
+            else:
+                values = np.where(count[i:j] > 0, vmax[i:j], np.nan)
+        items = zip(edges[i:j], values.tolist())
+        return [[t, v] for t, v in items if not math.isnan(v)]
+
+    done = 0
+    for times, values in archive.read(sensor, start, end):
+        if not len(times):
+            continue
+
+        idx = np.minimum(((times - start) / width).astype(int), bins - 1)
+        count += np.bincount(idx, minlength=bins)
+        total += np.bincount(idx, weights=values, minlength=bins)
+        np.minimum.at(vmin, idx, values)
+        np.maximum.at(vmax, idx, values)
+
+        # data log files are ordered by time, so bins before the last one
+        # are complete
+        last = int(idx[-1])
+        yield result(done, last)
+        done = last
+
+    yield result(done, bins)
+
+
+# vim: sw=4:et:ai
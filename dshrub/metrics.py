@@ -0,0 +1,329 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Runtime metrics of sensor data processing.
+
+Metrics are counters, histograms and gauges kept in a registry. Updating
+a counter or a histogram is cheap, so stages of sensor data processing
+update them for every sensor data item. Gauges are functions called only
+when snapshot of the metrics is taken.
+
+Metric can have a label, i.e. sensor name, and snapshot of the metrics is
+a dictionary
+
+    {name: value}
+    {name: {label: value}}
+"""
+
+import bisect
+import time
+from collections import deque
+
+# upper bounds of histogram buckets, in seconds
+BUCKETS = (
+    1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'),
+)
+
+# time window of counter rate, in seconds
+RATE_WINDOW = 60
+
+
+class Counter(object):
+    """
+    Counter of events, i.e. number of sensor data items.
+
+    The snapshot of a counter contains total count and rate per second
+    within last minute. The rate is calculated using counter values
+    recorded by previous snapshots, so it is the average rate since
+    counter creation on first snapshot.
+    """
+    def __init__(self):
+        super().__init__()
+        self.value = 0
+        self._history = deque([(time.monotonic(), 0)])
+
+
+    def inc(self, n=1):
+        """
+        Increase counter value.
+
+        :param n: Increment.
+        """
+        self.value += n
+
+
+    def snapshot(self):
+        now = time.monotonic()
+        history = self._history
+        while len(history) > 1 and now - history[1][0] >= RATE_WINDOW:
+            history.popleft()
+
+        t, value = history[0]
+        rate = (self.value - value) / (now - t) if now > t else 0
+        history.append((now, self.value))
+        return {'count': self.value, 'rate': rate}
+
+
+class Histogram(object):
+    """
+    Histogram of values, i.e. latency of an operation in seconds.
+
+    The snapshot of a histogram contains number of values, their mean and
+    maximum, and 50th, 90th and 99th percentiles estimated with upper
+    bounds of histogram buckets.
+    """
+    def __init__(self, buckets=BUCKETS):
+        """
+        Create histogram.
+
+        :param buckets: Ordered upper bounds of histogram buckets.
+        """
+        super().__init__()
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+
+    def observe(self, value):
+        """
+        Add value to the histogram.
+
+        :param value: Value to add.
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+
+    def percentile(self, p):
+        """
+        Estimate percentile of values.
+
+        :param p: Percentile, i.e. 99.
+        """
+        if not self.count:
+            return None
+        n = p / 100 * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= n:
+                return min(bound, self.max)
+        return self.max
+
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+
+class Gauge(object):
+    """
+    Gauge, which value is calculated by a function on snapshot.
+    """
+    def __init__(self, func):
+        """
+        Create gauge.
+
+        :param func: Function returning gauge value.
+        """
+        super().__init__()
+        self.func = func
+
+
+    def snapshot(self):
+        return self.func()
+
+
+class Metrics(object):
+    """
+    Registry of metrics.
+
+    Counters and histograms are created on first use. Gauges are replaced
+    when registered again, i.e. on data log file rotation.
+    """
+    def __init__(self):
+        super().__init__()
+        self._metrics = {}
+
+
+    def counter(self, name, label=None):
+        """
+        Get counter.
+
+        :param name: Metric name.
+        :param label: Optional metric label.
+        """
+        return self._get(name, label, Counter)
+
+
+    def histogram(self, name, label=None):
+        """
+        Get histogram.
+
+        :param name: Metric name.
+        :param label: Optional metric label.
+        """
+        return self._get(name, label, Histogram)
+
+
+    def gauge(self, name, func, label=None):
+        """
+        Register gauge.
+
+        :param name: Metric name.
+        :param func: Function returning gauge value.
+        :param label: Optional metric label.
+        """
+        self._metrics[name, label] = Gauge(func)
+
+
+    def snapshot(self):
+        """
+        Get dictionary of current values of all metrics.
+        """
+        result = {}
+        for (name, label), m in sorted(self._metrics.items(), key=_key):
+            value = m.snapshot()
+            if label is None:
+                result[name] = value
+            else:
+                result.setdefault(name, {})[label] = value
+        return result
+
+
+    def _get(self, name, label, cls):
+        key = name, label
+        m = self._metrics.get(key)
+        if m is None:
+            m = self._metrics[key] = cls()
+        return m
+
+
+class TopicProbe(object):
+    """
+    Sensor data topic wrapper measuring depth of queues of topic readers.
+
+    Number of sensor data items put into the topic and received by each
+    reader is counted. The difference is queue depth of a reader.
+    """
+    def __init__(self, topic, metrics, name='topic_depth'):
+        """
+        Create sensor data topic wrapper.
+
+        :param topic: Sensor data topic.
+        :param metrics: Registry of metrics.
+        :param name: Metric name of queue depth.
+        """
+        super().__init__()
+        self.topic = topic
+        self.metrics = metrics
+        self.name = name
+        self.count = 0
+
+
+    def put_nowait(self, item):
+        """
+        Put sensor data item into the topic.
+
+        :param item: Sensor data item.
+        """
+        self.count += 1
+        self.topic.put_nowait(item)
+
+
+    def reader(self, label):
+        """
+        Create topic reader, which has coroutine `get` method as the
+        topic.
+
+        :param label: Reader name, i.e. `cache` or `redis`.
+        """
+        reader = _Reader(self.topic)
+        self.metrics.gauge(
+            self.name, lambda: self.count - reader.count, label=label
+        )
+        return reader
+
+
+class _Reader(object):
+    def __init__(self, topic):
+        super().__init__()
+        self.topic = topic
+        self.count = 0
+
+
+    async def get(self):
+        items = await self.topic.get()
+        self.count += len(items)
+        return items
+
+
+def timed(func, histogram):
+    """
+    Wrap function to measure its execution time.
+
+    :param func: Function to wrap.
+    :param histogram: Histogram of execution time.
+    """
+    timer = time.perf_counter
+    def wrapper(*args, **kw):
+        t = timer()
+        try:
+            return func(*args, **kw)
+        finally:
+            histogram.observe(timer() - t)
+    return wrapper
+
+
+def timed_async(func, histogram):
+    """
+    Wrap coroutine function to measure time of its execution.
+
+    :param func: Coroutine function to wrap.
+    :param histogram: Histogram of execution time.
+    """
+    timer = time.perf_counter
+    async def wrapper(*args, **kw):
+        t = timer()
+        try:
+            return await func(*args, **kw)
+        finally:
+            histogram.observe(timer() - t)
+    return wrapper
+
+
+def _key(item):
+    (name, label), _ = item
+    return name, '' if label is None else str(label)
+
+
+# vim: sw=4:et:ai
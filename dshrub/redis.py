@@ -21,11 +21,94 @@
 Coroutines to simplify communication with Redis server.
 """
 
-import aioredis
+import asyncio
+import enum
+import json
 import logging
+import math
+import numpy as np
+import struct
+from collections import deque, namedtuple
+
+from .data import Batch
+from .retry import backoff
 
 logger = logging.getLogger(__name__)
 
+# maximum number of messages kept while Redis server is not available
+N_OUTBOX = 3600
+
+# maximum number of connections in Redis connection pool
+N_POOL = 4
+
+# shared Redis connection pools
+_pools = {}
+
+# maximum number of messages read from Redis stream at once
+N_STREAM_READ = 1000
+
+# time of blocking read of Redis stream, in milliseconds
+STREAM_BLOCK = 1000
+
+# field of Redis stream entry holding sensor data message
+STREAM_FIELD = b'data'
+
+# binary message header - magic, number of items and number of sensor
+# names
+BIN_HEADER = struct.Struct('<2sIH')
+BIN_MAGIC = b'D1'
+
+# sensors with vector sensor data values skipped by binary format
+_skipped = set()
+
+
+class Format(enum.Enum):
+    """
+    Format of sensor data messages published to Redis channel.
+
+    :var JSON: One JSON object per sensor data item.
+    :var BATCH: Batch of sensor data items as JSON object of columns.
+    :var BINARY: Batch of sensor data items as packed binary columns.
+    """
+    JSON = 'json'
+    BATCH = 'batch'
+    BINARY = 'binary'
+
+
+Config = namedtuple('Config', ['host', 'port', 'db', 'timeout'])
+Config.__new__.__defaults__ = ('localhost', 6379, 0, None)
+Config.__doc__ = """
+Redis server connection configuration.
+
+:var host: Redis server host name.
+:var port: Redis server port.
+:var db: Redis database number.
+:var timeout: Connection timeout in seconds.
+"""
+
+
+async def connect(config=Config()):
+    """
+    Get connection pool for Redis server.
+
+    The connection pool is shared by all users of the same configuration
+    and it is recreated if closed.
+
+    :param config: Redis server connection configuration.
+    """
+    import aioredis
+
+    pool = _pools.get(config)
+    if pool is None or pool.closed:
+        pool = await aioredis.create_redis_pool(
+            (config.host, config.port),
+            db=config.db,
+            timeout=config.timeout,
+            maxsize=N_POOL,
+        )
+        _pools[config] = pool
+    return pool
+
 
 class Channel(object):
     """
@@ -35,24 +118,32 @@ class Channel(object):
 
     The context manager returns Redis channel.
     """
-    def __init__(self, name):
+    def __init__(self, name, config=Config()):
         """
         Create context manager for Redis channel.
 
         :param name: Redis channel.
+        :param config: Redis server connection configuration.
         """
         super().__init__()
         self.name = name
+        self.config = config
 
 
     async def __aenter__(self):
-        self.client = await aioredis.create_redis(('localhost', 6379))
+        self.client = await connect(self.config)
         self.channel, = await self.client.subscribe(self.name)
         return self.channel
 
 
     async def __aexit__(self, *args):
-        self.client.close()
+        import aioredis
+
+        if not self.client.closed:
+            try:
+                await self.client.unsubscribe(self.name)
+            except (OSError, aioredis.RedisError) as ex:
+                logger.debug('cannot unsubscribe: {}'.format(ex))
 
 
     def __await__(self):
@@ -65,34 +156,361 @@ class Client(object):
 
     It is coroutine and context manager.
 
-    The context manager returns Redis connection.
+    The context manager returns Redis connection pool shared by all
+    clients of the same configuration, see `connect` function.
     """
+    def __init__(self, config=Config()):
+        """
+        Create context manager for Redis connection pool.
+
+        :param config: Redis server connection configuration.
+        """
+        super().__init__()
+        self.config = config
+
+
     async def __aenter__(self):
-        self.client = await aioredis.create_redis(('localhost', 6379))
+        self.client = await connect(self.config)
         return self.client
 
 
     async def __aexit__(self, *args):
-        self.client.close()
+        pass
 
 
     def __await__(self):
         return self.__aenter__().__await__()
 
 
+async def receive(name, callback, config=Config()):
+    """
+    Receive messages from Redis channel and pass them to callback.
+
+    If connection to Redis server is lost, then reconnect with exponential
+    backoff.
+
+    :param name: Redis channel name.
+    :param callback: Function receiving Redis message.
+    :param config: Redis server connection configuration.
+    """
+    import aioredis
+
+    delays = backoff()
+    while True:
+        try:
+            async with Channel(name, config) as channel:
+                delays = backoff()
+                while await channel.wait_message():
+                    callback(await channel.get())
+            logger.warning('redis channel {} closed'.format(name))
+        except (OSError, asyncio.TimeoutError, aioredis.RedisError) as ex:
+            logger.warning('redis connection error: {}'.format(ex))
+        await asyncio.sleep(next(delays))
+
+
+async def receive_stream(name, callback, config=Config(), start=0,
+        count=N_STREAM_READ, retry=backoff):
+    """
+    Read messages from Redis stream and pass them to callback.
+
+    Messages added to the stream since `start` time are read first, up to
+    `count` messages at a time, then new messages are awaited with
+    blocking reads. Reading continues after id of the last received
+    message, also on reconnection, so no message is lost or received
+    twice while it is kept in the stream.
+
+    Blocking reads use a dedicated connection to Redis server, not the
+    shared connection pool.
+
+    :param name: Redis stream name.
+    :param callback: Function receiving list of Redis messages.
+    :param config: Redis server connection configuration.
+    :param start: Time, in seconds since epoch, of the oldest message to
+        read.
+    :param count: Maximum number of messages read at once.
+    :param retry: Generator function of reconnection delays, see
+        `backoff` function.
+    """
+    import aioredis
+
+    last = '{}-0'.format(int(start * 1000))
+    delays = retry()
+    while True:
+        try:
+            client = await aioredis.create_redis(
+                (config.host, config.port), db=config.db,
+                timeout=config.timeout,
+            )
+            try:
+                delays = retry()
+                while True:
+                    items = await client.xread(
+                        [name], timeout=STREAM_BLOCK, count=count,
+                        latest_ids=[last]
+                    )
+                    if items:
+                        last = items[-1][1]
+                        callback([v[STREAM_FIELD] for *_, v in items])
+            finally:
+                client.close()
+                await client.wait_closed()
+        except (OSError, asyncio.TimeoutError, aioredis.RedisError) as ex:
+            logger.warning('redis connection error: {}'.format(ex))
+        await asyncio.sleep(next(delays))
+
 
-async def publish(topic, name):
+async def publish(topic, name, format=Format.JSON, size=None, delay=None,
+        config=Config(), maxsize=N_OUTBOX, metrics=None, stream_size=None):
     """
     Publish sensor data received from a topic to Redis channel.
 
+    Messages are put into outbox and sent to Redis server by a separate
+    task. While Redis server is not available, the outbox keeps up to
+    `maxsize` newest messages, which are sent in bulk on reconnection.
+
+    For `Format.JSON` format, each sensor data item is published as
+    separate message. A batch of sensor data values of a sensor, see
+    `dshrub.data.Batch`, is published as one message of `Format.BATCH`
+    format.
+
+    For other formats, sensor data items are batched. A batch is published
+    when it has at least `size` items or its oldest item was received at
+    least `delay` seconds ago. The batch window is checked when sensor data
+    is received from the topic. If neither `size` nor `delay` is
+    specified, then each batch received from the topic is published as one
+    message.
+
+    If `stream_size` is specified, then messages are also added to Redis
+    stream of the same name as the channel. The stream is capped to about
+    `stream_size` messages, see `receive_stream` function.
+
     :param topic: Sensor data topic.
     :param name: Redis channel name.
+    :param format: Format of published messages.
+    :param size: Minimum number of sensor data items in a batch.
+    :param delay: Maximum delay of a batch in seconds.
+    :param config: Redis server connection configuration.
+    :param maxsize: Maximum number of messages in the outbox.
+    :param metrics: Optional registry of metrics.
+    :param stream_size: Maximum number of messages kept in Redis stream.
     """
-    async with Client() as client:
+    if size is None and delay is None:
+        size = 1
+    size = math.inf if size is None else size
+    delay = math.inf if delay is None else delay
+
+    loop = asyncio.get_event_loop()
+    outbox = deque([], maxsize)
+    event = asyncio.Event()
+    task = asyncio.ensure_future(
+        send(
+            name, outbox, event, config, metrics=metrics,
+            stream_size=stream_size
+        )
+    )
+    if metrics:
+        metrics.gauge('redis_outbox', lambda: len(outbox))
+
+    items = []
+    try:
         while True:
             values = await topic.get()
-            for v in values:
-                client.publish_json(name, v._asdict())
+            if format == Format.JSON:
+                outbox.extend(
+                    encode([v], Format.BATCH) if isinstance(v, Batch)
+                    else json.dumps(v._asdict()) for v in values
+                )
+                event.set()
+                continue
+
+            if not items:
+                start = loop.time()
+            items.extend(values)
+            if len(items) >= size or loop.time() - start >= delay:
+                message = encode(items, format)
+                if message is not None:
+                    outbox.append(message)
+                    event.set()
+                items = []
+    finally:
+        task.cancel()
+
+
+async def send(name, outbox, event, config=Config(), retry=backoff,
+        metrics=None, stream_size=None):
+    """
+    Send messages from outbox to Redis channel.
+
+    The messages are sent with Redis pipeline when the event is set. If
+    connection to Redis server fails, then the messages are put back into
+    the outbox and the connection is retried with exponential backoff.
+
+    If `stream_size` is specified, then the messages are also added to
+    Redis stream `name` capped to about `stream_size` messages.
+
+    :param name: Redis channel name.
+    :param outbox: Queue of messages.
+    :param event: Event set when messages are put into the outbox.
+    :param config: Redis server connection configuration.
+    :param retry: Generator function of reconnection delays, see
+        `backoff` function.
+    :param metrics: Optional registry of metrics.
+    :param stream_size: Maximum number of messages kept in Redis stream.
+    """
+    import aioredis
+
+    loop = asyncio.get_event_loop()
+    if metrics:
+        latency = metrics.histogram('redis_publish_latency')
+        failures = metrics.counter('redis_publish_failures')
+
+    delays = retry()
+    while True:
+        await event.wait()
+        event.clear()
+
+        items = list(outbox)
+        outbox.clear()
+        try:
+            t = loop.time()
+            client = await connect(config)
+            pipe = client.pipeline()
+            for v in items:
+                pipe.publish(name, v)
+                if stream_size:
+                    pipe.xadd(name, {STREAM_FIELD: v}, max_len=stream_size)
+            await pipe.execute()
+            delays = retry()
+            if metrics:
+                latency.observe(loop.time() - t)
+        except (OSError, asyncio.TimeoutError, aioredis.RedisError) as ex:
+            if metrics:
+                failures.inc()
+            logger.warning(
+                'redis connection error, {} messages queued: {}'
+                .format(len(items) + len(outbox), ex)
+            )
+            items.extend(outbox)
+            outbox.clear()
+            outbox.extend(items)
+            await asyncio.sleep(next(delays))
+            event.set()
+
+
+def encode(items, format):
+    """
+    Encode batch of sensor data items as Redis message.
+
+    Sensor data values have to be scalar for `Format.BINARY` format, i.e.
+    raw accelerometer data can be published with other formats only.
+    Sensor data items with vector values are skipped with a warning and
+    `None` is returned if there are no other sensor data items.
+
+    Batches of sensor data values, see `dshrub.data.Batch`, are expanded
+    into sensor data items.
+
+    :param items: Collection of sensor data items.
+    :param format: Format of the message, `Format.BATCH` or
+        `Format.BINARY`.
+    """
+    names, clock, times, values = _columns(items)
+    if format == Format.BATCH:
+        data = {
+            'name': names,
+            'clock': clock,
+            'time': times,
+            'value': [np.asarray(v, dtype=float).tolist() for v in values],
+        }
+        return json.dumps(data)
+
+    rows = list(zip(names, clock, times, values))
+    scalar = [r for r in rows if np.ndim(r[3]) == 0]
+    if len(scalar) < len(rows):
+        _warn_skipped({r[0] for r in rows if np.ndim(r[3]) != 0})
+    if not scalar:
+        return None
+    names, clock, times, values = zip(*scalar)
+
+    keys = sorted(set(names))
+    index = {k: i for i, k in enumerate(keys)}
+    keys = [k.encode() for k in keys]
+
+    header = BIN_HEADER.pack(BIN_MAGIC, len(names), len(keys))
+    keys = b''.join(struct.pack('<B', len(k)) + k for k in keys)
+    columns = (
+        np.array([index[n] for n in names], dtype='<u2'),
+        np.array(clock, dtype='<f8'),
+        np.array(times, dtype='<f8'),
+        np.array(values, dtype='<f8'),
+    )
+    return header + keys + b''.join(c.tobytes() for c in columns)
+
+
+def decode(data):
+    """
+    Decode Redis message into list of sensor data items.
+
+    Each sensor data item is a dictionary compatible with `n23.core.Data`
+    class. All formats of messages, see `Format` class, are supported.
+
+    :param data: Redis message.
+    """
+    if data[:2] == BIN_MAGIC:
+        _, n, k = BIN_HEADER.unpack_from(data)
+        offset = BIN_HEADER.size
+        keys = []
+        for i in range(k):
+            size = data[offset]
+            keys.append(data[offset + 1:offset + 1 + size].decode())
+            offset += size + 1
+
+        index = np.frombuffer(data, dtype='<u2', count=n, offset=offset)
+        offset += index.nbytes
+        columns = np.frombuffer(data, dtype='<f8', count=3 * n, offset=offset)
+        names = [keys[i] for i in index.tolist()]
+        clock, times, values = columns.reshape(3, n).tolist()
+    else:
+        item = json.loads(data.decode())
+        if not isinstance(item['name'], list):
+            return [item]
+        names, clock, times, values = \
+            item['name'], item['clock'], item['time'], item['value']
+
+    items = zip(names, clock, times, values)
+    return [
+        {'name': n, 'clock': c, 'time': t, 'value': v}
+        for n, c, t, v in items
+    ]
+
+
+def _warn_skipped(names):
+    names = names - _skipped
+    if names:
+        logger.warning(
+            'vector sensor data not supported by binary format, skipping'
+            ' {}'.format(', '.join(sorted(names)))
+        )
+        _skipped.update(names)
+
+
+def _columns(items):
+    if not any(isinstance(v, Batch) for v in items):
+        return zip(*items)
+
+    names, clock, times, values = [], [], [], []
+    for v in items:
+        if isinstance(v, Batch):
+            n = len(v.time)
+            names.extend([v.name] * n)
+            clock.extend([v.clock] * n)
+            times.extend(v.time.tolist())
+            values.extend(v.value)
+        else:
+            names.append(v.name)
+            clock.append(v.clock)
+            times.append(v.time)
+            values.append(v.value)
+    return names, clock, times, values
 
 
 # vim: sw=4:et:ai
@@ -0,0 +1,155 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Replay of sensor data from HDF5 data log files.
+
+Sensor data is read from data log files in chunks and replayed with its
+original timestamps at real time, at chosen speed-up or as fast as
+possible. Sensor data of sensors read in batches is replayed in batches.
+"""
+
+import asyncio
+import logging
+import numpy as np
+import os.path
+
+from n23 import Data
+
+from .data import Batch, dlog_files
+
+logger = logging.getLogger(__name__)
+
+# number of sensor data values read from data log file at once
+N_CHUNK = 3600
+
+
+def replay_files(path, prefix='dshrub'):
+    """
+    Get list of data log files to replay ordered by their start time.
+
+    If path is a directory, then all data log files with the prefix,
+    i.e. rotated files, are returned.
+
+    :param path: Data log file or directory.
+    :param prefix: Prefix of data log file names.
+    """
+    return dlog_files(path, prefix) if os.path.isdir(path) else [path]
+
+
+class Replay(object):
+    """
+    Sensor data replay engine.
+
+    The replay keeps its position, so it is resumed after data log file
+    rotation, see `n23.cycle`.
+    """
+    def __init__(self, files, sensors, speed=1, chunk=N_CHUNK):
+        """
+        Create sensor data replay engine.
+
+        :param files: List of data log files.
+        :param sensors: Names of sensors to replay.
+        :param speed: Replay speed-up factor, replay as fast as possible if
+            zero or `None`.
+        :param chunk: Number of sensor data values read at once.
+        """
+        super().__init__()
+        self.files = files
+        self.sensors = sensors
+        self.speed = speed
+        self.chunk = chunk
+        self._ticks = self._read()
+
+
+    async def run(self, consumer, notify=None):
+        """
+        Replay sensor data.
+
+        Sensor data items are sent to consumer. The notification function
+        is called after all sensor data items of a tick are sent.
+
+        :param consumer: Function receiving sensor data items.
+        :param notify: Function called once per tick.
+        """
+        loop = asyncio.get_event_loop()
+        start = None
+        for i, (time, items) in enumerate(self._ticks):
+            if not self.speed:
+                # let other coroutines process the sensor data
+                if i % self.chunk == 0:
+                    await asyncio.sleep(0)
+            elif start is None:
+                start = time, loop.time()
+            else:
+                delay = start[1] + (time - start[0]) / self.speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            for item in items:
+                consumer(item)
+            if notify:
+                notify()
+
+        logger.info('replay finished')
+
+
+    def _read(self):
+        import h5py
+
+        for fn in self.files:
+            logger.info('replaying data file {}'.format(fn))
+            with h5py.File(fn, 'r') as f:
+                yield from self._read_file(f)
+
+
+    def _read_file(self, f):
+        start = f.attrs['start']
+        interval = f.attrs.get('interval', 1)
+        sensors = [s for s in self.sensors if s in f]
+        n = max((len(f[s]) for s in sensors), default=0)
+
+        for i in range(0, n, self.chunk):
+            data = []
+            batches = []
+            for s in sensors:
+                values = f[s][i:i + self.chunk]
+                if s + '_time' in f:
+                    times = f[s + '_time'][i:i + self.chunk]
+                    batches.append((s, times, values))
+                    continue
+                valid = ~np.isnan(values.reshape(len(values), -1)).any(axis=1)
+                data.append((s, values.tolist(), valid.tolist()))
+
+            for k in range(min(self.chunk, n - i)):
+                clock = i + k
+                time = start + clock * interval
+                items = [
+                    Data(s, clock, time, values[k])
+                    for s, values, valid in data
+                    if k < len(values) and valid[k]
+                ]
+                for s, times, values in batches:
+                    idx = ~np.isnan(times[k]) if k < len(times) else None
+                    if idx is not None and idx.any():
+                        item = Batch(s, clock, times[k][idx], values[k][idx])
+                        items.append(item)
+                yield time, items
+
+# vim: sw=4:et:ai
@@ -0,0 +1,40 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Delays of reconnecting to Redis server and sensor devices.
+"""
+
+
+def backoff(start=0.5, limit=30):
+    """
+    Generate delays, in seconds, for reconnecting to a server or a device.
+
+    The delay is doubled until it reaches the limit.
+
+    :param start: Initial delay.
+    :param limit: Maximum delay.
+    """
+    delay = start
+    while True:
+        yield delay
+        delay = min(delay * 2, limit)
+
+
+# vim: sw=4:et:ai
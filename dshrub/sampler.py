@@ -0,0 +1,152 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Reading of sensors at their own sampling intervals.
+
+Sensors, which sampling interval is different than interval of the
+scheduler, are read in a loop. Sensor data values are collected and sent
+to the consumer once per scheduler tick. Values of sensors read faster
+than the scheduler ticks are sent as one batch.
+"""
+
+import asyncio
+import logging
+import math
+import numpy as np
+import time
+
+from n23 import Data
+
+from .data import Batch
+
+logger = logging.getLogger(__name__)
+
+
+def parse_intervals(items):
+    """
+    Parse sampling intervals of sensors.
+
+    Dictionary of intervals is returned for `SENSOR=SECONDS` items.
+
+    :param items: Collection of sensor sampling interval specifications.
+    """
+    intervals = {}
+    for v in items:
+        name, sep, interval = v.partition('=')
+        try:
+            interval = float(interval)
+        except ValueError:
+            interval = 0
+        if not sep or interval <= 0:
+            raise ValueError('invalid sensor interval: {}'.format(v))
+        intervals[name] = interval
+    return intervals
+
+
+def batch_size(interval, tick):
+    """
+    Get number of sensor data values read by a sensor within one
+    scheduler tick.
+
+    One extra value is allowed due to jitter of sensor reads.
+
+    :param interval: Sampling interval of the sensor.
+    :param tick: Scheduler interval.
+    """
+    return math.ceil(tick / interval) + 1
+
+
+class Sampler(object):
+    """
+    Sensor reader sampling a sensor at its own interval.
+
+    The sensor is read in a loop by `run` coroutine. The `notify` method,
+    called once per scheduler tick, sends collected sensor data values to
+    the consumer - as `dshrub.data.Batch` item if the sensor is read
+    faster than the scheduler ticks, or as `n23.core.Data` items otherwise.
+    """
+    def __init__(self, name, read, interval, consumer, tick=1):
+        """
+        Create sensor reader.
+
+        :param name: Sensor name.
+        :param read: Coroutine function reading sensor data value.
+        :param interval: Sampling interval of the sensor.
+        :param consumer: Function receiving sensor data items.
+        :param tick: Scheduler interval.
+        """
+        super().__init__()
+        self.name = name
+        self.read = read
+        self.interval = interval
+        self.consumer = consumer
+        self.batch = interval < tick
+        self.clock = 0
+
+        self._times = []
+        self._values = []
+
+
+    async def run(self):
+        """
+        Read sensor data values in a loop.
+        """
+        logger.info('reading sensor {} every {}s'.format(
+            self.name, self.interval
+        ))
+        loop = asyncio.get_event_loop()
+        deadline = loop.time()
+        while True:
+            value = await self.read()
+            if value is not None:
+                self._times.append(time.time())
+                self._values.append(value)
+
+            deadline += self.interval
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                # reading is late, skip missed reads
+                deadline = loop.time()
+
+
+    def notify(self, *args):
+        """
+        Send sensor data values read since previous scheduler tick to the
+        consumer.
+        """
+        times, values = self._times, self._values
+        if times and self.batch:
+            item = Batch(
+                self.name, self.clock, np.array(times, dtype=np.float64),
+                np.array(values, dtype=np.float64)
+            )
+            self.consumer(item)
+        elif times:
+            for t, v in zip(times, values):
+                self.consumer(Data(self.name, self.clock, t, v))
+
+        self._times = []
+        self._values = []
+        self.clock += 1
+
+
+# vim: sw=4:et:ai
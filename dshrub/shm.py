@@ -0,0 +1,432 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Sensor data cache in shared memory.
+
+One process writes sensor data into the cache and other processes, i.e.
+forked HTTP workers, read it without locking. The memory is inherited by
+forked processes.
+
+The cache can be kept in a memory-mapped file as well. The file survives
+restart of a process, which maps it again and keeps appending sensor
+data, and other local tools can read it, see `open_cache` function.
+
+Shared memory block of a sensor contains total number of values written
+to its ring buffer, followed by array of sensor data times and array of
+sensor data values. Readers never read the oldest part of the ring
+buffer, which size is `margin`. The data is copied by a reader and the
+copy is valid if the writer did not write more than `margin` values
+meanwhile, otherwise reading is retried.
+"""
+
+import asyncio
+import json
+import logging
+import mmap
+import numpy as np
+import os
+import struct
+from contextlib import suppress
+from multiprocessing.shared_memory import SharedMemory
+
+from .data import LEVELS, N_DATA, Cache, RingBuffer
+
+logger = logging.getLogger(__name__)
+
+# size of header of shared memory block of a ring buffer
+HEADER_SIZE = 8
+
+# header of memory-mapped cache file - magic and size of JSON document
+# with list of sensors and sizes of their ring buffers
+FILE_HEADER = struct.Struct('<4sI')
+FILE_MAGIC = b'DSC1'
+
+# interval of flushing memory-mapped cache file to disk, in seconds
+SYNC_INTERVAL = 60
+
+
+def margin_size(maxsize):
+    """
+    Get number of the oldest values of a shared ring buffer, which are not
+    read by readers.
+
+    :param maxsize: Size of the ring buffer.
+    """
+    return max(1, maxsize // 64)
+
+
+class SharedRingBuffer(RingBuffer):
+    """
+    Ring buffer of sensor data values in shared memory.
+
+    The writer uses ring buffer methods as usual. A reader gets copies of
+    sensor data with `select` and `tail` methods.
+    """
+    def __init__(self, maxsize, buffer, writer=False):
+        """
+        Create ring buffer in shared memory.
+
+        :param maxsize: Maximum number of values kept in the buffer.
+        :param buffer: Shared memory buffer.
+        :param writer: True if the buffer is created by the writer.
+        """
+        super().__init__(0)
+        self.maxsize = maxsize
+        self.writer = writer
+        self.margin = 0 if writer else margin_size(maxsize)
+
+        n = maxsize * 8
+        self._count = np.ndarray(1, np.int64, buffer)
+        self._time = np.ndarray(maxsize, np.float64, buffer, HEADER_SIZE)
+        self._value = np.ndarray(maxsize, np.float64, buffer, HEADER_SIZE + n)
+        self._sync()
+
+
+    @property
+    def count(self):
+        """
+        Total number of values written to the buffer.
+        """
+        return int(self._count[0])
+
+
+    def append(self, time, value):
+        super().append(time, value)
+        self._count[0] += 1
+
+
+    def extend(self, times, values):
+        super().extend(times, values)
+        self._count[0] += min(len(times), self.maxsize)
+
+
+    def clear(self):
+        super().clear()
+        self._count[0] = 0
+
+
+    def segments(self):
+        if not self.writer:
+            self._sync()
+        return super().segments()
+
+
+    def select(self, start=-np.inf, end=np.inf):
+        if self.writer:
+            return super().select(start, end)
+
+        while True:
+            count = self._sync()
+            times, values = super().select(start, end)
+            times, values = times.copy(), values.copy()
+            if self.count - count <= self.margin:
+                return times, values
+
+
+    def tail(self, count):
+        """
+        Get copy of sensor data values written after `count` values.
+
+        Tuple `(times, values, count)` is returned, where `count` is total
+        number of values written to the buffer.
+
+        :param count: Number of values written to the buffer, i.e. since
+            previous call of the method.
+        """
+        while True:
+            current = self._sync()
+            n = min(current - count, self._size)
+            idx = np.arange(current - n, current) % self.maxsize
+            times, values = self._time[idx], self._value[idx]
+            if self.count - current <= self.margin:
+                return times, values, current
+
+
+    def __len__(self):
+        if not self.writer:
+            self._sync()
+        return super().__len__()
+
+
+    def _sync(self):
+        count = self.count
+        self._pos = count % self.maxsize
+        self._size = min(count, self.maxsize - self.margin)
+        return count
+
+
+class SharedCache(Cache):
+    """
+    Sensor data cache with ring buffers in shared memory.
+
+    The cache does not maintain rollups of sensor data, as readers bin
+    sensor data values of the ring buffers.
+    """
+    def __init__(self, sensors, maxsize=N_DATA, intervals=None):
+        """
+        Create sensor data cache in shared memory.
+
+        :param sensors: List of sensors.
+        :param maxsize: Maximum number of values kept per sensor sampled
+            every second.
+        :param intervals: Dictionary of sampling intervals of sensors, in
+            seconds; one second by default.
+        """
+        super().__init__(sensors, maxsize, levels=(), intervals=intervals)
+        self.memory = {}
+        for s in sensors:
+            size = self._cache[s].maxsize
+            shm = SharedMemory(create=True, size=HEADER_SIZE + 16 * size)
+            self.memory[s] = shm
+            self._cache[s] = SharedRingBuffer(size, shm.buf, writer=True)
+
+
+    def reader(self):
+        """
+        Create reader of the cache, i.e. in a forked process.
+        """
+        return CacheReader({
+            s: (self[s].maxsize, shm.buf) for s, shm in self.memory.items()
+        })
+
+
+    def close(self):
+        """
+        Release shared memory of the cache.
+        """
+        self._cache.clear()
+        for shm in self.memory.values():
+            shm.close()
+            shm.unlink()
+        self.memory.clear()
+
+
+class MappedCache(Cache):
+    """
+    Sensor data cache with ring buffers in memory-mapped file.
+
+    If the file exists and it has ring buffers of the same sensors and of
+    the same sizes, then its sensor data is kept and rollups of sensor
+    data are rebuilt. Otherwise, the file is recreated.
+
+    The file is flushed to disk with `flush` method, i.e. periodically
+    with `sync` coroutine and on exit with `close` method.
+    """
+    def __init__(self, path, sensors, maxsize=N_DATA, levels=LEVELS,
+            intervals=None):
+        """
+        Create sensor data cache in memory-mapped file.
+
+        :param path: Path of the file.
+        :param sensors: List of sensors.
+        :param maxsize: Maximum number of values kept per sensor sampled
+            every second.
+        :param levels: Width of rollup buckets in seconds.
+        :param intervals: Dictionary of sampling intervals of sensors, in
+            seconds; one second by default.
+        """
+        super().__init__(sensors, maxsize, levels, intervals)
+        self.path = path
+
+        sizes = [(s, self._cache[s].maxsize) for s in sensors]
+        header = _file_header(sizes)
+        offsets = _file_offsets(len(header), sizes)
+        size = offsets[-1][1] if offsets else len(header)
+
+        with open(path, 'a+b') as f:
+            f.seek(0)
+            current = f.read(len(header))
+            if current != header or os.fstat(f.fileno()).st_size != size:
+                if current:
+                    logger.warning(
+                        'cache file {} does not match sensors, recreating'
+                        .format(path)
+                    )
+                f.truncate(0)
+                f.write(header)
+                f.truncate(size)
+            self._mmap = mmap.mmap(f.fileno(), size)
+
+        buffer = memoryview(self._mmap)
+        self._buffers = {
+            s: (n, buffer[start:end])
+            for (s, n), (start, end) in zip(sizes, offsets)
+        }
+        for s, (n, b) in self._buffers.items():
+            data = SharedRingBuffer(n, b, writer=True)
+            self._cache[s] = data
+            for r in self._levels[s]:
+                r.extend(*data.data())
+
+        logger.info('cache file {} mapped, {} values'.format(
+            path, sum(len(self._cache[s]) for s in sensors)
+        ))
+
+
+    def reader(self):
+        """
+        Create reader of the cache, i.e. in a forked process.
+        """
+        return CacheReader(self._buffers)
+
+
+    def flush(self):
+        """
+        Flush the memory-mapped file to disk.
+        """
+        self._mmap.flush()
+
+
+    def close(self):
+        """
+        Flush and unmap the memory-mapped file.
+        """
+        self.flush()
+        self._cache.clear()
+        self._levels.clear()
+        self._buffers.clear()
+        # buffer might be still used, i.e. by a HTTP response
+        with suppress(BufferError):
+            self._mmap.close()
+
+
+class CacheReader(object):
+    """
+    Reader of sensor data cache in shared memory.
+
+    The reader is compatible with `dshrub.data.Cache` class for binning
+    of sensor data, see `dshrub.data.bin_cache` function.
+    """
+    def __init__(self, buffers):
+        """
+        Create reader of sensor data cache in shared memory.
+
+        :param buffers: Dictionary of sensor names and pairs of ring buffer
+            size and shared memory buffer.
+        """
+        super().__init__()
+        self._cache = {
+            s: SharedRingBuffer(n, b) for s, (n, b) in buffers.items()
+        }
+
+
+    def __getitem__(self, name):
+        return self._cache[name]
+
+
+    def levels(self, name):
+        """
+        Get rollups of sensor data of a sensor, which are not available
+        for the cache in shared memory.
+
+        :param name: Sensor name.
+        """
+        return []
+
+
+    def items(self):
+        """
+        Get `(name, buffer)` pairs of sensors and their ring buffers.
+        """
+        return self._cache.items()
+
+
+def open_cache(path):
+    """
+    Open memory-mapped cache file for reading.
+
+    The file is mapped read-only and its sensor data is not copied until
+    it is read.
+
+    :param path: Path of the file.
+    """
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, size = FILE_HEADER.unpack_from(data)
+    if magic != FILE_MAGIC:
+        raise ValueError('not a cache file: {}'.format(path))
+    k = FILE_HEADER.size
+    sizes = json.loads(data[k:k + size].decode())['sensors']
+
+    offsets = _file_offsets(len(_file_header(sizes)), sizes)
+    buffer = memoryview(data)
+    return CacheReader({
+        s: (n, buffer[i:j]) for (s, n), (i, j) in zip(sizes, offsets)
+    })
+
+
+async def sync(cache, interval=SYNC_INTERVAL):
+    """
+    Flush memory-mapped cache file to disk periodically.
+
+    :param cache: Sensor data cache in memory-mapped file.
+    :param interval: Flush interval in seconds.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        cache.flush()
+
+
+async def follow(cache, callback, interval=1):
+    """
+    Poll sensor data cache in shared memory for new sensor data values.
+
+    New sensor data values are sent to the callback as list of
+    dictionaries compatible with `n23.core.Data` class. Total number of
+    values written to ring buffer of a sensor is used as sensor data
+    clock.
+
+    :param cache: Reader of sensor data cache in shared memory.
+    :param callback: Function receiving list of sensor data items.
+    :param interval: Polling interval in seconds.
+    """
+    counts = {s: data.count for s, data in cache.items()}
+    while True:
+        await asyncio.sleep(interval)
+        items = []
+        for s, data in cache.items():
+            times, values, count = data.tail(counts[s])
+            clock = range(count - len(times), count)
+            items.extend(
+                {'name': s, 'clock': c, 'time': t, 'value': v}
+                for c, t, v in zip(clock, times.tolist(), values.tolist())
+            )
+            counts[s] = count
+        if items:
+            callback(items)
+
+
+def _file_header(sizes):
+    data = json.dumps({'sensors': [list(v) for v in sizes]}).encode()
+    header = FILE_HEADER.pack(FILE_MAGIC, len(data)) + data
+    return header + bytes(-len(header) % 8)
+
+
+def _file_offsets(start, sizes):
+    offsets = []
+    for _, n in sizes:
+        end = start + HEADER_SIZE + 16 * n
+        offsets.append((start, end))
+        start = end
+    return offsets
+
+
+# vim: sw=4:et:ai
@@ -0,0 +1,362 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Rolling statistics of sensor data.
+
+Statistics of sensor data values are updated for each sensor data value
+over sliding time windows, i.e. last minute or last hour. Adding a value
+and expiring the oldest values costs amortized constant time, so the
+statistics do not need raw sensor data to be kept or reduced on request.
+
+Percentiles are estimated with a sketch of logarithmic buckets with
+relative accuracy, which supports removal of expired values.
+"""
+
+import math
+from collections import Counter, deque
+from n23 import Data
+
+from .data import Batch
+
+# default sliding time windows, in seconds
+WINDOWS = (60,)
+
+# statistics of sensor data values sent to consumer
+STATS = ('mean', 'min', 'max', 'stddev', 'p50', 'p90', 'p99')
+
+# default period of sending statistics to consumer, in scheduler ticks
+PERIOD = 10
+
+# relative accuracy of estimated percentiles
+ACCURACY = 0.01
+
+
+def stats_name(sensor, stat, window):
+    """
+    Get name of sensor data series of a rolling statistic.
+
+    :param sensor: Sensor name.
+    :param stat: Statistic name, i.e. `mean`.
+    :param window: Sliding time window in seconds.
+    """
+    return '{}_{}_{}'.format(sensor, stat, window)
+
+
+class Sketch(object):
+    """
+    Sketch of sensor data values to estimate percentiles.
+
+    Values are counted in buckets with logarithmic bounds, so estimated
+    percentile is within relative accuracy of real value.
+    """
+    def __init__(self, accuracy=ACCURACY):
+        """
+        Create sketch.
+
+        :param accuracy: Relative accuracy of estimated percentiles.
+        """
+        super().__init__()
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.count = 0
+
+        self._log_gamma = math.log(self.gamma)
+        self._positive = Counter()
+        self._negative = Counter()
+        self._zero = 0
+
+
+    def add(self, value, n=1):
+        """
+        Add value to the sketch.
+
+        :param value: Sensor data value.
+        :param n: Number of values, negative to remove the value.
+        """
+        self.count += n
+        if value == 0:
+            self._zero += n
+            return
+
+        if value > 0:
+            store, key = self._positive, self._key(value)
+        else:
+            store, key = self._negative, self._key(-value)
+        store[key] += n
+        if not store[key]:
+            del store[key]
+
+
+    def remove(self, value):
+        """
+        Remove value from the sketch.
+
+        :param value: Sensor data value added to the sketch before.
+        """
+        self.add(value, -1)
+
+
+    def percentile(self, p):
+        """
+        Estimate percentile of sensor data values.
+
+        :param p: Percentile, i.e. 99.
+        """
+        if not self.count:
+            return None
+
+        rank = p / 100 * (self.count - 1)
+        buckets = [
+            (-self._value(k), n)
+            for k, n in sorted(self._negative.items(), reverse=True)
+        ]
+        buckets.append((0, self._zero))
+        buckets.extend(
+            (self._value(k), n) for k, n in sorted(self._positive.items())
+        )
+
+        total = 0
+        for value, n in buckets:
+            total += n
+            if total > rank:
+                return value
+        return buckets[-1][0]
+
+
+    def _key(self, value):
+        return math.ceil(math.log(value) / self._log_gamma)
+
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+
+class RollingStats(object):
+    """
+    Statistics of sensor data values within sliding time window.
+
+    Mean and standard deviation are calculated with running sums of
+    values shifted by the first value to avoid loss of precision. Minimum
+    and maximum are kept with monotonic queues.
+    """
+    def __init__(self, window, accuracy=ACCURACY):
+        """
+        Create rolling statistics.
+
+        :param window: Sliding time window in seconds.
+        :param accuracy: Relative accuracy of estimated percentiles.
+        """
+        super().__init__()
+        self.window = window
+        self.sketch = Sketch(accuracy)
+
+        self._values = deque()
+        self._min = deque()
+        self._max = deque()
+        self._shift = None
+        self._sum = 0
+        self._sum2 = 0
+
+
+    def add(self, time, value):
+        """
+        Add sensor data value and expire values out of the time window.
+
+        :param time: Sensor data time.
+        :param value: Sensor data value.
+        """
+        if self._shift is None:
+            self._shift = value
+
+        self._values.append((time, value))
+        x = value - self._shift
+        self._sum += x
+        self._sum2 += x * x
+        self.sketch.add(value)
+
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((time, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((time, value))
+
+        self.expire(time)
+
+
+    def expire(self, time):
+        """
+        Expire values out of the time window ending at given time.
+
+        :param time: Current time.
+        """
+        self._expire(time - self.window)
+
+
+    def snapshot(self):
+        """
+        Get dictionary of statistics of sensor data values.
+        """
+        n = len(self._values)
+        if not n:
+            return {s: None for s in STATS}
+
+        mean = self._sum / n
+        variance = max(self._sum2 / n - mean * mean, 0)
+        p = self.sketch.percentile
+        return {
+            'mean': mean + self._shift,
+            'min': self._min[0][1],
+            'max': self._max[0][1],
+            'stddev': math.sqrt(variance),
+            'p50': p(50),
+            'p90': p(90),
+            'p99': p(99),
+        }
+
+
+    def __len__(self):
+        return len(self._values)
+
+
+    def _expire(self, start):
+        values = self._values
+        while values and values[0][0] <= start:
+            _, value = values.popleft()
+            x = value - self._shift
+            self._sum -= x
+            self._sum2 -= x * x
+            self.sketch.remove(value)
+
+        for q in (self._min, self._max):
+            while q and q[0][0] <= start:
+                q.popleft()
+
+
+class Stats(object):
+    """
+    Sensor data stage calculating rolling statistics of sensor data.
+
+    Sensor data values are received with `put` method. On every `period`
+    call of `notify` method, i.e. once per `period` scheduler ticks, the
+    statistics are sent to the consumer as sensor data items of separate
+    sensor data series, see `stats_name` function.
+
+    The current time is the time of the newest sensor data value received.
+    Before the statistics are sent, values out of the time windows ending
+    at the current time are expired, so statistics of a sensor, which
+    stopped sending sensor data, are not sent once its time windows are
+    empty.
+
+    The current statistics of all sensors are returned by `snapshot`
+    method.
+    """
+    def __init__(self, consumer, sensors, windows=WINDOWS, period=PERIOD):
+        """
+        Create sensor data stage.
+
+        :param consumer: Function receiving sensor data items.
+        :param sensors: Names of sensors with scalar sensor data values.
+        :param windows: Sliding time windows in seconds.
+        :param period: Period of sending statistics to the consumer in
+            scheduler ticks.
+        """
+        super().__init__()
+        self.consumer = consumer
+        self.sensors = sensors
+        self.windows = windows
+        self.period = period
+        self.clock = 0
+
+        self._stats = {
+            s: [RollingStats(w) for w in windows] for s in sensors
+        }
+        self._now = -math.inf
+        self._ticks = 0
+
+
+    def names(self):
+        """
+        Get names of sensor data series of rolling statistics.
+        """
+        return [
+            stats_name(s, stat, w)
+            for s in self.sensors for w in self.windows for stat in STATS
+        ]
+
+
+    def put(self, item):
+        """
+        Receive sensor data item.
+
+        :param item: Sensor data item.
+        """
+        stats = self._stats.get(item.name)
+        if stats is None:
+            return
+
+        if isinstance(item, Batch):
+            values = zip(item.time.tolist(), item.value.tolist())
+        else:
+            values = [(item.time, item.value)]
+
+        for t, v in values:
+            if not math.isfinite(v):
+                continue
+            for s in stats:
+                s.add(t, v)
+            self._now = max(self._now, t)
+
+
+    def notify(self, *args):
+        """
+        Send statistics of sensor data to the consumer every `period`
+        calls.
+        """
+        self._ticks += 1
+        if self._ticks < self.period:
+            return
+        self._ticks = 0
+
+        t = self._now
+        for sensor, stats in self._stats.items():
+            for w, s in zip(self.windows, stats):
+                s.expire(t)
+                if not len(s):
+                    continue
+                for stat, v in s.snapshot().items():
+                    name = stats_name(sensor, stat, w)
+                    self.consumer(Data(name, self.clock, t, v))
+        self.clock += 1
+
+
+    def snapshot(self):
+        """
+        Get dictionary of statistics of sensor data values for each sensor
+        and time window.
+        """
+        return {
+            sensor: {
+                str(w): s.snapshot() for w, s in zip(self.windows, stats)
+            }
+            for sensor, stats in self._stats.items()
+        }
+
+
+# vim: sw=4:et:ai
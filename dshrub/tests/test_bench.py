@@ -0,0 +1,83 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for benchmarks of sensor data processing.
+"""
+
+import json
+
+from dshrub.bench import STARTUP, bench_cache_add, bench_publish, \
+    bench_startup, generate, stats
+from dshrub.redis import Format
+
+
+def test_generate():
+    """
+    Test generating batches of synthetic sensor data
+    """
+    batches = generate(2, 10, 3, start=100)
+    assert 30 == len(batches)
+    assert ['sensor-0', 'sensor-1'] == [v.name for v in batches[0]]
+    assert 100.1 == batches[1][0].time
+    assert 1 == batches[1][1].clock
+
+
+def test_stats():
+    """
+    Test creating benchmark result
+    """
+    result = stats(100, 2, [0.1, 0.2, 0.3])
+    assert 50 == result['samples_per_s']
+    assert 0.2 == result['latency']['p50']
+    assert 0.3 == result['latency_max']
+
+    # result is saved as JSON
+    json.dumps(result)
+
+
+def test_bench_cache_add():
+    """
+    Test data cache benchmark
+    """
+    result = bench_cache_add(generate(3, 1, 100), 50)
+    assert 300 == result['samples']
+
+
+def test_bench_publish():
+    """
+    Test Redis channel publishing benchmark with Redis server stand-in
+    """
+    for f in Format:
+        result = bench_publish(generate(2, 1, 10), f)
+        assert 20 == result['samples']
+        assert result['latency']['p50'] > 0
+
+
+def test_bench_startup():
+    """
+    Test that applications do not import on demand modules on start
+    """
+    result = bench_startup(repeat=1)
+    for app, (_, needed) in STARTUP.items():
+        assert set(result[app]['modules']) <= set(needed), app
+        assert result[app]['import_s'] > 0
+
+
+# vim: sw=4:et:ai
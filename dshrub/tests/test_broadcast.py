@@ -0,0 +1,105 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for fan-out of sensor data to multiple subscribers.
+"""
+
+from n23 import Topic
+from dshrub.broadcast import Broadcast, Overflow
+
+from .util import patch_async, run_coroutine, run_until_complete
+
+
+def test_broadcast_copy():
+    """
+    Test copying sensor data batch to all subscribers.
+    """
+    broadcast = Broadcast()
+    with broadcast.subscribe() as s1, broadcast.subscribe() as s2:
+        broadcast.put([1, 2])
+        assert [1, 2] == run_until_complete(s1.get())
+        assert [1, 2] == run_until_complete(s2.get())
+
+    assert not broadcast.subscribers
+
+
+def test_broadcast_run():
+    """
+    Test reading sensor data batches once and copying them to subscribers.
+    """
+    topic = Topic()
+    broadcast = Broadcast()
+    with broadcast.subscribe() as s1, broadcast.subscribe() as s2:
+        with patch_async(topic, 'get') as f:
+            f.side_effect = [[1], [2]]
+            run_coroutine(broadcast.run(f))
+
+        assert [[1], [2]] == list(s1._items)
+        assert [[1], [2]] == list(s2._items)
+
+
+def test_overflow_drop():
+    """
+    Test dropping the oldest sensor data batch on queue overflow.
+    """
+    broadcast = Broadcast(2, Overflow.DROP)
+    with broadcast.subscribe() as s:
+        for i in range(4):
+            broadcast.put([i])
+
+        assert [[2], [3]] == list(s._items)
+        assert 2 == s.dropped
+
+    # statistics are kept when subscriber is removed
+    assert 2 == broadcast.dropped
+
+
+def test_overflow_latest():
+    """
+    Test keeping the latest sensor data batch only on queue overflow.
+    """
+    broadcast = Broadcast(2, Overflow.LATEST)
+    with broadcast.subscribe() as s:
+        for i in range(3):
+            broadcast.put([i])
+
+        assert [[2]] == list(s._items)
+        assert 2 == s.dropped
+
+
+def test_overflow_disconnect():
+    """
+    Test disconnecting subscriber on queue overflow.
+    """
+    async def read(s):
+        return [v async for v in s]
+
+    broadcast = Broadcast(2, Overflow.DISCONNECT)
+    with broadcast.subscribe() as s:
+        for i in range(3):
+            broadcast.put([i])
+
+        assert s.closed
+        assert [] == run_until_complete(read(s))
+
+    assert 1 == broadcast.disconnected
+
+
+# vim: sw=4:et:ai
@@ -22,10 +22,16 @@ Unit tests fo sensor data processing functions.
 """
 
 import asyncio
+import h5py
+import numpy as np
+import os.path
+import tempfile
+import time
 from n23 import Data, Topic
-from dshrub.data import bin_data, cache_data, Cache
+from dshrub.data import bin_data, bin_cache, bin_cache_grid, cache_data, \
+    preload_data, read_data, Batch, Cache, RingBuffer, Rollup
 
-from .util import patch_async, run_coroutine
+from .util import patch_async, run_coroutine, run_until_complete
 
 
 def test_bin_data():
@@ -45,6 +51,272 @@ def test_bin_data():
     #assert [1.2, 1.4, 1.6] == [v[0] for v in result]
 
 
+def test_bin_data_ring_buffer():
+    """
+    Test binning of sensor data stored in ring buffer.
+    """
+    data = RingBuffer(6)
+    data.extend([1.1, 1.2, 1.3, 1.4, 1.5, 1.6], [2, 3, 4, 6, 8, 9])
+    result = bin_data(data, 'mean', 3)
+    assert [2.5, 5.0, 8.5] == [v[1] for v in result]
+
+
+def test_bin_data_empty():
+    """
+    Test binning of empty sensor data.
+    """
+    assert [] == bin_data(RingBuffer(6), 'mean', 3)
+
+
+def test_bin_data_lttb():
+    """
+    Test downsampling of sensor data with LTTB algorithm keeping a spike.
+    """
+    times = np.arange(1000, dtype=np.float64)
+    values = np.sin(times / 100)
+    values[333] = 10
+    data = RingBuffer(1000)
+    data.extend(times, values)
+
+    result = bin_data(data, 'lttb', 50)
+    assert 50 == len(result)
+    assert [0, values[0]] == result[0]
+    assert [999, values[999]] == result[-1]
+    assert [333, 10] in result
+    assert sorted(result) == result
+
+
+def test_bin_data_lttb_small():
+    """
+    Test downsampling of sensor data with LTTB algorithm when there are
+    less values than requested.
+    """
+    data = RingBuffer(6)
+    data.extend([1.0, 2.0, 3.0], [2, np.nan, 4])
+    assert [[1, 2], [3, 4]] == bin_data(data, 'lttb', 10)
+
+
+def test_bin_data_lttb_few_bins():
+    """
+    Test downsampling of sensor data with LTTB algorithm to less than three
+    values.
+    """
+    data = RingBuffer(10)
+    data.extend(np.arange(10.0), np.arange(10.0) * 2)
+    assert [[0, 0], [9, 18]] == bin_data(data, 'lttb', 2)
+    assert [[0, 0]] == bin_data(data, 'lttb', 1)
+
+
+def test_bin_data_minmax():
+    """
+    Test downsampling of sensor data to envelope of minimum and maximum
+    values.
+    """
+    times = np.arange(100, dtype=np.float64)
+    values = times % 10
+    values[55] = -5
+    data = RingBuffer(100)
+    data.extend(times, values)
+
+    result = bin_data(data, 'minmax', 5)
+    assert 10 == len(result)
+    assert [55, -5] in result
+    assert [-5, 9] == [min(v for _, v in result), max(v for _, v in result)]
+    assert sorted(result) == result
+
+
+def test_ring_buffer_wrap():
+    """
+    Test ring buffer returning data in order when wrapped around.
+    """
+    data = RingBuffer(3)
+    for i in range(5):
+        data.append(1000 + i, 100 + i)
+
+    assert 3 == len(data)
+    assert [(1002, 102), (1003, 103), (1004, 104)] == list(data)
+
+    segments = data.segments()
+    assert 2 == len(segments)
+    assert [1002, 1003, 1004] == \
+        [t for times, _ in segments for t in times]
+
+    times, values = data.data()
+    assert [1002, 1003, 1004] == times.tolist()
+    assert [102, 103, 104] == values.tolist()
+
+
+def test_ring_buffer_view():
+    """
+    Test ring buffer returning view of data when not wrapped around.
+    """
+    data = RingBuffer(4)
+    data.extend([1001, 1002, 1003], [101, 102, 103])
+    times, values = data.data()
+    data.append(1004, 104)
+    assert [1001, 1002, 1003] == times.tolist()
+    assert times.base is not None
+
+
+def test_ring_buffer_extend():
+    """
+    Test extending ring buffer with arrays over the buffer boundary.
+    """
+    data = RingBuffer(3)
+    data.append(1000, 100)
+    data.append(1001, 101)
+    data.extend([1002, 1003, 1004, 1005], [102, 103, 104, 105])
+    assert [(1003, 103), (1004, 104), (1005, 105)] == list(data)
+
+
+def test_ring_buffer_select():
+    """
+    Test selecting time range of sensor data from ring buffer.
+    """
+    data = RingBuffer(4)
+    for i in range(6):
+        data.append(1000 + i, 100 + i)
+
+    times, values = data.select(1003, 1004)
+    assert [1003, 1004] == times.tolist()
+    assert [103, 104] == values.tolist()
+
+    times, values = data.select(1001, 1003)
+    assert [1002, 1003] == times.tolist()
+
+    times, values = data.select(1006)
+    assert [] == times.tolist()
+
+
+def test_rollup_add():
+    """
+    Test adding sensor data values to rollup.
+    """
+    rollup = Rollup(10, 4)
+    for t, v in [(1, 2), (5, 4), (12, 1), (13, float('nan')), (25, 3)]:
+        rollup.add(t, v)
+
+    times, count, total, vmin, vmax = rollup.data()
+    assert [0, 10, 20] == times.tolist()
+    assert [2, 1, 1] == count.tolist()
+    assert [6, 1, 3] == total.tolist()
+    assert [2, 1, 3] == vmin.tolist()
+    assert [4, 1, 3] == vmax.tolist()
+
+
+def test_rollup_extend():
+    """
+    Test adding arrays of sensor data values to rollup.
+    """
+    rollup = Rollup(10, 4)
+    rollup.add(1, 2)
+    rollup.extend([5, 12, 13, 25], [4, 1, float('nan'), 3])
+
+    times, count, total, *_ = rollup.data()
+    assert [0, 10, 20] == times.tolist()
+    assert [2, 1, 1] == count.tolist()
+    assert [6, 1, 3] == total.tolist()
+
+
+def test_bin_cache():
+    """
+    Test binning of sensor data using cache rollups.
+    """
+    cache = Cache(['n'], 3600, levels=(10,))
+    for i in range(3600):
+        cache.add(Data('n', i, i, i // 100))
+
+    result = bin_cache(cache, 'n', 'mean', 36)
+    assert list(range(36)) == [v[1] for v in result]
+
+    result = bin_cache(cache, 'n', 'max', 36)
+    assert list(range(36)) == [v[1] for v in result]
+
+    result = bin_cache(cache, 'n', 'count', 36)
+    assert [100] * 36 == [v[1] for v in result]
+
+
+def test_bin_cache_range():
+    """
+    Test binning of sensor data within time range.
+    """
+    cache = Cache(['n'], 3600, levels=(10,))
+    for i in range(3600):
+        cache.add(Data('n', i, i, i // 100))
+
+    # rollup used
+    result = bin_cache(cache, 'n', 'mean', 10, 1000, 1999)
+    assert list(range(10, 20)) == [v[1] for v in result]
+
+    # raw values used
+    result = bin_cache(cache, 'n', 'median', 2, 1000, 1199)
+    assert [10, 11] == [v[1] for v in result]
+    assert 1000 == result[0][0]
+
+
+def test_bin_cache_window():
+    """
+    Test binning of sensor data using cache rollups within time window of
+    the cache.
+    """
+    cache = Cache(['n'], 3600, levels=(10,))
+    for i in range(7205):
+        cache.add(Data('n', i, i, i))
+
+    assert 3605 == cache['n'].data()[0][0]
+    assert 360 == cache.levels('n')[0].maxsize
+
+    result = bin_cache(cache, 'n', 'min', 36)
+    assert 36 == len(result)
+    assert 3605 == result[0][0]
+
+
+def test_bin_cache_fallback():
+    """
+    Test binning of sensor data when no rollup has enough buckets.
+    """
+    cache = Cache(['n'], 3600, levels=(10,))
+    for i in range(100):
+        cache.add(Data('n', i, i, i))
+
+    assert bin_data(cache['n'], 'mean', 20) \
+        == bin_cache(cache, 'n', 'mean', 20)
+
+
+def test_bin_cache_grid():
+    """
+    Test binning of sensor data of multiple sensors on one grid of bins.
+    """
+    cache = Cache(['a', 'b', 'c'], 3601, levels=(10,))
+    for i in range(3601):
+        cache.add(Data('a', i, i, i // 100))
+    for i in range(1800, 3601):
+        cache.add(Data('b', i, i, 1))
+
+    times, values = bin_cache_grid(cache, ['a', 'b', 'c'], 'mean', 36)
+    assert list(range(0, 3600, 100)) == times.tolist()
+    assert list(range(35)) == values['a'][:35].tolist()
+    assert np.isnan(values['b'][:18]).all()
+    assert [1] * 18 == values['b'][18:].tolist()
+    assert np.isnan(values['c']).all()
+
+    # raw values used
+    times, values = bin_cache_grid(cache, ['a', 'b'], 'median', 36)
+    assert list(range(0, 3600, 100)) == times.tolist()
+    assert list(range(35)) == values['a'][:35].tolist()
+
+
+def test_bin_cache_grid_empty():
+    """
+    Test binning of sensor data of multiple sensors when there is no
+    sensor data.
+    """
+    cache = Cache(['a', 'b'], 100)
+    times, values = bin_cache_grid(cache, ['a', 'b'], 'mean', 10)
+    assert 0 == len(times)
+    assert 0 == len(values['a'])
+
+
 def test_data_cache_store_limit():
     """
     Test data cache storing no more than max size items.
@@ -85,6 +357,44 @@ def test_data_cache_store_list():
     assert [(1001, 101), (1002, 102)] == list(cache['n'])
 
 
+def test_data_cache_skip_vector():
+    """
+    Test data cache skipping sensor data items with vector values.
+    """
+    cache = Cache(['n'])
+    cache.add({'name': 'n', 'clock': 10, 'time': 1001, 'value': [1, 2, 3]})
+    cache.add(Data('n', 11, 1002, (1, 2, 3)))
+    cache.add(Batch('n', 12, np.array([1003]), np.ones((1, 3))))
+    cache.add(Data('n', 13, 1004, 104))
+    assert [(1004, 104)] == list(cache['n'])
+
+
+def test_data_cache_store_batch():
+    """
+    Test data cache storing batch of sensor data values.
+    """
+    cache = Cache(['n', 'm'], 10, intervals={'n': 0.5})
+    assert 20 == cache['n'].maxsize
+    assert 10 == cache['m'].maxsize
+
+    cache.add(Batch('n', 10, np.array([1001, 1001.5]), np.array([101, 102])))
+    cache.add(Batch('x', 10, np.array([1001]), np.array([1])))
+    assert [(1001, 101), (1001.5, 102)] == list(cache['n'])
+
+
+def test_data_cache_last_time():
+    """
+    Test getting time of the newest sensor data value in data cache.
+    """
+    cache = Cache(['n', 'm'], 3)
+    assert cache.last_time('n') is None
+
+    for i in range(5):
+        cache.add({'name': 'n', 'time': 1000 + i, 'value': i})
+    assert 1004 == cache.last_time('n')
+    assert cache.last_time('m') is None
+
+
 def test_cache_data():
     """
     Test sensor data caching coroutine.
@@ -104,4 +414,88 @@ def test_cache_data():
     assert [(1001, 101), (1002, 102)] == list(cache['test-sensor'])
 
 
+def test_read_data():
+    """
+    Test reading the last sensor data values from data log files.
+    """
+    nan = float('nan')
+    with tempfile.TemporaryDirectory() as path:
+        files = []
+        for i, values in enumerate([[1, 2, 3], [4, nan], [6, 7]]):
+            fn = os.path.join(path, 'dshrub-{}.h5'.format(i))
+            with h5py.File(fn, 'w') as f:
+                f.attrs['start'] = 1000 + 10 * i
+                f['n'] = values
+            files.append(fn)
+
+        data = read_data(files, ['n', 'x'], 5)
+
+    times, values = data['n']
+    assert [1002, 1010, 1020, 1021] == times.tolist()
+    assert [3, 4, 6, 7] == values.tolist()
+    assert ['n'] == list(data)
+
+
+def test_read_data_limit():
+    """
+    Test reading the last sensor data values from data log files with
+    maximum number of values per sensor.
+    """
+    with tempfile.TemporaryDirectory() as path:
+        files = []
+        for i in range(3):
+            fn = os.path.join(path, 'dshrub-{}.h5'.format(i))
+            with h5py.File(fn, 'w') as f:
+                f.attrs['start'] = 1000 + 10 * i
+                f['n'] = [10 * i + k for k in range(10)]
+                f['m'] = [10 * i + k for k in range(10)]
+            files.append(fn)
+
+        data = read_data(files, ['n', 'm'], {'n': 12, 'm': 3})
+
+    assert list(range(18, 30)) == data['n'][1].tolist()
+    assert [27, 28, 29] == data['m'][1].tolist()
+
+
+def test_preload_data():
+    """
+    Test preloading data cache from unordered list of data log files
+    within time window of the cache.
+    """
+    now = time.time()
+    with tempfile.TemporaryDirectory() as path:
+        files = []
+        for i, start in enumerate([-10, -20, -100, -40]):
+            fn = os.path.join(path, 'dshrub-{}.h5'.format(i))
+            with h5py.File(fn, 'w') as f:
+                f.attrs['start'] = now + start
+                f['n'] = [start + k for k in range(3)]
+            files.append(fn)
+        files.append(os.path.join(path, 'dshrub.txt'))
+        with open(files[-1], 'w') as f:
+            f.write('not a data log file')
+
+        cache = Cache(['n'], 30)
+        run_until_complete(preload_data(cache, files, ['n']))
+
+    _, values = cache['n'].data()
+    assert [-40, -39, -38, -20, -19, -18, -10, -9, -8] == values.tolist()
+
+
+def test_data_cache_preload():
+    """
+    Test preloading data cache with sensor data older than cached data.
+    """
+    cache = Cache(['n'], 4, levels=(10,))
+    cache.add(Data('n', 10, 1003, 103))
+    cache.preload('n', np.array([1000, 1001, 1002, 1003]),
+        np.array([100, 101, 102, 0]))
+
+    expected = [(1000, 100), (1001, 101), (1002, 102), (1003, 103)]
+    assert expected == list(cache['n'])
+    _, count, total, *_ = cache.levels('n')[0].data()
+    assert [4] == count.tolist()
+    assert [406] == total.tolist()
+
+
 # vim: sw=4:et:ai
@@ -0,0 +1,160 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for derived sensor data channels.
+"""
+
+import numpy as np
+
+from n23 import Data
+from dshrub.data import Batch
+from dshrub.derive import DERIVED, Derive, MovingAverage, dew_point, \
+    derived_channel, magnitude, sensor_inputs, sensor_intervals
+
+
+def test_magnitude():
+    """
+    Test calculating magnitude of vectors.
+    """
+    result = magnitude([(3, 4, 0), (1, 2, 2)])
+    assert [5, 3] == result.tolist()
+
+
+def test_dew_point():
+    """
+    Test calculating dew point.
+    """
+    result = dew_point(20.0, 50.0)
+    assert 9.26 == round(result, 2)
+
+
+def test_moving_average():
+    """
+    Test moving average over batch boundary.
+    """
+    avg = MovingAverage(3)
+    assert [1, 1.5] == avg([1, 2]).tolist()
+    assert [2, 3, 4] == avg([3, 4, 5]).tolist()
+
+
+def test_sensor_inputs():
+    """
+    Test getting sensors to read for sensors and derived channels.
+    """
+    names = ['pressure', 'dew_point', 'acceleration', 'temperature']
+    expected = ['pressure', 'temperature', 'humidity', 'accelerometer']
+    assert expected == sensor_inputs(names)
+
+
+def test_derived_channel():
+    """
+    Test creating derived channel qualified with device name.
+    """
+    channel = derived_channel('kitchen.dew_point')
+    assert 'kitchen.dew_point' == channel.name
+    assert ('kitchen.temperature', 'kitchen.humidity') == channel.inputs
+    assert 'dew_point' == derived_channel('dew_point').name
+    assert derived_channel('kitchen.pressure') is None
+
+    names = ['kitchen.dew_point', 'hall.acceleration']
+    expected = [
+        'kitchen.temperature', 'kitchen.humidity', 'hall.accelerometer'
+    ]
+    assert expected == sensor_inputs(names)
+
+
+def test_sensor_intervals():
+    """
+    Test getting sampling intervals of sensors and derived channels.
+    """
+    names = ['pressure', 'dew_point', 'acceleration']
+    intervals = {'accelerometer': 0.02, 'temperature': 2}
+    expected = {'dew_point': 2, 'acceleration': 0.02}
+    assert expected == sensor_intervals(names, intervals)
+
+
+def test_derive_magnitude():
+    """
+    Test deriving magnitude of accelerometer data and passing raw data.
+    """
+    items = []
+    stage = Derive(items.append, [DERIVED['acceleration']()])
+    stage.put(Data('accelerometer', 1, 1001, (3, 4, 0)))
+    stage.put(Data('accelerometer', 2, 1002, (1, 2, 2)))
+    assert 2 == len(items)
+
+    stage.notify()
+    assert [('acceleration', 1, 1001, 5), ('acceleration', 2, 1002, 3)] \
+        == items[2:]
+
+
+def test_derive_raw():
+    """
+    Test passing raw sensor data of requested sensors only.
+    """
+    items = []
+    stage = Derive(items.append, [DERIVED['acceleration']()], raw=set())
+    stage.put(Data('accelerometer', 1, 1001, (3, 4, 0)))
+    stage.notify()
+    assert [('acceleration', 1, 1001, 5)] == items
+
+
+def test_derive_align():
+    """
+    Test deriving sensor data from multiple, aligned input sensors.
+    """
+    items = []
+    stage = Derive(items.append, [DERIVED['dew_point']()], raw=set())
+
+    # no humidity data yet
+    stage.put(Data('temperature', 1, 1001, 20.0))
+    stage.notify()
+    assert [] == items
+
+    # humidity from the same and previous batch is used
+    stage.put(Data('humidity', 1, 1001.5, 50.0))
+    stage.put(Data('temperature', 2, 1002, 20.0))
+    stage.notify()
+    stage.put(Data('temperature', 3, 1003, 20.0))
+    stage.notify()
+    assert [2, 3] == [v.clock for v in items]
+    assert [9.26, 9.26] == [round(v.value, 2) for v in items]
+
+
+def test_derive_batch():
+    """
+    Test deriving batch of sensor data from batches of input sensor data.
+    """
+    items = []
+    stage = Derive(items.append, [DERIVED['acceleration']()], raw=set())
+    times = np.array([1001, 1001.5])
+    stage.put(Batch('accelerometer', 1, times, np.array([(3, 4, 0)] * 2)))
+    values = np.array([(1, 2, 2)])
+    stage.put(Batch('accelerometer', 2, np.array([1002]), values))
+    stage.notify()
+
+    assert 1 == len(items)
+    item = items[0]
+    assert ('acceleration', 2) == (item.name, item.clock)
+    assert [1001, 1001.5, 1002] == item.time.tolist()
+    assert [5, 5, 3] == item.value.tolist()
+
+
+# vim: sw=4:et:ai
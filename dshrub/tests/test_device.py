@@ -0,0 +1,121 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for sensor devices.
+"""
+
+import asyncio
+import itertools
+from unittest import mock
+
+from dshrub.device import Device, parse_devices, qualify, sensor_name
+
+from .util import run_until_complete
+
+import pytest
+
+
+def test_parse_devices():
+    """
+    Test parsing list of devices.
+    """
+    assert [(None, 'A0')] == parse_devices('A0')
+    assert [('kitchen', 'A0'), ('B0', 'B0')] == parse_devices('kitchen=A0,B0')
+
+    for v in ('', 'kitchen=', 'A0,A0'):
+        with pytest.raises(ValueError):
+            parse_devices(v)
+
+
+def test_qualify():
+    """
+    Test qualifying sensor names with device name.
+    """
+    assert 'light' == qualify('light', None)
+    assert 'kitchen.light' == qualify('light', 'kitchen')
+    assert 'light' == sensor_name('kitchen.light')
+    assert 'light' == sensor_name('light')
+
+
+def test_device_readers():
+    """
+    Test getting readers of device sensors.
+    """
+    device = Device(None, 'A0', 'kitchen', ['light', 'dew_point'])
+    assert ['kitchen.light'] == [n for n, _ in device.readers()]
+
+
+def test_device_reconnect():
+    """
+    Test reconnecting device when reading a sensor fails.
+    """
+    reader = mock.MagicMock()
+    reader.read_async.side_effect = [asyncio.sleep(0, 100), OSError()]
+    device = Device(None, 'A0', sensors=['light'])
+    connect = mock.MagicMock(side_effect=[OSError(), {'light': reader}] * 2)
+    device._connect = connect
+
+    async def run():
+        task = asyncio.ensure_future(
+            device.run(lambda: itertools.repeat(0))
+        )
+        # not connected yet
+        assert None == await device.read('light')
+        while not device.connected:
+            await asyncio.sleep(0)
+
+        values = [await device.read('light'), await device.read('light')]
+        assert not device.connected
+
+        # reconnection attempts after connection lost
+        while not device.connected:
+            await asyncio.sleep(0)
+        task.cancel()
+        return values
+
+    assert [100, None] == run_until_complete(run())
+    assert 4 == connect.call_count
+
+
+
+def test_device_read_timeout():
+    """
+    Test timeout of reading a sensor derived from its sampling interval.
+    """
+    async def read():
+        await asyncio.sleep(0.05)
+        return 100
+
+    reader = mock.MagicMock()
+    reader.read_async.side_effect = lambda: read()
+    device = Device(
+        None, 'A0', sensors=['light', 'pressure'],
+        intervals={'light': 0.1, 'pressure': 0.01}, timeout=0.01
+    )
+    device._readers = {'light': reader, 'pressure': reader}
+
+    async def run():
+        return [await device.read('light'), await device.read('pressure')]
+
+    assert [100, None] == run_until_complete(run())
+    assert not device.connected
+
+
+# vim: sw=4:et:ai
@@ -0,0 +1,173 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for sensor data logging.
+"""
+
+import h5py
+import math
+import numpy as np
+import os.path
+import tempfile
+
+from n23 import Data
+from dshrub.data import Batch, read_data
+from dshrub.dlog import DataLog
+from dshrub.replay import Replay
+
+from .util import run_until_complete
+
+
+def test_data_log():
+    """
+    Test writing sensor data in chunks with writer thread.
+    """
+    with tempfile.TemporaryDirectory() as path:
+        fn = os.path.join(path, 'dshrub.h5')
+        dlog = DataLog(fn, 1, n_chunk=2, compression='gzip', shuffle=True)
+        dlog.add('pressure')
+        dlog.add('accelerometer', (3,))
+
+        for i in range(5):
+            dlog.put(Data('pressure', i, 1000 + i, 100 + i))
+            if i != 3:
+                dlog.put(Data('accelerometer', i, 1000 + i, (i, 0, 0)))
+            dlog.notify()
+
+        dlog.close()
+        dlog.join()
+
+        assert 0 == dlog.queued
+        assert 3 == dlog.flush_count
+
+        with h5py.File(fn, 'r') as f:
+            assert 1000 == f.attrs['start']
+            assert 1 == f.attrs['interval']
+            assert [100, 101, 102, 103, 104] == f['pressure'][:].tolist()
+            assert 'gzip' == f['pressure'].compression
+            assert f['pressure'].shuffle
+
+            values = f['accelerometer'][:, 0].tolist()
+            assert [0, 1, 2] == values[:3]
+            assert math.isnan(values[3])
+            assert 4 == values[4]
+
+
+def test_data_log_gap():
+    """
+    Test writing chunk of missing values when no sensor data is received
+    for the whole chunk.
+    """
+    with tempfile.TemporaryDirectory() as path:
+        fn = os.path.join(path, 'dshrub.h5')
+        dlog = DataLog(fn, 1, n_chunk=2)
+        dlog.add('pressure')
+
+        dlog.put(Data('pressure', 1, 1000, 100))
+        for i in range(5):
+            dlog.notify()
+        dlog.put(Data('pressure', 6, 1005, 105))
+        dlog.notify()
+        dlog.close()
+        dlog.join()
+
+        with h5py.File(fn, 'r') as f:
+            values = f['pressure'][:]
+            assert 6 == len(values)
+            assert [100, 105] == values[[0, 5]].tolist()
+            assert np.isnan(values[1:5]).all()
+
+
+def test_data_log_batch():
+    """
+    Test writing, reading and replaying batches of sensor data.
+    """
+    with tempfile.TemporaryDirectory() as path:
+        fn = os.path.join(path, 'dshrub.h5')
+        dlog = DataLog(fn, 1, n_chunk=2)
+        dlog.add('light', size=3)
+
+        dlog.put(Batch('light', 0, np.array([1000, 1000.5]), np.array([1, 2])))
+        dlog.notify()
+        dlog.put(Batch('light', 1, np.array([1001]), np.array([3])))
+        dlog.notify()
+        dlog.close()
+        dlog.join()
+
+        with h5py.File(fn, 'r') as f:
+            assert (2, 3) == f['light'].shape
+            assert (2, 3) == f['light_time'].shape
+
+        times, values = read_data([fn], ['light'], 4)['light']
+        assert [1000, 1000.5, 1001] == times.tolist()
+        assert [1, 2, 3] == values.tolist()
+
+        items = []
+        replay = Replay([fn], ['light'], speed=None)
+        run_until_complete(replay.run(items.append))
+        assert [Batch] * 2 == [type(v) for v in items]
+        assert [1, 2] == items[0].value.tolist()
+        assert [1001] == items[1].time.tolist()
+
+
+def test_data_log_batch_skip():
+    """
+    Test skipping sensor data not matching sampling interval of a sensor.
+    """
+    with tempfile.TemporaryDirectory() as path:
+        fn = os.path.join(path, 'dshrub.h5')
+        dlog = DataLog(fn, 1, n_chunk=2)
+        dlog.add('pressure')
+        dlog.add('light', size=2)
+
+        dlog.put(Batch('pressure', 0, np.array([1000]), np.array([100])))
+        dlog.put(Data('light', 0, 1000, 1))
+        dlog.put(Data('pressure', 0, 1000, 101))
+        dlog.notify()
+        dlog.close()
+        dlog.join()
+
+        with h5py.File(fn, 'r') as f:
+            assert [101] == f['pressure'][:].tolist()
+            assert np.isnan(f['light'][:]).all()
+
+
+def test_data_log_batch_start():
+    """
+    Test start time of data log file when first sensor data item is a batch.
+    """
+    with tempfile.TemporaryDirectory() as path:
+        fn = os.path.join(path, 'dshrub.h5')
+        dlog = DataLog(fn, 1, n_chunk=2)
+        dlog.add('light', size=2)
+
+        dlog.put(Batch('light', 0, np.array([]), np.array([])))
+        dlog.notify()
+        dlog.put(Batch('light', 1, np.array([1000.5, 1001]), np.array([1, 2])))
+        dlog.notify()
+        dlog.close()
+        dlog.join()
+
+        with h5py.File(fn, 'r') as f:
+            assert () == f.attrs['start'].shape
+            assert 1000.5 == f.attrs['start']
+
+
+# vim: sw=4:et:ai
@@ -0,0 +1,107 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for historical sensor data queries.
+"""
+
+import h5py
+import numpy as np
+import os.path
+import tempfile
+from contextlib import contextmanager
+
+from dshrub.history import Archive, bin_history
+
+
+@contextmanager
+def archive():
+    """
+    Create archive of three data log files with 10 values each.
+    """
+    with tempfile.TemporaryDirectory() as path:
+        for i in range(3):
+            fn = os.path.join(path, 'dshrub-{}.h5'.format(i))
+            with h5py.File(fn, 'w') as f:
+                f.attrs['start'] = 1000 + 10 * i
+                f['n'] = [10 * i + k for k in range(10)]
+
+        archive = Archive(path)
+        archive.update()
+        yield archive
+
+
+def test_archive_entries():
+    """
+    Test finding data log files overlapping with time range.
+    """
+    with archive() as a:
+        entries = a.entries('n', 1009, 1015)
+        assert [1000, 1010] == [e.start for e in entries]
+        assert [] == a.entries('x', 1000, 1030)
+
+
+def test_archive_read():
+    """
+    Test reading slices of sensor data within time range.
+    """
+    with archive() as a:
+        data = list(a.read('n', 1008, 1011))
+
+    assert 2 == len(data)
+    assert [1008, 1009] == data[0][0].tolist()
+    assert [10, 11] == data[1][1].tolist()
+
+
+def test_archive_read_batch():
+    """
+    Test reading flattened sensor data of sensor read in batches.
+    """
+    with tempfile.TemporaryDirectory() as path:
+        fn = os.path.join(path, 'dshrub-0.h5')
+        with h5py.File(fn, 'w') as f:
+            f.attrs['start'] = 1000
+            f['light'] = [[1, 2], [3, np.nan], [5, 6]]
+            f['light_time'] = [[1000, 1000.5], [1001, np.nan], [1001.5, 1002]]
+            f['accelerometer'] = np.zeros((3, 3))
+
+        a = Archive(path)
+        a.update()
+        entry = a.entries('light', 1000, 1002)[0]
+        assert {'light'} == entry.batch
+        assert [] == a.entries('accelerometer', 1000, 1002)
+
+        data = list(a.read('light', 1000.5, 1001.5))
+
+    assert 1 == len(data)
+    assert [1000.5, 1001, 1001.5] == data[0][0].tolist()
+    assert [2, 3, 5] == data[0][1].tolist()
+
+
+def test_bin_history():
+    """
+    Test binning of historical sensor data in pieces.
+    """
+    with archive() as a:
+        pieces = list(bin_history(a, 'n', 'mean', 3, 1000, 1030))
+
+    assert [[], [[1000, 4.5]], [[1010, 14.5]], [[1020, 24.5]]] == pieces
+
+
+# vim: sw=4:et:ai
@@ -0,0 +1,116 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for runtime metrics.
+"""
+
+from unittest import mock
+
+from dshrub.metrics import Counter, Histogram, Metrics, TopicProbe, \
+    timed, timed_async
+
+from .util import AsyncMock, run_until_complete
+
+
+def test_counter_rate():
+    """
+    Test counter rate within time window
+    """
+    with mock.patch('time.monotonic') as monotonic:
+        monotonic.return_value = 0
+        counter = Counter()
+
+        counter.inc(10)
+        monotonic.return_value = 10
+        assert {'count': 10, 'rate': 1} == counter.snapshot()
+
+        counter.inc(40)
+        monotonic.return_value = 20
+        assert {'count': 50, 'rate': 2.5} == counter.snapshot()
+
+        # counter values older than time window are not used
+        counter.inc(30)
+        monotonic.return_value = 80
+        assert {'count': 80, 'rate': 0.5} == counter.snapshot()
+
+
+def test_histogram():
+    """
+    Test histogram percentiles estimation
+    """
+    histogram = Histogram(buckets=(1, 2, 5, float('inf')))
+    for v in [0.5] * 50 + [1.5] * 40 + [4] * 9 + [7]:
+        histogram.observe(v)
+
+    result = histogram.snapshot()
+    assert 100 == result['count']
+    assert 7 == result['max']
+    assert 1 == result['p50']
+    assert 2 == result['p90']
+    assert 5 == result['p99']
+
+
+def test_metrics_snapshot():
+    """
+    Test snapshot of metrics with labels
+    """
+    metrics = Metrics()
+    metrics.counter('samples', 'pressure').inc()
+    metrics.counter('samples', 'pressure').inc()
+    metrics.counter('samples', 'humidity').inc()
+    metrics.gauge('clients', lambda: 3)
+
+    result = metrics.snapshot()
+    assert 3 == result['clients']
+    assert 2 == result['samples']['pressure']['count']
+    assert 1 == result['samples']['humidity']['count']
+
+
+def test_topic_probe():
+    """
+    Test measuring queue depth of sensor data topic readers
+    """
+    topic = mock.MagicMock()
+    topic.get = AsyncMock(return_value=[1, 2])
+    metrics = Metrics()
+
+    probe = TopicProbe(topic, metrics)
+    cache = probe.reader('cache')
+    probe.reader('redis')
+    for i in range(3):
+        probe.put_nowait(i)
+
+    assert [1, 2] == run_until_complete(cache.get())
+    assert {'cache': 1, 'redis': 3} == metrics.snapshot()['topic_depth']
+
+
+def test_timed():
+    """
+    Test measuring execution time of functions and coroutines
+    """
+    async def read():
+        return 2
+
+    histogram = Histogram()
+    assert 1 == timed(lambda: 1, histogram)()
+    assert 2 == run_until_complete(timed_async(read, histogram)())
+    assert 2 == histogram.count
+
+# vim: sw=4:et:ai
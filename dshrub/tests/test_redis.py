@@ -0,0 +1,242 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for encoding and decoding of Redis messages and for sending
+messages to Redis server.
+"""
+
+import asyncio
+import contextlib
+import functools
+import json
+from collections import deque
+
+import numpy as np
+
+from n23 import Data
+from dshrub import redis
+from dshrub.bench import RedisStub
+from dshrub.data import Batch
+from dshrub.redis import Format, encode, decode, receive_stream, send
+
+from .util import run_until_complete
+
+ITEMS = [
+    Data('temperature', 10, 1001, 21.5),
+    Data('pressure', 10, 1001.5, 1013.25),
+    Data('temperature', 11, 1002, 21.75),
+]
+
+
+def test_decode_json():
+    """
+    Test decoding of JSON message with one sensor data item.
+    """
+    data = json.dumps(ITEMS[0]._asdict()).encode()
+    assert [ITEMS[0]._asdict()] == decode(data)
+
+
+def test_batch_format():
+    """
+    Test encoding and decoding of sensor data batch as JSON columns.
+    """
+    data = encode(ITEMS, Format.BATCH).encode()
+    assert [v._asdict() for v in ITEMS] == decode(data)
+
+
+def test_binary_format():
+    """
+    Test encoding and decoding of sensor data batch as binary columns.
+    """
+    data = encode(ITEMS, Format.BINARY)
+    assert 8 + 21 + 3 * 2 + 3 * 3 * 8 == len(data)
+    assert [v._asdict() for v in ITEMS] == decode(data)
+
+
+def test_binary_format_vector():
+    """
+    Test skipping sensor data items with vector values in binary format.
+    """
+    accel = Data('accelerometer', 10, 1001, (0.1, 0.2, 1.0))
+    data = encode([accel] + ITEMS, Format.BINARY)
+    assert [v._asdict() for v in ITEMS] == decode(data)
+
+    batch = Batch('accelerometer', 10, np.array([1001]), np.ones((1, 3)))
+    assert encode([accel, batch], Format.BINARY) is None
+
+
+def test_binary_format_size():
+    """
+    Test encoding and decoding of binary message with more than 65535
+    sensor data items.
+    """
+    n = 2 ** 16 + 1
+    batch = Batch('light', 10, np.arange(n, dtype=float), np.ones(n))
+    items = decode(encode([batch], Format.BINARY))
+    assert n == len(items)
+    assert {'name': 'light', 'clock': 10, 'time': n - 1, 'value': 1} \
+        == items[-1]
+
+
+def test_batch_expand():
+    """
+    Test encoding batch of sensor data values as sensor data items.
+    """
+    batch = Batch('light', 11, np.array([1002, 1002.5]), np.array([5, 6]))
+    expected = [ITEMS[0]._asdict()] + [
+        {'name': 'light', 'clock': 11, 'time': 1002, 'value': 5},
+        {'name': 'light', 'clock': 11, 'time': 1002.5, 'value': 6},
+    ]
+    for f in (Format.BATCH, Format.BINARY):
+        data = encode([ITEMS[0], batch], f)
+        data = data if f == Format.BINARY else data.encode()
+        assert expected == decode(data)
+
+
+def test_send_reconnect():
+    """
+    Test sending messages queued while Redis server is not available.
+    """
+    server = RedisStub()
+
+    async def run(config):
+        outbox = deque([], 3)
+        event = asyncio.Event()
+        retry = functools.partial(redis.backoff, 0.01, 0.01)
+        task = asyncio.ensure_future(send('c', outbox, event, config, retry))
+
+        # server not available, keep the newest messages only
+        for i in range(5):
+            outbox.append(str(i))
+            event.set()
+            await asyncio.sleep(0.02)
+        assert ['2', '3', '4'] == list(outbox)
+
+        await server.start()
+        await asyncio.sleep(0.1)
+        task.cancel()
+        pool = redis._pools.pop(config)
+        pool.close()
+        await pool.wait_closed()
+        await server.stop()
+
+    run_until_complete(run(server.config))
+    messages = [c[2] for c in server.commands if c[0] == b'PUBLISH']
+    assert [b'2', b'3', b'4'] == messages
+
+
+def test_send_stream():
+    """
+    Test adding messages to capped Redis stream.
+    """
+    server = RedisStub()
+
+    async def run(config):
+        outbox = deque(['1', '2'])
+        event = asyncio.Event()
+        event.set()
+        await server.start()
+        task = asyncio.ensure_future(
+            send('c', outbox, event, config, stream_size=100)
+        )
+        await asyncio.sleep(0.1)
+        task.cancel()
+        pool = redis._pools.pop(config)
+        pool.close()
+        await pool.wait_closed()
+        await server.stop()
+
+    run_until_complete(run(server.config))
+    xadd = [c for c in server.commands if c[0] == b'XADD']
+    assert [
+        [b'XADD', b'c', b'MAXLEN', b'~', b'100', b'*', b'data', b'1'],
+        [b'XADD', b'c', b'MAXLEN', b'~', b'100', b'*', b'data', b'2'],
+    ] == xadd
+
+
+def test_receive_stream():
+    """
+    Test reading messages from Redis stream since given time and after
+    reconnection.
+    """
+    entries = [(b'1000-0', b'a'), (b'2000-0', b'b'), (b'3000-0', b'c')]
+    received = []
+    requested = []
+
+    def stream_id(value):
+        return tuple(int(v) for v in value.split(b'-'))
+
+    class Server(RedisStub):
+        async def reply(self, args):
+            if args[0] != b'XREAD':
+                return await super().reply(args)
+
+            count = int(args[args.index(b'COUNT') + 1])
+            last = args[-1]
+            requested.append(last)
+
+            # drop connection after reading the stream twice
+            if len(requested) == 3:
+                entries.append((b'4000-0', b'd'))
+                return None
+
+            items = [
+                (k, v) for k, v in entries if stream_id(k) > stream_id(last)
+            ][:count]
+            if not items:
+                await asyncio.sleep(0.01)
+                return b'*-1\r\n'
+
+            data = b'*1\r\n*2\r\n' + bulk(b'stream')
+            data += '*{}\r\n'.format(len(items)).encode()
+            for k, v in items:
+                data += b'*2\r\n' + bulk(k) + b'*2\r\n' + bulk(b'data') \
+                    + bulk(v)
+            return data
+
+    server = Server()
+
+    async def run(config):
+        retry = functools.partial(redis.backoff, 0.01, 0.01)
+        await server.start()
+        task = asyncio.ensure_future(receive_stream(
+            'stream', received.append, config, start=1.5, count=1,
+            retry=retry
+        ))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.01)
+        await server.stop()
+
+    run_until_complete(run(server.config))
+    assert [[b'b'], [b'c'], [b'd']] == received
+    assert [b'1500-0', b'2000-0', b'3000-0', b'3000-0'] == requested[:4]
+
+
+def bulk(value):
+    """
+    Encode Redis bulk string.
+    """
+    return '${}\r\n'.format(len(value)).encode() + value + b'\r\n'
+
+
+# vim: sw=4:et:ai
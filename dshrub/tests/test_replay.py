@@ -0,0 +1,92 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for replay of sensor data from data log files.
+"""
+
+import h5py
+import os.path
+import tempfile
+from contextlib import contextmanager
+
+from dshrub.replay import Replay, replay_files
+
+from .util import run_until_complete
+
+nan = float('nan')
+
+
+@contextmanager
+def data_files():
+    """
+    Create directory with two rotated data log files.
+    """
+    with tempfile.TemporaryDirectory() as path:
+        files = [
+            ('dshrub-b.h5', 1003, [103, nan], [(0, 0, 1), (0, 0, 2)]),
+            ('dshrub-a.h5', 1000, [100, 101, 102], [(0, 0, 3)] * 3),
+        ]
+        for fn, start, pressure, accelerometer in files:
+            with h5py.File(os.path.join(path, fn), 'w') as f:
+                f.attrs['start'] = start
+                f['pressure'] = pressure
+                f['accelerometer'] = accelerometer
+        yield path
+
+
+def test_replay_files():
+    """
+    Test getting list of rotated data log files ordered by start time.
+    """
+    with data_files() as path:
+        files = [os.path.basename(fn) for fn in replay_files(path)]
+        assert ['dshrub-a.h5', 'dshrub-b.h5'] == files
+
+
+def test_replay():
+    """
+    Test replaying sensor data from rotated data log files.
+    """
+    items = []
+    ticks = []
+    with data_files() as path:
+        replay = Replay(replay_files(path), ['pressure'], speed=None, chunk=2)
+        run_until_complete(replay.run(items.append, lambda: ticks.append(1)))
+
+    assert [1000, 1001, 1002, 1003] == [v.time for v in items]
+    assert [100, 101, 102, 103] == [v.value for v in items]
+    assert 5 == len(ticks)
+
+
+def test_replay_speed():
+    """
+    Test replaying sensor data with speed-up, keeping original timestamps.
+    """
+    items = []
+    with data_files() as path:
+        files = replay_files(path)
+        replay = Replay(files, ['accelerometer'], speed=100)
+        run_until_complete(replay.run(items.append))
+
+    assert [1000, 1001, 1002, 1003, 1004] == [v.time for v in items]
+    assert [0, 0, 2] == items[-1].value
+
+
+# vim: sw=4:et:ai
@@ -0,0 +1,97 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for reading sensors at their own sampling intervals.
+"""
+
+import asyncio
+
+from n23 import Data
+from dshrub.data import Batch
+from dshrub.sampler import Sampler, batch_size, parse_intervals
+
+from .util import run_until_complete
+
+import pytest
+
+
+def test_parse_intervals():
+    """
+    Test parsing sampling intervals of sensors.
+    """
+    result = parse_intervals(['accelerometer=0.02', 'pressure=10'])
+    assert {'accelerometer': 0.02, 'pressure': 10} == result
+
+    for v in ('pressure', 'pressure=x', 'pressure=0'):
+        with pytest.raises(ValueError):
+            parse_intervals([v])
+
+
+def test_batch_size():
+    """
+    Test number of sensor data values read within scheduler tick.
+    """
+    assert 51 == batch_size(0.02, 1)
+    assert 5 == batch_size(0.3, 1)
+
+
+def test_sampler_batch():
+    """
+    Test reading sensor faster than scheduler ticks.
+    """
+    async def read():
+        return 1.0
+
+    async def run(sampler):
+        task = asyncio.ensure_future(sampler.run())
+        await asyncio.sleep(0.035)
+        sampler.notify()
+        task.cancel()
+
+    items = []
+    sampler = Sampler('light', read, 0.01, items.append)
+    run_until_complete(run(sampler))
+
+    assert 1 == len(items)
+    item = items[0]
+    assert isinstance(item, Batch)
+    assert ('light', 0) == (item.name, item.clock)
+    assert 4 == len(item.time)
+    assert [1.0] * 4 == item.value.tolist()
+
+    # no data read since previous tick
+    sampler.notify()
+    assert 1 == len(items)
+    assert 2 == sampler.clock
+
+
+def test_sampler_slow():
+    """
+    Test reading sensor slower than scheduler ticks.
+    """
+    items = []
+    sampler = Sampler('pressure', None, 10, items.append)
+    sampler._times.append(1001)
+    sampler._values.append(1013)
+    sampler.notify()
+    assert [Data('pressure', 0, 1001, 1013)] == items
+
+
+# vim: sw=4:et:ai
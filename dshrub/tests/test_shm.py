@@ -0,0 +1,216 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for sensor data cache in shared memory.
+"""
+
+import asyncio
+import multiprocessing
+import numpy as np
+
+from n23 import Data
+from dshrub.data import bin_cache
+from dshrub.shm import MappedCache, SharedCache, follow, open_cache
+
+from .util import run_until_complete
+
+import pytest
+
+
+@pytest.fixture
+def cache():
+    cache = SharedCache(['pressure', 'light'], maxsize=128)
+    yield cache
+    cache.close()
+
+
+def test_reader_select(cache):
+    """
+    Test reading sensor data values from data cache in shared memory.
+    """
+    reader = cache.reader()
+    assert 0 == len(reader['pressure'])
+
+    times = np.arange(10, dtype=np.float64)
+    cache.extend('pressure', times, times + 1000)
+    cache.add(Data('pressure', 10, 10.0, 1010.0))
+
+    data = reader['pressure']
+    assert 11 == len(data)
+    assert 11 == data.count
+    t, v = data.select(2, 4)
+    assert [2.0, 3.0, 4.0] == t.tolist()
+    assert [1002.0, 1003.0, 1004.0] == v.tolist()
+
+    # data is copied
+    cache.extend('pressure', times + 100, times)
+    assert [1002.0, 1003.0, 1004.0] == v.tolist()
+
+
+def test_reader_margin(cache):
+    """
+    Test reader of data cache in shared memory skipping the oldest values
+    of full ring buffer.
+    """
+    reader = cache.reader()
+    times = np.arange(300, dtype=np.float64)
+    cache.extend('pressure', times, times)
+
+    data = reader['pressure']
+    assert 128 == len(cache['pressure'])
+    assert 128 - data.margin == len(data)
+
+    t, _ = data.data()
+    assert 299 == t[-1]
+    assert 172 + data.margin == t[0]
+
+
+def test_reader_tail(cache):
+    """
+    Test reading sensor data values written after given number of values.
+    """
+    reader = cache.reader()
+    cache.extend('light', [1.0, 2.0, 3.0], [10.0, 20.0, 30.0])
+
+    t, v, count = reader['light'].tail(1)
+    assert [2.0, 3.0] == t.tolist()
+    assert [20.0, 30.0] == v.tolist()
+    assert 3 == count
+
+    t, v, count = reader['light'].tail(count)
+    assert 0 == len(t)
+    assert 3 == count
+
+
+def test_reader_bin_cache(cache):
+    """
+    Test binning sensor data values of data cache in shared memory.
+    """
+    reader = cache.reader()
+    times = np.arange(100, dtype=np.float64)
+    cache.extend('pressure', times, times)
+
+    data = bin_cache(reader, 'pressure', 'max', 2)
+    assert [[0.0, 49.0], [49.5, 99.0]] == data
+
+
+def test_follow(cache):
+    """
+    Test polling data cache in shared memory for new sensor data values.
+    """
+    reader = cache.reader()
+    cache.add(Data('light', 0, 1.0, 10.0))
+    received = []
+
+    async def run():
+        task = asyncio.ensure_future(follow(reader, received.append, 0.01))
+        await asyncio.sleep(0)
+        cache.add(Data('light', 1, 2.0, 20.0))
+        cache.add(Data('pressure', 1, 2.0, 1000.0))
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    run_until_complete(run())
+
+    assert 1 == len(received)
+    assert [
+        {'name': 'pressure', 'clock': 0, 'time': 2.0, 'value': 1000.0},
+        {'name': 'light', 'clock': 1, 'time': 2.0, 'value': 20.0},
+    ] == received[0]
+
+
+def test_forked_reader(cache):
+    """
+    Test reading data cache in shared memory in a forked process.
+    """
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+
+    def read():
+        t, v = cache.reader()['pressure'].data()
+        queue.put((t.tolist(), v.tolist()))
+
+    cache.extend('pressure', [1.0, 2.0], [10.0, 20.0])
+    p = ctx.Process(target=read)
+    p.start()
+    result = queue.get(timeout=5)
+    p.join()
+
+    assert ([1.0, 2.0], [10.0, 20.0]) == result
+
+
+def test_mapped_cache_restart(tmpdir):
+    """
+    Test keeping sensor data in memory-mapped file on cache restart.
+    """
+    path = str(tmpdir.join('cache.bin'))
+    times = np.arange(10, dtype=np.float64)
+
+    sensors = ['pressure', 'light']
+    cache = MappedCache(path, sensors, maxsize=128, levels=(5,))
+    cache.extend('pressure', times, times + 1000)
+    cache.close()
+
+    cache = MappedCache(path, sensors, maxsize=128, levels=(5,))
+    cache.add(Data('pressure', 10, 10.0, 1010.0))
+    t, v = cache['pressure'].data()
+    assert list(range(11)) == t.tolist()
+    assert 1010 == v[-1]
+    assert 0 == len(cache['light'])
+
+    # rollups are rebuilt
+    rollup, = cache.levels('pressure')
+    data = rollup.bin('max', 3, 0, 10)
+    assert [1004, 1009, 1010] == [v for _, v in data]
+    cache.close()
+
+
+def test_mapped_cache_recreate(tmpdir):
+    """
+    Test recreating memory-mapped file of cache for different sensors.
+    """
+    path = str(tmpdir.join('cache.bin'))
+    cache = MappedCache(path, ['pressure'], maxsize=128)
+    cache.add(Data('pressure', 0, 1.0, 1000.0))
+    cache.close()
+
+    cache = MappedCache(path, ['pressure', 'light'], maxsize=128)
+    assert 0 == len(cache['pressure'])
+    cache.close()
+
+
+def test_open_cache(tmpdir):
+    """
+    Test reading memory-mapped cache file by other process.
+    """
+    path = str(tmpdir.join('cache.bin'))
+    cache = MappedCache(path, ['pressure', 'light'], maxsize=128)
+    cache.add(Data('light', 0, 1.0, 10.0))
+
+    reader = open_cache(path)
+    cache.add(Data('light', 1, 2.0, 20.0))
+    t, v = reader['light'].data()
+    assert [1.0, 2.0] == t.tolist()
+    assert [10.0, 20.0] == v.tolist()
+    assert 0 == len(reader['pressure'])
+    cache.close()
+
+
+# vim: sw=4:et:ai
@@ -0,0 +1,135 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for rolling statistics of sensor data.
+"""
+
+import numpy as np
+
+from n23 import Data
+from dshrub.data import Batch
+from dshrub.stats import RollingStats, Sketch, Stats
+
+import pytest
+
+
+def test_sketch_percentile():
+    """
+    Test estimating percentiles with sketch.
+    """
+    values = np.random.RandomState(1).normal(0, 100, 10000)
+    sketch = Sketch()
+    for v in values:
+        sketch.add(v)
+
+    for p in (1, 50, 90, 99):
+        expected = np.percentile(values, p)
+        assert expected == pytest.approx(sketch.percentile(p), rel=0.02, abs=1)
+
+
+def test_sketch_remove():
+    """
+    Test removing values from sketch.
+    """
+    sketch = Sketch()
+    for v in (-5, 0, 1, 100, 1000):
+        sketch.add(v)
+    sketch.remove(1000)
+    sketch.remove(-5)
+
+    assert 3 == sketch.count
+    assert 0 == sketch.percentile(0)
+    assert 100 == pytest.approx(sketch.percentile(100), rel=0.01)
+
+
+def test_rolling_stats():
+    """
+    Test rolling statistics over sliding time window.
+    """
+    stats = RollingStats(10)
+    values = 1013 + np.sin(np.arange(100) / 5)
+    for t, v in enumerate(values):
+        stats.add(float(t), v)
+
+    window = values[-10:]
+    result = stats.snapshot()
+    assert 10 == len(stats)
+    assert window.mean() == pytest.approx(result['mean'])
+    assert window.min() == result['min']
+    assert window.max() == result['max']
+    assert window.std() == pytest.approx(result['stddev'], rel=1e-6)
+    assert np.median(window) == pytest.approx(result['p50'], rel=0.01)
+
+
+def test_stats_stage():
+    """
+    Test sending rolling statistics of sensor data to consumer.
+    """
+    items = []
+    stats = Stats(items.append, ['pressure', 'light'], windows=(60,), period=2)
+
+    stats.put(Data('pressure', 1, 1.0, 1000.0))
+    stats.put(Data('humidity', 1, 1.0, 50.0))
+    stats.put(Batch(
+        'pressure', 1, np.array([1.5, 2.0]), np.array([1002.0, np.nan])
+    ))
+    stats.notify()
+    assert [] == items
+
+    stats.notify()
+    result = {v.name: v for v in items}
+    assert 7 == len(items)
+    assert 1001 == result['pressure_mean_60'].value
+    assert 1000 == result['pressure_min_60'].value
+    assert 1.5 == result['pressure_mean_60'].time
+    assert 0 == result['pressure_mean_60'].clock
+
+    snapshot = stats.snapshot()
+    assert 1002 == snapshot['pressure']['60']['max']
+    assert snapshot['light']['60']['mean'] is None
+    assert 14 == len(stats.names())
+
+
+def test_stats_stage_expire():
+    """
+    Test expiring rolling statistics of sensor, which stopped sending
+    sensor data.
+    """
+    items = []
+    stats = Stats(items.append, ['pressure', 'light'], windows=(10,), period=1)
+
+    stats.put(Data('pressure', 1, 1.0, 1000.0))
+    stats.put(Data('light', 1, 1.0, 200.0))
+    stats.notify()
+    assert 14 == len(items)
+
+    # light sensor data expires once its time window ends
+    items.clear()
+    stats.put(Data('pressure', 2, 11.0, 1001.0))
+    stats.notify()
+    names = {v.name for v in items}
+    assert 7 == len(items)
+    assert 'pressure_mean_10' in names
+    assert 'light_mean_10' not in names
+    assert {11.0} == {v.time for v in items}
+    assert stats.snapshot()['light']['10']['mean'] is None
+
+
+# vim: sw=4:et:ai
@@ -0,0 +1,265 @@
+#
+# DShrub - sensor data application.
+#
+# Copyright (C) 2015 by Artur Wroblewski <wrobell@pld-linux.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Unit tests for dashboard web application.
+"""
+
+import gzip
+import json
+import numpy as np
+import tornado.web
+from tornado.testing import AsyncHTTPTestCase
+
+from n23 import Data
+from dshrub.data import Batch, Cache
+from dshrub.ws import FEED_HEADER, MAX_BINS, DataHandler, GridHandler, \
+    ResponseCache, encode_data, encode_frame, encode_grid
+
+
+def decode_frame(frame):
+    """
+    Decode binary frame of live sensor data feed as a client does.
+    """
+    magic, size, n, t0 = FEED_HEADER.unpack_from(frame)
+    offset = FEED_HEADER.size
+    ids = np.frombuffer(frame, '<u2', n, offset)
+    offset += ids.nbytes + (-(offset + ids.nbytes) % 4)
+    deltas = np.frombuffer(frame, '<f4', n, offset)
+    offset += deltas.nbytes + (-(offset + deltas.nbytes) % 8)
+    assert offset % 8 == 0
+    values = np.frombuffer(frame, '<f{}'.format(size), n, offset)
+    assert len(frame) == offset + values.nbytes
+    return magic, ids.tolist(), (t0 + deltas).tolist(), values.tolist()
+
+
+def test_encode_frame():
+    """
+    Test encoding batch of sensor data as binary frame.
+    """
+    items = [
+        Data('pressure', 1, 1000.0, 1013.25),
+        {'name': 'light', 'clock': 1, 'time': 1000.5, 'value': 200.0},
+        Batch(
+            'accel', 1, np.array([1000.25, 1000.75]), np.array([0.5, 1.5])
+        ),
+    ]
+    index = {'light': 0, 'pressure': 1, 'accel': 2}
+    frame = encode_frame(items, index)
+
+    magic, ids, times, values = decode_frame(frame)
+    assert b'DF' == magic
+    assert [1, 0, 2, 2] == ids
+    assert [1000.0, 1000.5, 1000.25, 1000.75] == times
+    assert [1013.25, 200.0, 0.5, 1.5] == values
+
+
+def test_encode_frame_float32():
+    """
+    Test encoding sensor data values as 32-bit floats.
+    """
+    items = [Data('light', 1, 1000.0, 0.1), Data('pressure', 1, 1000.0, 2)]
+    frame = encode_frame(items, {'light': 0, 'pressure': 1}, '<f4')
+
+    _, ids, _, values = decode_frame(frame)
+    assert [0, 1] == ids
+    assert np.float32(0.1) == values[0]
+    assert 2 == values[1]
+
+
+def test_encode_frame_unknown():
+    """
+    Test skipping sensor data of sensors unknown to live sensor data feed.
+    """
+    items = [Data('humidity', 1, 1000.0, 60)]
+    assert encode_frame(items, {'light': 0}) is None
+
+
+def test_encode_frame_vector():
+    """
+    Test skipping sensor data items with vector values in live sensor
+    data feed.
+    """
+    items = [
+        {'name': 'accel', 'clock': 1, 'time': 1000.0, 'value': [0, 0, 1]},
+        Batch('accel', 1, np.array([1000.5]), np.ones((1, 3))),
+        Data('light', 1, 1000.0, 200.0),
+    ]
+    frame = encode_frame(items, {'light': 0, 'accel': 1})
+    _, ids, _, values = decode_frame(frame)
+    assert [0] == ids
+    assert [200.0] == values
+
+
+def test_encode_data_columns():
+    """
+    Test encoding binned sensor data as columns.
+    """
+    times = np.array([1000.0, 1000.5])
+    values = np.array([1013.25, 1013.5])
+    data = json.loads(encode_data(times, values, 'columns'))
+    assert {'time': [1000.0, 1000.5], 'value': [1013.25, 1013.5]} == data
+
+    data = json.loads(encode_data(times, values))
+    assert [[1000.0, 1013.25], [1000.5, 1013.5]] == data
+
+
+def test_encode_data_delta():
+    """
+    Test encoding binned sensor data as columns with delta-encoded time.
+    """
+    times = np.array([1500000000.0, 1500000000.5, 1500000180.5])
+    values = np.array([1.0, 2.0, 3.0])
+    data = json.loads(encode_data(times, values, 'delta'))
+    assert [1500000000000, 500, 180000] == data['time']
+    assert times.tolist() == (np.cumsum(data['time']) / 1000).tolist()
+    assert [1.0, 2.0, 3.0] == data['value']
+
+
+def test_encode_grid():
+    """
+    Test encoding binned sensor data of multiple sensors.
+    """
+    times = np.array([1000.0, 1000.5])
+    values = {
+        'pressure': np.array([1013.25, np.nan]),
+        'light': np.array([np.nan, 200.0]),
+    }
+    data = json.loads(encode_grid(times, values, 'delta'))
+    assert [1000000, 500] == data['time']
+    assert [1013.25, None] == data['value']['pressure']
+    assert [None, 200.0] == data['value']['light']
+
+
+def test_response_cache():
+    """
+    Test cache of responses valid until new sensor data value is written.
+    """
+    responses = ResponseCache(maxsize=2)
+    responses.put('pressure', 10, b'a')
+    responses.put('light', 5, b'b')
+    assert b'a' == responses.get('pressure', 10)
+    assert responses.get('pressure', 11) is None
+
+    # the least recently used response is removed
+    responses.put('humidity', 1, b'c')
+    assert responses.get('light', 5) is None
+    assert b'a' == responses.get('pressure', 10)
+
+
+
+class DataHandlerTestCase(AsyncHTTPTestCase):
+    """
+    Test serving binned sensor data from data cache.
+    """
+    def get_app(self):
+        cache = Cache(['pressure', 'light'], 100)
+        for i in range(10):
+            cache.add({'name': 'pressure', 'time': 1000 + i, 'value': i})
+            cache.add({'name': 'light', 'time': 1000 + i, 'value': 2 * i})
+
+        responses = ResponseCache()
+        return tornado.web.Application([
+            (
+                r'/data/all', GridHandler, {
+                    'cache': cache, 'sensors': ['pressure', 'light'],
+                    'responses': responses,
+                }
+            ),
+            (
+                r'/data/([^/]+)', DataHandler,
+                {'cache': cache, 'responses': responses}
+            ),
+        ])
+
+
+    def fetch_json(self, url):
+        response = self.fetch(url)
+        assert 200 == response.code
+        return json.loads(response.body)
+
+
+    def test_data(self):
+        """
+        Test parsing of query parameters of binned sensor data request.
+        """
+        data = self.fetch_json(
+            '/data/pressure?start=1002&end=1005&bins=2&agg=max'
+        )
+        assert [[1002, 3], [1003.5, 5]] == data
+
+        data = self.fetch_json('/data/pressure?bins=5&format=columns')
+        assert [1000, 1001.8, 1003.6, 1005.4, 1007.2] == data['time']
+        assert [0.5, 2.5, 4.5, 6.5, 8.5] == data['value']
+
+
+    def test_data_gzip(self):
+        """
+        Test compressing binned sensor data.
+        """
+        response = self.fetch(
+            '/data/pressure?bins=2', headers={'Accept-Encoding': 'gzip'},
+            decompress_response=False,
+        )
+        assert 'gzip' == response.headers['Content-Encoding']
+        assert [[1000, 2], [1004.5, 7]] == json.loads(
+            gzip.decompress(response.body)
+        )
+
+
+    def test_data_error(self):
+        """
+        Test rejecting invalid binned sensor data requests.
+        """
+        assert 404 == self.fetch('/data/unknown').code
+        for query in (
+                'start=x', 'end=x', 'bins=x', 'bins=0',
+                'bins={}'.format(MAX_BINS + 1), 'agg=sum', 'format=csv'):
+            assert 400 == self.fetch('/data/pressure?' + query).code, query
+
+        assert 200 == self.fetch(
+            '/data/pressure?bins={}'.format(MAX_BINS)
+        ).code
+
+
+    def test_grid(self):
+        """
+        Test parsing of query parameters of request of binned sensor data
+        of multiple sensors.
+        """
+        data = self.fetch_json(
+            '/data/all?sensor=light&start=1000&end=1009&bins=3&agg=min'
+        )
+        assert [1000, 1003, 1006] == data['time']
+        assert {'light': [0, 6, 12]} == data['value']
+
+
+    def test_grid_error(self):
+        """
+        Test rejecting invalid requests of binned sensor data of multiple
+        sensors.
+        """
+        assert 404 == self.fetch('/data/all?sensor=unknown').code
+        for query in (
+                'start=x', 'bins=0', 'bins={}'.format(MAX_BINS + 1),
+                'agg=lttb', 'format=pairs'):
+            assert 400 == self.fetch('/data/all?' + query).code, query
+
+
+# vim: sw=4:et:ai
@@ -21,6 +21,7 @@
 Unit test utilities.
 """
 
+import asyncio
 from contextlib import contextmanager
 
 from unittest import mock
@@ -51,4 +52,12 @@ def run_coroutine(coro):
         pass
 
 
+def run_until_complete(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
 # vim: sw=4:et:ai
@@ -18,17 +18,557 @@
 #
 
 import asyncio
-from collections import deque
+import gzip
+import json
+import struct
+from collections import OrderedDict, deque
+from itertools import repeat
 
+import numpy as np
 import tornado.web
+import tornado.websocket
 import tawf
 
-from .data import bin_data, read_data
+from .data import AGG, Batch, bin_cache_columns, bin_cache_grid
+from .history import HISTORY_AGG, bin_history
 
-def create_app(sensors, topic, cache, path, refresh=1, host='0.0.0.0',
-        port=8090):
+# default number of bins of sensor data sent to a client
+N_BINS = 480
 
-    app = tawf.Application([
+# maximum number of bins of sensor data sent to a client
+MAX_BINS = 10000
+
+# formats of binned sensor data, see `encode_data` function
+DATA_FORMATS = ('pairs', 'columns', 'delta')
+
+# aggregation functions supported when binning sensor data of multiple
+# sensors on one grid of bins
+GRID_AGG = ('mean', 'min', 'max', 'median', 'count')
+
+# formats of binned sensor data of multiple sensors, see `encode_grid`
+# function
+GRID_FORMATS = ('columns', 'delta')
+
+# maximum number of cached responses with binned sensor data
+N_RESPONSES = 128
+
+# compression level of responses with binned sensor data
+COMPRESS_LEVEL = 6
+
+# binary frame of live sensor data feed, see `encode_frame` function
+FEED_MAGIC = b'DF'
+FEED_HEADER = struct.Struct('<2sBxId')
+
+# data types of sensor data values of live sensor data feed
+FEED_DTYPES = {'f4': '<f4', 'f8': '<f8'}
+
+
+class ResponseCache(object):
+    """
+    Cache of responses with binned sensor data.
+
+    A response is valid until new sensor data value of its sensor is
+    written to data cache, which is checked with total number of values
+    written to the ring buffer of the sensor. The least recently used
+    responses are removed when the cache is full.
+    """
+    def __init__(self, maxsize=N_RESPONSES):
+        """
+        Create cache of responses.
+
+        :param maxsize: Maximum number of cached responses.
+        """
+        super().__init__()
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+
+    def get(self, key, count):
+        """
+        Get cached response or `None` if there is no valid response.
+
+        :param key: Response key.
+        :param count: Number of values written to ring buffer of sensor.
+        """
+        item = self._data.get(key)
+        if item is None or item[0] != count:
+            return None
+        self._data.move_to_end(key)
+        return item[1]
+
+
+    def put(self, key, count, body):
+        """
+        Put response into the cache.
+
+        :param key: Response key.
+        :param count: Number of values written to ring buffer of sensor
+            before the response was created.
+        :param body: Response body.
+        """
+        self._data[key] = count, body
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class DataHandler(tornado.web.RequestHandler):
+    """
+    Serve binned sensor data from data cache.
+
+    The response is compressed with gzip if a client accepts it. The
+    responses are cached until new sensor data value of a sensor is
+    received, when cache of responses is configured.
+
+    The following, optional query parameters are supported
+
+    `start`
+        Start of time range of sensor data.
+    `end`
+        End of time range of sensor data.
+    `bins`
+        Number of bins (default 480, at most 10000).
+    `agg`
+        Name of aggregation function - `mean` (default), `min`, `max`,
+        `median` or `count`; or name of downsampling function selecting
+        sensor data values - `lttb` or `minmax`.
+    `format`
+        Format of binned sensor data - `pairs` (default), `columns` or
+        `delta`, see `encode_data` function.
+    """
+    def initialize(self, cache, responses=None):
+        self.cache = cache
+        self.responses = responses
+
+
+    def get(self, sensor):
+        try:
+            data = self.cache[sensor]
+        except KeyError:
+            raise tornado.web.HTTPError(404)
+
+        start = self._query_value('start', float, None)
+        end = self._query_value('end', float, None)
+        bins = self._query_value('bins', int, N_BINS)
+        agg = self.get_query_argument('agg', 'mean')
+        format = self.get_query_argument('format', 'pairs')
+        if not 1 <= bins <= MAX_BINS:
+            raise tornado.web.HTTPError(400)
+        if agg not in AGG or format not in DATA_FORMATS:
+            raise tornado.web.HTTPError(400)
+
+        compress = self._accepts_gzip()
+
+        # read number of values before binning, so a response is never
+        # cached as valid for newer sensor data
+        count = data.count
+        key = (sensor, start, end, bins, agg, format, compress)
+        responses = self.responses
+        body = None if responses is None else responses.get(key, count)
+        if body is None:
+            times, values = bin_cache_columns(
+                self.cache, sensor, agg, bins, start, end
+            )
+            body = encode_data(times, values, format).encode()
+            if compress:
+                body = gzip.compress(body, COMPRESS_LEVEL)
+            if responses is not None:
+                responses.put(key, count, body)
+
+        self._write_body(body, compress)
+
+
+    def _write_body(self, body, compress):
+        self.set_header('Content-Type', 'application/json; charset=utf-8')
+        self.set_header('Vary', 'Accept-Encoding')
+        if compress:
+            self.set_header('Content-Encoding', 'gzip')
+        self.write(body)
+
+
+    def _accepts_gzip(self):
+        return 'gzip' in self.request.headers.get('Accept-Encoding', '')
+
+
+    def _query_value(self, name, type, default):
+        value = self.get_query_argument(name, None)
+        if value is None:
+            return default
+        try:
+            return type(value)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+
+
+class GridHandler(DataHandler):
+    """
+    Serve binned sensor data of all sensors from data cache in one
+    response.
+
+    Sensor data of all sensors is binned on one grid of bins in one pass,
+    so the sensor data is aligned in time, see
+    `dshrub.data.bin_cache_grid` function. The response is compressed and
+    cached as with `DataHandler` class; a response is valid until new
+    sensor data value of any of the sensors is received, so concurrent
+    requests share the result of binning.
+
+    The following, optional query parameters are supported
+
+    `sensor`
+        Name of a sensor, can be repeated; all sensors by default.
+    `start`
+        Start of time range of sensor data.
+    `end`
+        End of time range of sensor data.
+    `bins`
+        Number of bins (default 480, at most 10000).
+    `agg`
+        Name of aggregation function - `mean` (default), `min`, `max`,
+        `median` or `count`.
+    `format`
+        Format of binned sensor data - `columns` (default) or `delta`, see
+        `encode_grid` function.
+    """
+    def initialize(self, cache, sensors, responses=None):
+        self.cache = cache
+        self.sensors = sensors
+        self.responses = responses
+
+
+    def get(self):
+        sensors = self.get_query_arguments('sensor') or self.sensors
+        if any(s not in self.sensors for s in sensors):
+            raise tornado.web.HTTPError(404)
+
+        start = self._query_value('start', float, None)
+        end = self._query_value('end', float, None)
+        bins = self._query_value('bins', int, N_BINS)
+        agg = self.get_query_argument('agg', 'mean')
+        format = self.get_query_argument('format', 'columns')
+        if not 1 <= bins <= MAX_BINS:
+            raise tornado.web.HTTPError(400)
+        if agg not in GRID_AGG or format not in GRID_FORMATS:
+            raise tornado.web.HTTPError(400)
+
+        compress = self._accepts_gzip()
+        count = tuple(self.cache[s].count for s in sensors)
+        key = (tuple(sensors), start, end, bins, agg, format, compress)
+        responses = self.responses
+        body = None if responses is None else responses.get(key, count)
+        if body is None:
+            times, values = bin_cache_grid(
+                self.cache, sensors, agg, bins, start, end
+            )
+            body = encode_grid(times, values, format).encode()
+            if compress:
+                body = gzip.compress(body, COMPRESS_LEVEL)
+            if responses is not None:
+                responses.put(key, count, body)
+
+        self._write_body(body, compress)
+
+
+class HistoryHandler(tornado.web.RequestHandler):
+    """
+    Serve binned historical sensor data from archive of data log files.
+
+    The binned sensor data is sent in pieces, as data log files are read.
+
+    The following query parameters are supported
+
+    `start`
+        Start of time range of sensor data (required).
+    `end`
+        End of time range of sensor data (required).
+    `bins`
+        Number of bins (default 480, at most 10000).
+    `agg`
+        Name of aggregation function - `mean` (default), `min`, `max` or
+        `count`.
+    """
+    def initialize(self, archive):
+        self.archive = archive
+
+
+    async def get(self, sensor):
+        try:
+            start = float(self.get_query_argument('start'))
+            end = float(self.get_query_argument('end'))
+            bins = int(self.get_query_argument('bins', N_BINS))
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        agg = self.get_query_argument('agg', 'mean')
+        if not 1 <= bins <= MAX_BINS:
+            raise tornado.web.HTTPError(400)
+        if start >= end or agg not in HISTORY_AGG:
+            raise tornado.web.HTTPError(400)
+
+        loop = asyncio.get_event_loop()
+        pieces = bin_history(self.archive, sensor, agg, bins, start, end)
+        self.set_header('Content-Type', 'application/json; charset=utf-8')
+        self.write('[')
+
+        sep = ''
+        while True:
+            # read data log files in a separate thread
+            data = await loop.run_in_executor(None, next, pieces, None)
+            if data is None:
+                break
+            if data:
+                self.write(sep + json.dumps(data)[1:-1])
+                sep = ','
+                await self.flush()
+
+        self.write(']')
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """
+    Serve snapshot of runtime metrics as JSON.
+    """
+    def initialize(self, metrics):
+        self.metrics = metrics
+
+
+    def get(self):
+        self.set_header('Content-Type', 'application/json; charset=utf-8')
+        self.write(json.dumps(self.metrics.snapshot()))
+
+
+class StatsHandler(tornado.web.RequestHandler):
+    """
+    Serve rolling statistics of sensor data as JSON.
+    """
+    def initialize(self, stats):
+        self.stats = stats
+
+
+    def get(self):
+        self.set_header('Content-Type', 'application/json; charset=utf-8')
+        self.write(json.dumps(self.stats.snapshot()))
+
+
+class FeedHandler(tornado.websocket.WebSocketHandler):
+    """
+    Send live sensor data to a client as binary WebSocket frames.
+
+    When a client connects, a JSON message with list of sensors is sent.
+    Position of a sensor in the list is its id used in the binary frames.
+    Then each batch of sensor data is sent as one binary frame, see
+    `encode_frame` function.
+
+    The following, optional query parameter is supported
+
+    `dtype`
+        Data type of sensor data values - `f8` (default) for 64-bit
+        floats or `f4` for 32-bit floats.
+    """
+    def initialize(self, sensors, broadcast):
+        self.sensors = sensors
+        self.broadcast = broadcast
+        self._index = {s: i for i, s in enumerate(sensors)}
+        self._task = None
+
+
+    def prepare(self):
+        self.dtype = FEED_DTYPES.get(self.get_query_argument('dtype', 'f8'))
+        if self.dtype is None:
+            raise tornado.web.HTTPError(400)
+
+
+    def open(self):
+        self.write_message(json.dumps({'sensors': self.sensors}))
+        self._task = asyncio.ensure_future(self._send())
+
+
+    def on_close(self):
+        if self._task:
+            self._task.cancel()
+
+
+    async def _send(self):
+        with self.broadcast.subscribe() as queue:
+            async for items in queue:
+                frame = encode_frame(items, self._index, self.dtype)
+                if frame is None:
+                    continue
+                try:
+                    await self.write_message(frame, binary=True)
+                except tornado.websocket.WebSocketClosedError:
+                    return
+
+        # the subscriber is disconnected on queue overflow
+        self.close()
+
+
+def encode_frame(items, index, dtype='<f8'):
+    """
+    Encode batch of sensor data as binary frame of live sensor data feed.
+
+    The frame consists of
+
+    - header with `DF` magic bytes, size of sensor data value, number of
+      sensor data values and base time, which is time of the first sensor
+      data value
+    - array of 16-bit unsigned integer sensor ids, padded to 4 bytes
+    - array of 32-bit float sensor data time deltas from the base time,
+      padded to 8 bytes
+    - array of 32-bit or 64-bit float sensor data values
+
+    The arrays are little-endian and aligned, so a client can decode them
+    with typed arrays without copying.
+
+    Sensor data items of sensors not in the index and sensor data items
+    with vector values are skipped. If there is no sensor data to send,
+    then `None` is returned.
+
+    :param items: Batch of sensor data items, see `dshrub.data.Cache.add`.
+    :param index: Dictionary of sensor ids.
+    :param dtype: Data type of sensor data values.
+    """
+    rows = [v for item in items for v in _feed_values(item, index)]
+    if not rows:
+        return None
+
+    ids, times, values = zip(*rows)
+    ids = np.array(ids, dtype='<u2')
+    times = np.array(times, dtype=np.float64)
+    values = np.array(values, dtype=dtype)
+    t0 = times[0]
+    n = len(ids)
+
+    header = FEED_HEADER.pack(FEED_MAGIC, values.itemsize, n, t0)
+    deltas = (times - t0).astype('<f4')
+
+    # align arrays of time deltas and values
+    offset = len(header) + ids.nbytes
+    pad_ids = bytes(-offset % 4)
+    offset += len(pad_ids) + deltas.nbytes
+    pad_deltas = bytes(-offset % 8)
+
+    return b''.join([
+        header, ids.tobytes(), pad_ids, deltas.tobytes(), pad_deltas,
+        values.tobytes(),
+    ])
+
+
+def encode_data(times, values, format='pairs'):
+    """
+    Encode binned sensor data as JSON document.
+
+    The following formats are supported
+
+    `pairs`
+        List of `[time, value]` pairs.
+    `columns`
+        Object with `time` and `value` lists.
+    `delta`
+        Object with `time` and `value` lists, where the first time is
+        integer number of milliseconds since epoch and the other times
+        are integer differences in milliseconds from the previous time.
+
+    :param times: Array of sensor data times.
+    :param values: Array of sensor data values.
+    :param format: Format of binned sensor data.
+    """
+    if format == 'pairs':
+        data = np.column_stack((times, values)).tolist()
+    else:
+        data = {'time': _encode_times(times, format), 'value': values.tolist()}
+    return json.dumps(data)
+
+
+def encode_grid(times, values, format='columns'):
+    """
+    Encode binned sensor data of multiple sensors as JSON document.
+
+    The document is an object with `time` list of start times of the bins
+    and `value` object with list of sensor data values for each sensor.
+    Missing sensor data values are `null`. The times are encoded as with
+    `encode_data` function.
+
+    :param times: Array of start times of the bins.
+    :param values: Dictionary of arrays of sensor data values.
+    :param format: Format of binned sensor data - `columns` or `delta`.
+    """
+    data = {
+        'time': _encode_times(times, format),
+        'value': {
+            n: np.where(np.isnan(v), None, v).tolist()
+            for n, v in values.items()
+        },
+    }
+    return json.dumps(data)
+
+
+def _encode_times(times, format):
+    if format == 'columns':
+        return times.tolist()
+    elif format == 'delta':
+        ms = np.round(times * 1000).astype(np.int64)
+        ms[1:] = np.diff(ms)
+        return ms.tolist()
+    else:
+        raise ValueError('Format {} not supported'.format(format))
+
+
+def _feed_values(item, index):
+    if isinstance(item, dict):
+        name, time, value = item['name'], item['time'], item['value']
+    else:
+        name, time, value = item.name, item.time, item.value
+
+    i = index.get(name)
+    if i is None:
+        return ()
+    elif isinstance(item, Batch):
+        if np.ndim(value) != 1:
+            return ()
+        return zip(repeat(i), time.tolist(), value.tolist())
+    elif np.ndim(value) != 0:
+        return ()
+    else:
+        return [(i, time, value)]
+
+
+def expand_batch(item, callback):
+    """
+    Send batch of sensor data values to a client as separate sensor data
+    items.
+
+    :param item: Batch of sensor data values.
+    :param callback: Function sending sensor data item to the client.
+    """
+    name, clock = item.name, item.clock
+    for t, v in zip(item.time.tolist(), item.value.tolist()):
+        callback({'name': name, 'clock': clock, 'time': t, 'value': v})
+
+
+def create_app(sensors, broadcast, cache, path, refresh=1, host='0.0.0.0',
+        port=8090, archive=None, metrics=None, stats=None):
+
+    responses = ResponseCache()
+    handlers = [
+        (
+            r'/data/all', GridHandler,
+            {'cache': cache, 'sensors': sensors, 'responses': responses}
+        ),
+        (
+            r'/data/([^/]+)', DataHandler,
+            {'cache': cache, 'responses': responses}
+        ),
+        (r'/feed', FeedHandler, {'sensors': sensors, 'broadcast': broadcast}),
+    ]
+    if archive:
+        handlers.append(
+            (r'/history/([^/]+)', HistoryHandler, {'archive': archive})
+        )
+    if metrics:
+        handlers.append((r'/metrics', MetricsHandler, {'metrics': metrics}))
+    if stats:
+        handlers.append((r'/stats', StatsHandler, {'stats': stats}))
+
+    app = tawf.Application(handlers + [
         (r'/(.*)', tornado.web.StaticFileHandler, {'path': path}),
     ])
 
@@ -41,18 +581,34 @@ def create_app(sensors, topic, cache, path, refresh=1, host='0.0.0.0',
     def conf():
         return config
 
-    @app.route('/data/{sensor}', mimetype='application/json')
-    def data(sensor):
-        data = cache[sensor]
-        return bin_data(data, 'mean', 480)
-
     @app.sse('/data', mimetype='application/json')
     async def data(callback):
-        while True:
-            items = await topic.get()
-            for item in items:
-                callback(item._asdict())
+        with broadcast.subscribe() as queue:
+            async for items in queue:
+                for item in items:
+                    if isinstance(item, Batch):
+                        expand_batch(item, callback)
+                    else:
+                        callback(item._asdict())
+
+    app.listen(port, address=host)
+
+
+def create_metrics_app(metrics, host='0.0.0.0', port=8091, stats=None):
+    """
+    Serve runtime metrics on `/metrics` endpoint, and rolling statistics
+    of sensor data on `/stats` endpoint, when dashboard application is not
+    started.
 
+    :param metrics: Registry of metrics.
+    :param host: Address to listen on.
+    :param port: Port to listen on.
+    :param stats: Optional rolling statistics of sensor data.
+    """
+    handlers = [(r'/metrics', MetricsHandler, {'metrics': metrics})]
+    if stats:
+        handlers.append((r'/stats', StatsHandler, {'stats': stats}))
+    app = tornado.web.Application(handlers)
     app.listen(port, address=host)
 
 
@@ -32,7 +32,7 @@ setup(
     url='https://github.com/wrobell/dshrub',
     setup_requires = ['setuptools_git >= 1.0',],
     packages=find_packages('.'),
-    scripts=('bin/dshrub', 'bin/dshrub-dashboard'),
+    scripts=('bin/dshrub', 'bin/dshrub-dashboard', 'bin/dshrub-bench'),
     include_package_data=True,
     long_description=\
 """\
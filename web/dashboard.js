@@ -1,6 +1,22 @@
+// sensor names can be qualified with device name or address,
+// i.e. kitchen.temperature, so escape them for use as element id
+function element_id(name) {
+    return name.replace(/[^A-Za-z0-9_-]/g, '_');
+}
+
+// maximum number of sensor data values kept by a view
+var N_DATA = 24 * 3600;
+
+// delays of reconnecting to live sensor data feed, in milliseconds
+var FEED_RETRY = 500;
+var FEED_RETRY_MAX = 30000;
+
+// sensor data is kept in ring buffer of preallocated arrays of times, in
+// milliseconds, and values; the plot is redrawn at most once per animation
+// frame
 function DataView(name) {
     this.name = name;
-    this.div_id = '#plot-' + name;
+    this.div_id = '#plot-' + element_id(name);
     this.plot_params = {
         xaxis: {mode: 'time'},
         'shadowSize': 0,
@@ -11,59 +27,242 @@ function DataView(name) {
             'radius': 2,
         },
     };
-    this.plot = $.plot($('#plot-' + name), [[]], this.plot_params);
-    this.data = new Array();
+    this.plot = $.plot($(this.div_id), [[]], this.plot_params);
+    this.times = new Float64Array(N_DATA);
+    this.values = new Float64Array(N_DATA);
+    this.pos = 0;
+    this.size = 0;
+    this.pending = false;
 }
 
 DataView.prototype.add = function(x, y) {
-    this.data.push([x, y]);
-    if (this.data.length > 24 * 3600)
-        this.data.shift();
+    this.times[this.pos] = x;
+    this.values[this.pos] = y;
+    this.pos = (this.pos + 1) % N_DATA;
+    if (this.size < N_DATA)
+        this.size++;
+}
+
+DataView.prototype.clear = function() {
+    this.pos = 0;
+    this.size = 0;
 }
 
 DataView.prototype.draw = function() {
-    this.plot.setData([this.data]);
+    if (this.pending)
+        return;
+    this.pending = true;
+
+    var view = this;
+    window.requestAnimationFrame(function() {
+        view.pending = false;
+        view.render();
+    });
+}
+
+DataView.prototype.render = function() {
+    this.plot.setData([decimate(this, this.plot.width())]);
     this.plot.setupGrid();
     this.plot.draw();
 }
 
+// decimate sensor data of a view to minimum and maximum value per pixel
+// column of a plot, so spikes of sensor data values stay visible
+function decimate(view, width) {
+    var times = view.times;
+    var values = view.values;
+    var maxsize = times.length;
+    var n = view.size;
+    var start = (view.pos - n + maxsize) % maxsize;
+    var result = [];
+    var i, k;
+
+    if (n <= 2 * width) {
+        for (k = 0; k < n; k++) {
+            i = (start + k) % maxsize;
+            result.push([times[i], values[i]]);
+        }
+        return result;
+    }
+
+    var t0 = Infinity;
+    var t1 = -Infinity;
+    for (k = 0; k < n; k++) {
+        i = (start + k) % maxsize;
+        t0 = Math.min(t0, times[i]);
+        t1 = Math.max(t1, times[i]);
+    }
+
+    var scale = width / (t1 - t0 || 1);
+    var column = -1;
+    var i_min, i_max;
+    for (k = 0; k < n; k++) {
+        i = (start + k) % maxsize;
+        var c = Math.min(Math.floor((times[i] - t0) * scale), width - 1);
+        if (c != column) {
+            if (column >= 0)
+                push_range(result, times, values, i_min, i_max);
+            column = c;
+            i_min = i_max = i;
+        }
+        else if (values[i] < values[i_min])
+            i_min = i;
+        else if (values[i] > values[i_max])
+            i_max = i;
+    }
+    push_range(result, times, values, i_min, i_max);
+    return result;
+}
+
+// add minimum and maximum value of a pixel column in time order
+function push_range(result, times, values, i, j) {
+    if (times[j] < times[i]) {
+        var k = i;
+        i = j;
+        j = k;
+    }
+    result.push([times[i], values[i]]);
+    if (i != j)
+        result.push([times[j], values[j]]);
+}
+
 function create_view(name) {
+    var id = element_id(name);
     $('#dashboard').append(
-        '<div id="panel-' + name + '" class="data-plot">'
+        '<div id="panel-' + id + '" class="data-plot">'
         + '<div class="title"></div>'
         + '<div>'
         + '<div class="value"></div>'
-        + '<div id="plot-' + name + '" class="plot"></div>'
+        + '<div id="plot-' + id + '" class="plot"></div>'
         + '</div>'
         + '</div>'
     );
     return new DataView(name);
 }
 
-function plot_add_item(plot, item) {
-    x = new Date(item[0] * 1000);
-    y = item[1];
-    plot.add(x, y);
-}
-
 function panel_set_item_value(name, item) {
-    $('div#panel-' + name + ' div.value').html(
+    $('div#panel-' + element_id(name) + ' div.value').html(
         Math.round(item['value'] * 1000) / 1000
     );
 }
 
-function panel_initial_data(data) {
-    size = data.length;
-    console.log(
-        'received initial data for ' + this.name + ', size=' + size
-    );
-    plot = this.plot;
-    data.forEach(function(item, index, data) {
-        plot_add_item(plot, item);
+// initial data of all sensors is requested in `delta` format, on one
+// grid of bins - the first time is in milliseconds since epoch and the
+// other times are differences in milliseconds from the previous time;
+// bins without sensor data values are null
+function panels_initial_data(plots, data) {
+    var n = data['time'].length;
+    var times = new Float64Array(n);
+    var t = 0;
+    for (var i = 0; i < n; i++) {
+        t += data['time'][i];
+        times[i] = t;
+    }
+
+    for (var name in data['value']) {
+        var plot = plots[name];
+        var values = data['value'][name];
+        var last = null;
+        if (plot === undefined)
+            continue;
+
+        for (var i = 0; i < n; i++) {
+            if (values[i] === null)
+                continue;
+            plot.add(times[i], values[i]);
+            last = values[i];
+        }
+        console.log('received initial data for ' + name + ', size=' + n);
+        if (last !== null)
+            panel_set_item_value(name, {'value': last});
+        plot.draw();
+    }
+}
+
+// load binned sensor data of all sensors, replacing sensor data of the
+// views
+function load_data(plots) {
+    $.ajax({
+        url: '/data/all?format=delta',
+        success: function(data) {
+            for (var name in plots)
+                plots[name].clear();
+            panels_initial_data(plots, data);
+        }
     });
-    if (size > 0)
-        panel_set_item_value(this.name, data[size - 1]);
-    this.plot.draw();
+}
+
+function align(offset, k) {
+    return Math.ceil(offset / k) * k;
+}
+
+// decode binary frame of live sensor data feed into typed arrays of
+// sensor ids, time deltas from the base time and values; the arrays are
+// views of the frame, see dshrub.ws.encode_frame
+function decode_frame(buffer) {
+    var size = new Uint8Array(buffer, 2, 1)[0];
+    var n = new Uint32Array(buffer, 4, 1)[0];
+    var t0 = new Float64Array(buffer, 8, 1)[0];
+
+    var offset = 16;
+    var ids = new Uint16Array(buffer, offset, n);
+    offset = align(offset + ids.byteLength, 4);
+    var deltas = new Float32Array(buffer, offset, n);
+    offset = align(offset + deltas.byteLength, 8);
+    var values = size == 4
+        ? new Float32Array(buffer, offset, n)
+        : new Float64Array(buffer, offset, n);
+    return {'t0': t0, 'ids': ids, 'deltas': deltas, 'values': values};
+}
+
+// read live sensor data from binary WebSocket feed; ids of sensors are
+// positions in sensor list sent on connection
+//
+// when the connection is closed, i.e. on dashboard restart, reconnect
+// with exponential backoff; `delay` is the delay of the reconnection and
+// sensor data sent while disconnected is loaded again on reconnection
+function connect_feed(plots, delay) {
+    var scheme = location.protocol == 'https:' ? 'wss://' : 'ws://';
+    var socket = new WebSocket(scheme + location.host + '/feed?dtype=f4');
+    var sensors = [];
+    var connected = false;
+    socket.binaryType = 'arraybuffer';
+
+    socket.onclose = function() {
+        var next = FEED_RETRY;
+        if (!connected && delay !== undefined)
+            next = Math.min(2 * delay, FEED_RETRY_MAX);
+        console.log('data feed closed, reconnecting in ' + next + 'ms');
+        window.setTimeout(function() { connect_feed(plots, next); }, next);
+    };
+
+    socket.onmessage = function(event) {
+        if (typeof event.data === 'string') {
+            sensors = JSON.parse(event.data)['sensors'];
+            connected = true;
+            console.log('connected to data feed');
+            if (delay !== undefined)
+                load_data(plots);
+            return;
+        }
+
+        var frame = decode_frame(event.data);
+        var last = {};
+        for (var i = 0; i < frame.ids.length; i++) {
+            var name = sensors[frame.ids[i]];
+            var plot = plots[name];
+            if (plot === undefined)
+                continue;
+            var t = frame.t0 + frame.deltas[i];
+            plot.add(t * 1000, frame.values[i]);
+            last[name] = frame.values[i];
+        }
+        for (var name in last) {
+            panel_set_item_value(name, {'value': last[name]});
+            plots[name].draw();
+        }
+    };
+    return socket;
 }
 
 // vim: sw=4:et:ai